@@ -1,3 +1,6 @@
+-- The base schema. Indexes and later changes are applied on top of it by src/migrations.py when the bot starts, which also
+-- creates it (migrations.BASE_SCHEMA) in a new database
+
 -- A single course
 CREATE TABLE courses (
   dept TEXT NOT NULL, -- Dept code. Ex: AE, ECE, ME
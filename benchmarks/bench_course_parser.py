@@ -0,0 +1,119 @@
+"""Benchmark of the course string parser against the original Course class
+
+Measures how many course strings per second each one turns into Course objects, both for a term-start mix
+(a few popular strings repeated many times) and for strings that are all different (every one a cache miss).
+Run from the repository root:
+    python benchmarks/bench_course_parser.py [--tokens 100000]
+"""
+
+import argparse, os, random, re, sys, time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+
+import course
+
+################################ Old Parser ################################
+# The original Semester and Course parsing, kept here for comparison
+
+class OldSemester:
+    def __init__(self, year, semester):
+        self.semester = semester
+        self.year = year
+        self.year_short = year[2:4]
+        self.update_other_semeseter_parameters()
+
+    def update_other_semeseter_parameters(self):
+        if self.semester == "Spring":
+            self.semester_short = "Sp"
+            self.semester_sort = "1"
+        elif self.semester == "Summer":
+            self.semester_short = "Su"
+            self.semester_sort = "2"
+        elif self.semester == "Fall":
+            self.semester_short = "F"
+            self.semester_sort = "3"
+
+    def update_year(self, year):
+        if len(year) == 2:
+            self.year = "20"
+        self.year += year
+        self.year_short = self.year[2:4]
+
+    def update_semester(self, semester):
+        if len(semester) == 1 and semester[0] == "F":
+            self.semester = "Fall"
+        elif len(semester) == 2 and semester[0] == "S":
+            if semester[1] == "P":
+                self.semester = "Spring"
+            elif semester[1] == "U":
+                self.semester = "Summer"
+        self.update_other_semeseter_parameters()
+
+class OldCourse:
+    def __init__(self, course_string, current_year = "", current_semester = ""):
+        self.raw_string = course_string
+        self.is_possible = False
+        self.is_special_topic = False
+        self.dept = ""
+        self.code = ""
+        self.topic = "0"
+        self.title = ""
+        self.semester = OldSemester(current_year, current_semester)
+        course_components = course_string.split('-')
+        if len(course_components) > 0:
+            dept_course = re.findall(r'\d+|\D+', course_components[0])
+            if len(dept_course) == 2:
+                self.dept = dept_course[0].strip().upper()
+                self.code = dept_course[1].strip()
+                self.topic = "0"
+                self.is_possible = True
+            if len(course_components) == 2:
+                course_component = re.findall(r'\d+|\D+', course_components[1])
+                if len(course_component) == 1:
+                    self.topic = course_component[0].upper()
+                    self.is_special_topic = True
+                elif len(course_component) == 2:
+                    self.semester.update_semester(course_component[0])
+                    self.semester.update_year(course_component[1])
+            elif len(course_components) == 3:
+                self.topic = course_components[1].upper()
+                self.is_special_topic = True
+                semester_year = re.findall(r'\d+|\D+', course_components[2])
+                self.semester.update_semester(semester_year[0])
+                self.semester.update_year(semester_year[1])
+
+################################ Benchmark ################################
+
+def term_start_tokens(count):
+    """A few dozen popular courses, requested over and over"""
+
+    popular = ["AE" + str(1000 + i) for i in range(40)] + ["AE8803-NON", "AE8803-ROB-SP22", "ECE2020-F21"]
+    return [random.choice(popular) for _ in range(count)]
+
+def distinct_tokens(count):
+    """Every string different, so nothing can come from a cache"""
+
+    return ["CS" + str(10000 + i) + ("-SP22" if i % 3 == 0 else "") for i in range(count)]
+
+def tokens_per_second(make_course, tokens):
+    start = time.perf_counter()
+    for token in tokens:
+        make_course(token, "2021", "Fall")
+    return len(tokens) / (time.perf_counter() - start)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tokens", type=int, default=100000, help="course strings parsed per run")
+    args = parser.parse_args()
+
+    random.seed(0)
+    print("{:<14}{:>16}{:>16}{:>10}".format("tokens", "old (per s)", "new (per s)", "speedup"))
+    for name, tokens in [("term start", term_start_tokens(args.tokens)), ("all distinct", distinct_tokens(args.tokens))]:
+        course._parse_normalized.cache_clear()
+        old = tokens_per_second(OldCourse, tokens)
+        new = tokens_per_second(course.Course, tokens)
+        print("{:<14}{:>16,.0f}{:>16,.0f}{:>9.2f}x".format(name, old, new, new / old))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""Micro-benchmark of the parameterized queries against the old string-built ones
+
+Builds a temporary database from GT.sql, fills it with a catalog and registrations, then times each query
+both ways. Run from the repository root:
+    python benchmarks/bench_queries.py [--courses 2000] [--iterations 20000]
+"""
+
+import argparse, os, sqlite3, sys, tempfile, timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+
+import queries, migrations
+from course import Course
+
+################################ Old Queries ################################
+# The string-built queries that used to live in buzz-bot.py, kept here for comparison
+
+def old_get_course_available(conn, course : Course):
+    sql = "SELECT * FROM registrar WHERE dept='" + course.dept + "' AND course='" + course.code + "' "
+    sql += "AND topic='" + course.topic + "' AND year='" + course.semester.year + "' AND semester='" + course.semester.semester + "'"
+    return conn.execute(sql).fetchall()
+
+def old_get_course_requested(conn, course : Course):
+    sql = "SELECT * FROM requests WHERE dept='" + course.dept + "' AND course='" + course.code + "'"
+    sql += " AND topic='" + course.topic + "' AND year='" + course.semester.year + "' AND semester='" + course.semester.semester + "'"
+    return conn.execute(sql).fetchall()
+
+def old_join_course(conn, user, username, category_id):
+    sql = "INSERT INTO schedule (user, username, category_id) VALUES('" + str(user) + "', '" + username + "', '" + str(category_id) + "')"
+    conn.execute(sql)
+
+def old_request_course(conn, course : Course, user, username):
+    sql = "INSERT INTO requests (dept, course, topic, year, semester, user, username) "
+    sql += " VALUES('" + course.dept  + "', '" + course.code  + "', '" + course.topic + "', '"
+    sql += course.semester.year + "', '" + course.semester.semester + "', '"
+    sql += str(user) + "', '" + username + "')"
+    conn.execute(sql)
+
+################################ Benchmark ################################
+
+def build_database(path, course_count):
+    """Create the schema from GT.sql and fill it with courses, registrations and requests"""
+
+    conn = sqlite3.connect(path)
+    with open(os.path.join(ROOT, "GT.sql")) as schema:
+        conn.executescript(schema.read())
+    migrations.migrate(conn)
+
+    courses = [Course("AE" + str(1000 + i), "2021", "Fall") for i in range(course_count)]
+    with conn:
+        conn.executemany("INSERT INTO courses VALUES (?, ?, ?, ?, 0)", [(c.dept, c.code, c.topic, "Course " + c.code) for c in courses])
+        # Half the courses are registered, the other half requested
+        for i, c in enumerate(courses):
+            if i % 2 == 0:
+                queries.create_course_registration(conn, c, i + 1, 1)
+            else:
+                queries.request_course(conn, c, i + 1, "user" + str(i))
+    return conn, courses
+
+def time_per_call(function, iterations):
+    """Return the mean time of a call in microseconds"""
+
+    return timeit.timeit(function, number=iterations) / iterations * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--courses", type=int, default=2000, help="number of courses in the catalog")
+    parser.add_argument("--iterations", type=int, default=20000, help="calls timed per query")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        conn, courses = build_database(os.path.join(directory, "GT.db"), args.courses)
+        registered = courses[::2]
+        requested = courses[1::2]
+        position = {"i": 0}
+
+        def next_of(items):
+            position["i"] += 1
+            return items[position["i"] % len(items)]
+
+        comparisons = [
+            ("course available",
+                lambda: old_get_course_available(conn, next_of(registered)),
+                lambda: queries.get_courses_available(conn, [next_of(registered)])),
+            ("course requested",
+                lambda: old_get_course_requested(conn, next_of(requested)),
+                lambda: queries.get_courses_requested(conn, [next_of(requested)])),
+            ("join course",
+                lambda: old_join_course(conn, 1, "user", next_of(range(1 << 30))),
+                lambda: queries.join_course(conn, 1, "user", next_of(range(1 << 30)))),
+            ("request course",
+                lambda: old_request_course(conn, next_of(courses), 2, "user"),
+                lambda: queries.request_course(conn, next_of(courses), 2, "user")),
+        ]
+
+        print("{:<20}{:>14}{:>18}{:>10}".format("query", "string (us)", "parameterized (us)", "speedup"))
+        for name, old, new in comparisons:
+            old_time = time_per_call(old, args.iterations)
+            new_time = time_per_call(new, args.iterations)
+            print("{:<20}{:>14.2f}{:>18.2f}{:>9.2f}x".format(name, old_time, new_time, old_time / new_time))
+
+        conn.rollback() # the writes were only for timing
+        conn.close()
+
+if __name__ == "__main__":
+    main()
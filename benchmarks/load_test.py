@@ -0,0 +1,416 @@
+"""Load test of the !add, !join and !register commands against a fake Discord guild
+
+Imports the real bot (src/buzz-bot.py) against a temporary database built from GT.sql and a generated catalog,
+then drives its command coroutines with in-process stand-ins for discord.py's Guild, Member, Context and
+channels. Every Discord call the bot makes sleeps for a simulated REST latency and waits on Discord-like rate
+limit buckets (per route and global) the way discord.py does, and channel creation fires the bot's channel events.
+
+The load is the first hour of term compressed: a few admins !add missing courses, then every student arrives (at
+--arrival-rate per second) and does !join, then they all arrive again and !register for --courses-each courses,
+picked from the --popular most popular ones with a Zipf distribution so many requests collide and create groups.
+Each phase runs until the bot's action queue has drained, then reports throughput, p50/p99 command latency, and
+database queries and Discord calls per command. Replies to commands share one channel's rate limit (5 messages
+every 5 seconds), like they do on Discord, so a full run takes a few minutes. With --overflow, a small --channel-limit
+shows course groups spilling into overflow guilds (see OVERFLOW_GUILDS). Needs the packages in requirements.txt.
+Run from the repository root:
+    python benchmarks/load_test.py [--students 200] [--arrival-rate 10] [--latency 0.08] [--deferred]
+"""
+
+import argparse, asyncio, collections, importlib.util, os, random, sqlite3, sys, tempfile, time, warnings
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+
+import discord
+
+DEPARTMENTS = ["AE", "BMED", "CEE", "CHBE", "CS", "ECE", "ISYE", "MATH", "ME", "MSE", "PHYS", "PSYC"]
+
+################################ Fake Discord ################################
+# Just enough of discord.py's models for the bot's command paths. Every REST call goes through FakeREST
+
+class FakeREST:
+    """Simulated Discord API: a latency per call and rate limit buckets that make callers wait like discord.py does"""
+
+    def __init__(self, latency : float, rate = 5, per = 5.0, global_rate = 50):
+        self.latency = latency
+        self.rate = rate
+        self.per = per
+        self.global_rate = global_rate
+        self.buckets = {} # route -> times of the calls in the current window
+        self.global_calls = collections.deque()
+        self.calls = collections.Counter() # kind -> number of calls
+        self.rate_limit_waits = 0 # calls that had to wait for a bucket
+        self.in_flight = 0
+
+    async def _wait(self, calls : collections.deque, limit : int, window : float):
+        waited = False
+        while True:
+            now = time.monotonic()
+            while calls and now - calls[0] >= window:
+                calls.popleft()
+            if len(calls) < limit:
+                calls.append(now)
+                return waited
+            waited = True
+            await asyncio.sleep(window - (now - calls[0]))
+
+    async def call(self, kind : str, route, result = None):
+        """Make one API call of the given kind (ie "create_category") on a rate limit route (ie ("guild", id))"""
+
+        self.in_flight += 1
+        try:
+            self.calls[kind] += 1
+            waited = await self._wait(self.buckets.setdefault(route, collections.deque()), self.rate, self.per)
+            waited = await self._wait(self.global_calls, self.global_rate, 1.0) or waited
+            if waited:
+                self.rate_limit_waits += 1
+            await asyncio.sleep(random.uniform(0.5, 1.5) * self.latency)
+            return result
+        finally:
+            self.in_flight -= 1
+
+
+class FakeRole:
+    def __init__(self, id : int, name : str):
+        self.id = id
+        self.name = name
+        self.mention = "<@&" + str(id) + ">"
+
+    def __hash__(self):
+        return hash(self.id)
+
+
+class FakeMember:
+    def __init__(self, guild, id : int, name : str):
+        self.guild = guild
+        self.id = id
+        self.name = name
+        self.display_name = name
+        self.mention = "<@" + str(id) + ">"
+        self.bot = False
+        self._roles = discord.utils.SnowflakeList([])
+
+    def __hash__(self):
+        return hash(self.id)
+
+    @property
+    def roles(self):
+        return [self.guild.default_role] + [self.guild.get_role(role_id) for role_id in self._roles]
+
+    async def add_roles(self, *roles):
+        await self.guild.rest.call("add_roles", ("guild", self.guild.id))
+        for role in roles:
+            if role is not None and not self._roles.has(role.id):
+                self._roles.add(role.id)
+
+
+class FakeMessage:
+    def __init__(self, channel, content : str, author = None):
+        self.channel = channel
+        self.content = content
+        self.author = author
+        self.guild = channel.guild
+        self.attachments = []
+        self.edited = asyncio.get_event_loop().create_future()
+
+    async def edit(self, content = None):
+        await self.channel.guild.rest.call("edit_message", ("channel", self.channel.id))
+        self.content = content
+        if not self.edited.done():
+            self.edited.set_result(time.perf_counter())
+
+
+class FakeChannel:
+    def __init__(self, guild, id : int, name : str, category = None, overwrites = None):
+        self.guild = guild
+        self.id = id
+        self.name = name
+        self.category = category
+        self.mention = "<#" + str(id) + ">"
+        self.overwrites = dict(overwrites or {})
+        self.channels = [] # only used by categories
+
+    def __hash__(self):
+        return hash(self.id)
+
+    async def send(self, content):
+        await self.guild.rest.call("send_message", ("channel", self.id))
+        return FakeMessage(self, content)
+
+    async def set_permissions(self, target, overwrite = None):
+        await self.guild.rest.call("set_permissions", ("channel", self.id))
+        if overwrite is None:
+            self.overwrites.pop(target, None)
+        else:
+            self.overwrites[target] = overwrite
+
+    async def create_invite(self, max_age = 0, unique = True, reason = None):
+        return await self.guild.rest.call("create_invite", ("channel", self.id), FakeInvite("https://discord.gg/" + str(self.id)))
+
+    async def edit(self, overwrites = None):
+        await self.guild.rest.call("edit_channel", ("channel", self.id))
+        if overwrites is not None:
+            self.overwrites = dict(overwrites)
+
+    async def delete(self):
+        await self.guild.rest.call("delete_channel", ("channel", self.id))
+        self.guild._remove_channel(self)
+
+
+class FakeInvite:
+    def __init__(self, url : str):
+        self.url = url
+
+
+class FakeGuild:
+    def __init__(self, rest : FakeREST, bot_module, id = 1, name = "Load Test", channel_names = ("welcome", "course-requests", "bot-testing", "general")):
+        self.rest = rest
+        self.bot_module = bot_module # to fire the channel events the gateway would
+        self.id = id
+        self.name = name
+        self.unavailable = False
+        self.system_channel = None
+        self.next_id = id * 1000000 # every guild's IDs are different
+        self.default_role = FakeRole(self.id, "@everyone")
+        self.roles = [self.default_role, FakeRole(self._id(), "Yellow Jackets"), FakeRole(self._id(), "Admin")]
+        self.members = {}
+        self.channels = []
+        for name in channel_names:
+            self.channels.append(FakeChannel(self, self._id(), name))
+
+    def _id(self):
+        self.next_id += 1
+        return self.next_id
+
+    @property
+    def text_channels(self):
+        return [channel for channel in self.channels if not channel.name.startswith("voice-") and not isinstance(channel, FakeCategory)]
+
+    @property
+    def categories(self):
+        return [channel for channel in self.channels if isinstance(channel, FakeCategory)]
+
+    def get_channel(self, id : int):
+        return next((channel for channel in self.channels if channel.id == id), None)
+
+    def get_member(self, id : int):
+        return self.members.get(id)
+
+    def get_role(self, id : int):
+        return next((role for role in self.roles if role.id == id), None)
+
+    def add_member(self, name : str):
+        member = FakeMember(self, self._id(), name)
+        self.members[member.id] = member
+        return member
+
+    def _add_channel(self, channel):
+        self.channels.append(channel)
+        if channel.category is not None:
+            channel.category.channels.append(channel)
+        asyncio.ensure_future(self.bot_module.on_guild_channel_create(channel))
+        return channel
+
+    def _remove_channel(self, channel):
+        self.channels.remove(channel)
+        asyncio.ensure_future(self.bot_module.on_guild_channel_delete(channel))
+
+    async def create_category(self, name, overwrites = None):
+        await self.rest.call("create_channel", ("guild", self.id))
+        return self._add_channel(FakeCategory(self, self._id(), name, overwrites=overwrites))
+
+    async def create_text_channel(self, name, category = None, position = 0):
+        await self.rest.call("create_channel", ("guild", self.id))
+        return self._add_channel(FakeChannel(self, self._id(), name, category=category))
+
+    async def create_voice_channel(self, name, category = None, position = 0):
+        await self.rest.call("create_channel", ("guild", self.id))
+        return self._add_channel(FakeChannel(self, self._id(), name, category=category))
+
+
+class FakeCategory(FakeChannel):
+    pass
+
+
+class FakeContext:
+    def __init__(self, guild, channel, author, content):
+        self.message = FakeMessage(channel, content, author)
+        self.author = author
+        self.guild = guild
+
+################################ Setup ################################
+
+def build_database(path, course_count):
+    """Create the schema from GT.sql and fill it with a catalog
+
+    Returns:
+        list: the course strings, ie "ae1000"
+    """
+
+    conn = sqlite3.connect(path)
+    with open(os.path.join(ROOT, "GT.sql")) as schema:
+        conn.executescript(schema.read())
+
+    rows = []
+    for i in range(course_count):
+        dept = DEPARTMENTS[i % len(DEPARTMENTS)]
+        rows.append((dept, str(1000 + i // len(DEPARTMENTS) * 10), "0", dept + " course " + str(i), 0))
+    with conn:
+        conn.executemany("INSERT INTO courses VALUES (?, ?, ?, ?, ?)", rows)
+    conn.close()
+    return [dept.lower() + code for dept, code, _, _, _ in rows]
+
+def import_bot(database_path, args):
+    """Import src/buzz-bot.py (a hyphenated script, so by path) configured for the test"""
+
+    os.environ.update({
+        "CURRENT_YEAR": "2022",
+        "CURRENT_SEMESTER": "Fall",
+        "DATABASE_PATH": database_path,
+        "CONFIG_FILE": os.path.join(os.path.dirname(database_path), "none.env"),
+        "GUILD_CONFIG_DIRECTORY": os.path.dirname(database_path),
+        "LOG_LEVEL": os.getenv("LOG_LEVEL", "ERROR"),
+        "RECONCILE_ON_STARTUP": "false",
+        "REGISTER_DEFERRED": "true" if args.deferred else "false",
+        "CHANNEL_LIMIT": str(args.channel_limit),
+        "OVERFLOW_GUILDS": ",".join(str(2 + i) for i in range(args.overflow)),
+    })
+    spec = importlib.util.spec_from_file_location("buzz_bot", os.path.join(ROOT, "src", "buzz-bot.py"))
+    module = importlib.util.module_from_spec(spec)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", DeprecationWarning) # discord.py 1.7 gets the event loop outside of a coroutine
+        spec.loader.exec_module(module)
+    return module
+
+################################ Load Test ################################
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+
+def count_queries(bot_module):
+    return sum(histogram.count for (name, _), histogram in bot_module.bot_metrics.histograms.items() if name == "buzzbot_db_query_seconds")
+
+async def drain(bot_module, rest, guild):
+    """Wait for every queued Discord action (and any call still in flight) to finish"""
+
+    workers = bot_module.guild_states.get(guild).register_workers
+    while bot_module.action_queue.depth() or rest.in_flight or workers.depth() or workers.running:
+        await asyncio.sleep(0.01)
+
+async def run_phase(name, bot_module, rest, guild, jobs, arrival_rate):
+    """Start each job at the arrival rate and measure them
+
+    Args:
+        jobs (list): coroutine functions that run one command and return its latency in seconds
+    """
+
+    queries_before = count_queries(bot_module)
+    calls_before = sum(rest.calls.values())
+    waits_before = rest.rate_limit_waits
+    start = time.perf_counter()
+
+    tasks = []
+    for job in jobs:
+        tasks.append(asyncio.ensure_future(job()))
+        await asyncio.sleep(random.expovariate(arrival_rate))
+    latencies = await asyncio.gather(*tasks)
+    await drain(bot_module, rest, guild)
+
+    elapsed = time.perf_counter() - start
+    count = len(jobs)
+    print("{:<9} {:>5} commands in {:>6.1f}s  {:>6.2f}/s  p50 {:>7.3f}s  p99 {:>7.3f}s  {:>5.1f} queries/cmd  {:>5.2f} Discord calls/cmd  {} rate limit waits".format(
+        name, count, elapsed, count / elapsed, percentile(latencies, 0.5), percentile(latencies, 0.99),
+        (count_queries(bot_module) - queries_before) / count, (sum(rest.calls.values()) - calls_before) / count, rest.rate_limit_waits - waits_before))
+
+async def load_test(args, bot_module, course_strings):
+    rest = FakeREST(args.latency)
+    guild = FakeGuild(rest, bot_module)
+    guilds = [guild] + [FakeGuild(rest, bot_module, 2 + i, "Overflow " + str(1 + i), ("general",)) for i in range(args.overflow)]
+    bot_module.bot.get_guild = {x.id: x for x in guilds}.get # the bot looks overflow guilds up by ID
+    for x in guilds:
+        await bot_module.open_guild(x)
+    requests_channel = next(channel for channel in guild.channels if channel.name == "course-requests")
+    admin = guild.add_member("admin")
+    students = [guild.add_member("student" + str(i)) for i in range(args.students)]
+
+    def command(callback, author, content, **kwargs):
+        async def job():
+            context = FakeContext(guild, requests_channel, author, content)
+            start = time.perf_counter()
+            await callback(context, **kwargs)
+            return time.perf_counter() - start
+        return job
+
+    def deferred_register(author, arg):
+        async def job():
+            context = FakeContext(guild, requests_channel, author, "!register " + arg)
+            replies = []
+            send = requests_channel.send
+            async def capture(content): # keep the acknowledgement so its edit can be waited for
+                reply = await send(content)
+                replies.append(reply)
+                return reply
+            context.message.channel = FakeChannel(guild, requests_channel.id, requests_channel.name)
+            context.message.channel.send = capture
+            start = time.perf_counter()
+            await bot_module.register.callback(context, arg=arg)
+            finished = await replies[0].edited
+            return finished - start
+        return job
+
+    # Admins add the courses that are missing from the catalog
+    added = []
+    for i in range(args.adds):
+        added.append(command(bot_module.add.callback, admin, "", arg="lt" + str(9000 + i) + " Load Test Course " + str(i)))
+    await run_phase("add", bot_module, rest, guild, added, args.arrival_rate)
+
+    # Every student joins, then registers for a few of the popular courses
+    await run_phase("join", bot_module, rest, guild, [command(bot_module.join.callback, student, "!join") for student in students], args.arrival_rate)
+
+    popular = course_strings[:args.popular]
+    weights = [1 / (rank + 1) ** 1.1 for rank in range(len(popular))]
+    registrations = []
+    for student in students:
+        picks = set()
+        while len(picks) < args.courses_each:
+            picks.add(random.choices(popular, weights)[0])
+        arg = ",".join(sorted(picks))
+        registrations.append(deferred_register(student, arg) if args.deferred else command(bot_module.register.callback, student, "!register " + arg, arg=arg))
+    await run_phase("register", bot_module, rest, guild, registrations, args.arrival_rate)
+
+    print()
+    for x in guilds:
+        print("{}: {} course groups, {} of {} channels".format(x.name, len(x.categories), bot_module.channel_budget.get_total_channels(x), bot_module.channel_budget.get_limit(x)))
+    print("Discord calls: {}".format(dict(rest.calls)))
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test !add, !join and !register against a fake Discord guild")
+    parser.add_argument("--students", type=int, default=200, help="students who join and register (default: 200)")
+    parser.add_argument("--arrival-rate", type=float, default=10, help="students arriving per second (default: 10)")
+    parser.add_argument("--courses-each", type=int, default=4, help="courses each student registers for (default: 4)")
+    parser.add_argument("--popular", type=int, default=100, help="number of courses the students choose from (default: 100)")
+    parser.add_argument("--catalog", type=int, default=3000, help="courses in the catalog (default: 3000)")
+    parser.add_argument("--adds", type=int, default=20, help="!add commands run by the admins (default: 20)")
+    parser.add_argument("--latency", type=float, default=0.08, help="mean simulated Discord REST latency in seconds (default: 0.08)")
+    parser.add_argument("--channel-limit", type=int, default=500, help="channels each guild can have (default: 500)")
+    parser.add_argument("--overflow", type=int, default=0, help="overflow guilds for course groups once the first one is full (default: 0)")
+    parser.add_argument("--deferred", action="store_true", help="run !register deferred, timed until the acknowledgement is edited")
+    parser.add_argument("--seed", type=int, default=1, help="random seed (default: 1)")
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    with tempfile.TemporaryDirectory() as directory:
+        database_path = os.path.join(directory, "GT.db")
+        course_strings = build_database(database_path, args.catalog)
+        bot_module = import_bot(database_path, args)
+
+        print("{} students, {} courses each from the {} most popular, arriving at {}/s, {}s simulated latency{}".format(
+            args.students, args.courses_each, args.popular, args.arrival_rate, args.latency, ", deferred" if args.deferred else ""))
+        try:
+            bot_module.bot.loop.run_until_complete(load_test(args, bot_module, course_strings))
+        finally:
+            bot_module.bot.loop.run_until_complete(bot_module.guild_states.close())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+import asyncio, collections, logging, time
+import discord
+
+logger = logging.getLogger(__name__)
+
+class TokenBucket:
+    """Allows up to `rate` actions every `per` seconds, with bursts of up to `rate`"""
+
+    def __init__(self, rate : int, per : float):
+        self.rate = rate
+        self.per = per
+        self.tokens = float(rate)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0 # set when Discord tells us to back off
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate / self.per)
+        self.updated = now
+
+    def delay(self):
+        """How long to wait before the next action can be sent (0 if it can be sent now)"""
+
+        self._refill()
+        wait = max(0.0, self.blocked_until - time.monotonic())
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) * self.per / self.rate)
+        return wait
+
+    def take(self):
+        """Use up one action"""
+
+        self._refill()
+        self.tokens -= 1
+
+    def back_off(self, seconds : float):
+        """Send nothing for the given number of seconds"""
+
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+
+class Route:
+    """The pending actions for one rate limit bucket, in the order they were submitted"""
+
+    def __init__(self, rate : int, per : float):
+        self.bucket = TokenBucket(rate, per)
+        self.order = collections.deque() # keys in submission order
+        self.pending = {} # key -> [action, futures waiting on it, time it was first submitted]
+        self.worker = None
+
+
+class ActionQueue:
+    """A central queue for every Discord change the bot makes (permissions, roles, channels, messages)
+
+    Each action is queued on a route, which matches one of Discord's rate limit buckets (ie one channel or one guild).
+    Every route sends at most `rate` actions every `per` seconds and all routes together stay under the global limit,
+    so bursts at the start of term are smoothed out instead of running into 429s. An action submitted with the same
+    key as one that is still waiting replaces it, so a member's or role's permission overwrite on a channel is only
+    sent once however many times it changes before it goes out. Callers can await the returned future or let it finish
+    in the background (failures are logged).
+    """
+
+    def __init__(self, rate = 5, per = 5.0, global_rate = 50, global_per = 1.0, retries = 3, metrics = None):
+        self.rate = rate
+        self.per = per
+        self.retries = retries
+        self.global_bucket = TokenBucket(global_rate, global_per)
+        self.routes = {} # route -> Route
+        self.latest_overwrites = {} # (channel ID, target ID) -> token of the latest overwrite queued for it, until it's sent
+        self.overwrite_locks = {} # (channel ID, target ID) -> asyncio.Lock held while an overwrite for it is being sent
+        self.coalesced = 0 # actions that were merged into another one instead of being sent
+        self.metrics = metrics # optional metrics.Metrics to record waits and Discord API latency into
+
+    def depth(self):
+        """The number of actions waiting to be sent"""
+
+        return sum(len(route.pending) for route in self.routes.values())
+
+    def depths(self):
+        """The number of actions waiting to be sent on each route that has any"""
+
+        return {name: len(route.pending) for name, route in self.routes.items() if route.pending}
+
+    def submit(self, route_name, action, key = None):
+        """Queue an action
+
+        Args:
+            route_name (tuple): the rate limit bucket the action belongs to. Ex: ("channel", channel.id)
+            action: a function taking no arguments that returns the coroutine to run (ie lambda: member.add_roles(role))
+            key (hashable): optional. If an action with the same key is still waiting on this route it is replaced by this one
+
+        Returns:
+            asyncio.Future: the result of the action
+        """
+
+        route = self.routes.get(route_name)
+        if route is None:
+            route = self.routes[route_name] = Route(self.rate, self.per)
+
+        future = asyncio.get_event_loop().create_future()
+        future.add_done_callback(lambda f: self._log_failure(route_name, f))
+
+        if key is None:
+            key = object() # never matches anything else
+
+        if key in route.pending:
+            # Replace the waiting action, keeping its place in the queue. Everyone waiting on it gets the new result
+            route.pending[key][0] = action
+            route.pending[key][1].append(future)
+            self.coalesced += 1
+        else:
+            route.pending[key] = [action, [future], time.perf_counter()]
+            route.order.append(key)
+
+        if route.worker is None or route.worker.done():
+            route.worker = asyncio.ensure_future(self._work(route_name, route))
+        return future
+
+    def set_permissions(self, channel, target, overwrite):
+        """Queue a permission overwrite change for a member or role on a channel
+
+        Each target's overwrite is sent on its own (set_permissions only changes that target), on the channel's route.
+        A change queued for the same target before the last one is sent replaces it, and a retry of an older change
+        is skipped once a newer one has been queued, so the newest change always wins.
+
+        Args:
+            channel (discord.abc.GuildChannel): the channel or category
+            target (discord.Member or discord.Role): who the overwrite is for
+            overwrite (discord.PermissionOverwrite): the new overwrite, or None to remove it
+
+        Returns:
+            asyncio.Future: finishes once the change has been made
+        """
+
+        key = (channel.id, target.id)
+        token = self.latest_overwrites[key] = object()
+        return self.submit(("channel", channel.id), lambda: self._apply_overwrite(channel, target, overwrite, key, token), key=("overwrites",) + key)
+
+    async def _apply_overwrite(self, channel, target, overwrite, key, token):
+        """Send one target's overwrite (it may be a retry), unless a newer one for the target has been queued since"""
+
+        # Held while it's sent, so a newer overwrite for the target can't overtake this one
+        lock = self.overwrite_locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            if self.latest_overwrites.get(key) is token:
+                await channel.set_permissions(target, overwrite=overwrite)
+                if self.latest_overwrites.get(key) is token:
+                    del self.latest_overwrites[key]
+        if key not in self.latest_overwrites and not lock.locked(): # nothing newer is queued or being sent
+            self.overwrite_locks.pop(key, None)
+
+    async def _work(self, route_name, route : Route):
+        """Send a route's actions as fast as its bucket and the global bucket allow. Exits once the route is empty"""
+
+        while route.order:
+            delay = max(route.bucket.delay(), self.global_bucket.delay())
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+
+            key = route.order.popleft()
+            action, futures, submitted = route.pending.pop(key)
+            route.bucket.take()
+            self.global_bucket.take()
+            if self.metrics is not None: # how long the action was held back to stay under the rate limits
+                self.metrics.observe("buzzbot_discord_wait_seconds", time.perf_counter() - submitted, route=route_name[0])
+
+            # Don't wait for the action to finish, the next one can go out as soon as there's room in the bucket
+            asyncio.ensure_future(self._send(route_name, route, action, futures))
+
+    async def _send(self, route_name, route : Route, action, futures):
+        """Run an action, backing off and retrying if Discord says we're being rate limited"""
+
+        for attempt in range(self.retries + 1):
+            start = time.perf_counter()
+            try:
+                result = await action()
+            except discord.HTTPException as e:
+                self._observe_call(route_name, start, e.status)
+                if e.status != 429 or attempt == self.retries:
+                    self._finish(futures, exception=e)
+                    return
+                retry_after = float(e.response.headers.get("Retry-After", 1))
+                logger.warning("Rate limited on %s, retrying in %ss", route_name, retry_after)
+                if self.metrics is not None:
+                    self.metrics.increment("buzzbot_discord_rate_limited_total", route=route_name[0])
+                route.bucket.back_off(retry_after)
+                await asyncio.sleep(retry_after)
+            except Exception as e:
+                self._observe_call(route_name, start, "error")
+                self._finish(futures, exception=e)
+                return
+            else:
+                self._observe_call(route_name, start, "ok")
+                self._finish(futures, result=result)
+                return
+
+    def _observe_call(self, route_name, start : float, status):
+        if self.metrics is not None:
+            self.metrics.observe("buzzbot_discord_call_seconds", time.perf_counter() - start, route=route_name[0], status=status)
+
+    def _finish(self, futures, result = None, exception = None):
+        for future in futures:
+            if future.done():
+                continue
+            if exception is not None:
+                future.set_exception(exception)
+            else:
+                future.set_result(result)
+
+    def _log_failure(self, route_name, future):
+        if not future.cancelled() and future.exception() is not None:
+            logger.error("Discord action on %s failed: %r", route_name, future.exception())
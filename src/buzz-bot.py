@@ -1,265 +1,446 @@
-import discord, sqlite3, math, logging, os
+import discord, asyncio, csv, io, logging, os, signal, time
 from discord.ext import commands
-from enum import Enum
 from course import Course
+from database import Transaction
+from config import Config, ConfigError
+from action_queue import ActionQueue
+from channel_budget import ChannelBudget
+from command_gate import CommandGate
+from guild_state import GuildStates
+from catalog import Catalog
+import queries, catalog_import, reconcile, rollover, metrics
 from discord_message import DiscordMessage
 
-# Config Variables
-CURRENT_YEAR = os.getenv('CURRENT_YEAR')
-CURRET_SEMESTER = os.getenv('CURRENT_SEMESTER')
-LOGGING_LEVEL = os.getenv('LOG_LEVEL', default='WARNING')
+# Config Variables. Read from the environment and the CONFIG_FILE (.env by default), see config.py. !reload (or SIGHUP) reloads them
+# These are the process wide settings, each guild's own settings are in its GuildState
+config = Config.load()
 
 # Set up logging
 logger = logging.getLogger()
-logging.basicConfig(format='%(asctime)s %(name)s %(levelname)s: %(message)s', level=LOGGING_LEVEL)
+logging.basicConfig(format='%(asctime)s %(name)s %(levelname)s: %(message)s', level=config.log_level)
 
 logger.info("Buzz-Bot started")
-logger.info("Logging Level: " + LOGGING_LEVEL)
-logger.info("Semester and Year: " + CURRET_SEMESTER + " " + CURRENT_YEAR)
-
-# Global Database Variables
-Courses_Columns = Enum('Courses_Columns', ['dept', 'course', 'topic', 'title', 'special'], start=0)
-Registrar_Columns = Enum('Registrar_Columns', ['category', 'year', 'semester', 'semester_sort', 'dept', 'course', 'topic'], start=0)
-Requests_Columns = Enum('Requests_Columns', ['dept', 'course', 'topic', 'year', 'semester', 'user'], start=0)
-Schedule_Columns = Enum('Schedule_Columns', ['id', 'user', 'category', 'hidden'], start=0)
-
-# Set up the sqlite database
-conn = sqlite3.connect("GT.db")
+logger.info("Logging Level: %s", config.log_level)
+logger.info("Semester and Year: %s %s", config.current_semester, config.current_year)
+logger.info("Database: %s %r", config.database_path or "(default, see config.get_database_path)", config.database_profile)
+
+# Timings and queue depths of the hot paths (see metrics.py). Served on METRICS_PORT and/or logged every METRICS_LOG_INTERVAL seconds
+bot_metrics = metrics.Metrics()
+bot_metrics.describe("buzzbot_command_seconds", "Time to handle each command")
+bot_metrics.describe("buzzbot_register_background_seconds", "Time to process a deferred !register on the background workers")
+bot_metrics.describe("buzzbot_db_query_seconds", "Time each database query was awaited, waiting for its thread included")
+bot_metrics.describe("buzzbot_discord_call_seconds", "Latency of each Discord API call")
+bot_metrics.describe("buzzbot_discord_wait_seconds", "Time each Discord action was held in the action queue to stay under the rate limits")
+bot_metrics.describe("buzzbot_discord_rate_limited_total", "Discord API calls that got a 429")
+
+# Each guild's settings, database, catalog and background workers (see guild_state.py), opened when the bot first sees the guild.
+# All queries run on each database's own threads so they never block the event loop
+guild_states = GuildStates(metrics=bot_metrics)
 
 # Set up the discord intents
 intents = discord.Intents.default()
 intents.members = True
 
 # Create the discord bot with a given prefix and no default help command (A custom one is defined below)
-bot = commands.Bot(command_prefix='!', help_command=None, intents=intents)
-
-
-################################ Database Functions ################################
-# All the functions to interact with the database
+# Sharded, so one process (or several, see SHARD_COUNT and SHARD_IDS) can serve many guilds. With a single guild it runs one shard
+bot = commands.AutoShardedBot(command_prefix='!', help_command=None, intents=intents,
+                              shard_count=config.shard_count or None, shard_ids=list(config.shard_ids) or None)
 
-def db_get_course(course : Course):
-    """Query the database to see if the course is valid (ie "already known")
+# Reload the config on SIGHUP too (ie `kill -HUP` or `docker kill --signal=HUP`). Signal handlers aren't available on Windows
+try:
+    bot.loop.add_signal_handler(signal.SIGHUP, lambda: asyncio.ensure_future(reload_config_from_signal()))
+except (AttributeError, NotImplementedError):
+    logger.info("SIGHUP isn't available, the config can only be reloaded with !reload")
 
-    Args:
-        dept (string): the department the course is in
-        course (string): the course code
-        topic (integer): the topic
+# Every change the bot makes on Discord goes through this queue so bursts stay under the rate limits.
+# Its routes are per channel or per guild, so only the global limit (which Discord applies to the whole bot) is shared between guilds
+action_queue = ActionQueue(rate=config.discord_route_rate, per=config.discord_route_per, global_rate=config.discord_global_rate, metrics=bot_metrics)
 
-    Returns:
-        row (list): return all the rows returned by the query
-    """
+# Running count of the channels in each guild, kept up to date by the channel events
+channel_budget = ChannelBudget(config.channel_limit)
 
-    # Build query to get the course from the database
-    sql = "SELECT * FROM courses WHERE dept='" + course.dept + "' AND course='" + course.code + "' AND topic='" + course.topic + "'"
-    logger.debug("db_get_course query: \"" + sql + "\"")
-    return conn.execute(sql).fetchall()
+# The IDs of the command channels and the admin and member roles, cached so on_message doesn't scan the guild for every message
+command_gate = CommandGate(config.command_channels, config.admin_role, config.member_role)
 
-def db_is_course_special_topics(course : Course):
-    """Query the database to see if the course is a special topics course
+# Queue depths, read whenever the metrics are
+bot_metrics.gauge("buzzbot_discord_queue_depth", lambda: action_queue_depths())
+bot_metrics.gauge("buzzbot_discord_coalesced", lambda: action_queue.coalesced)
+bot_metrics.gauge("buzzbot_register_queue_depth", lambda: per_guild(lambda guild, state: state.register_workers.depth()))
+bot_metrics.gauge("buzzbot_db_pending", lambda: per_guild(lambda guild, state: state.database.pending))
+bot_metrics.gauge("buzzbot_channels_remaining", lambda: per_guild(lambda guild, state: channel_budget.get_channels_remaining(guild)))
 
-    Args:
-        dept (string): the department the course is in
-        course (string): the course code
+# Database -> {(user ID, guild ID)} of the members who left and haven't been purged yet (see purge_departed_member)
+departed_members = {}
 
-    Returns:
-        boolean: if the course is a special topics course
-    """
-
-    # Build query to get the course from the database
-    sql = "SELECT * FROM courses WHERE dept='" + course.dept + "' AND course='" + course.code + "' AND special=1"
-    logger.debug("db_is_course_special_topics query: \"" + sql + "\"")
-    row = conn.execute(sql).fetchall()
-
-    if row: # if there were any courses returned (there could be more than one)
-        return True # then the course is a special topics course
-    else: # the course is not a special topics course (or doesn't exist at all)
-        return False
+# guild ID -> invite URL for each overflow guild (see OVERFLOW_GUILDS), created the first time someone needs one
+overflow_invites = {}
 
-def db_get_course_available(course : Course):
-    """Query the database to see if the course is available (ie "already exists")
-    
-    Args:
-    \tdept (string): the department the course is in
-    \tcourse (string): the course code
-    \ttopic (string): the course topic (only relevant for special topics courses, 0 for other courses)
-    \tyear (str): optional. defaults to current_year environment variable
-    \tsemester (str): optional. defaults to current_semester environment variable
-
-    Returns:
-        bool: True if the course is available, False otherwise
-    """
-
-    # Build query to check if the course is in the registrar table
-    sql = "SELECT * FROM registrar WHERE dept='" + course.dept + "' AND course='" + course.code + "' "
-    sql += "AND topic='" + course.topic + "' AND year='" + course.semester.year + "' AND semester='" + course.semester.semester + "'"
-    logger.debug("db_get_course_available query: \"" + sql + "\"")
-    return conn.execute(sql).fetchall() # Return what the query returned
-
-def db_get_course_requested(course : Course):
-    """Query the database to see if the course is in the requested list (already been requested)
-
-    Args:
-        \tdept (string): the department the course is in\n
-        \tcourse (string): the course code\n
-        \ttopic (string): the course topic (only relevant for special topics courses, 0 for other courses)\n
-        \tyear (str): optional. defaults to current_year environment variable
-        \tsemester (str): optional. defaults to current_semester environment variable
-
-    Returns:
-        the row of returned query of if a course was requested
-    """
-
-    # Build query to check if the course is in the requests table
-    sql = "SELECT * FROM requests WHERE dept='" + course.dept + "' AND course='" + course.code + "'"
-    sql += " AND topic='" + course.topic + "' AND year='" + course.semester.year + "' AND semester='" + course.semester.semester + "'"
-    logger.debug("db_get_course_requested query: \"" + sql + "\"")
-    return conn.execute(sql).fetchall() # Return what the query returned
-
-def db_join_course(user, username, category_id):
-    """Add a user to a course in the current semester
-
-    Makes the relevant changes in both Discord itself and the database
-
-    Args:
-        user (integer): the Discord user unique ID
-        category (integer): the Discord category unique ID
-    """
-
-    # Build query to add the user to the schedule
-    sql = "INSERT INTO schedule (user, username, category_id) VALUES('" + str(user) + "', '" + username + "', '" + str(category_id) + "')"
-    logger.debug("db_join_course query: \"" + sql + "\"")
-    conn.execute(sql) # Execute the query
-    conn.commit() # Commit the change
-
-def db_create_course_registration(course : Course, category_id):
-    """Create a specific instance of a course
-    
-    Args:\n
-    \tdept (str): the department the course is in\n
-    \tcourse (str): the course code\n
-    \ttopic (string): the course topic (only relevant for special topics courses, 0 for other courses)\n
-    \tcategory_id (int): the Discord category ID
-    \tyear (str): optional. defaults to current_year environment variable
-    \tsemester (str): optional. defaults to current_semester environment variable
-    \tsemester_sort (str): optional. defaults to current_semester_sort environment variable
-    """
-    
-    # Insert the course into the registrar table
-    sql = "INSERT INTO registrar (category_id, year, semester, semester_sort, dept, course, topic) "
-    sql += "VALUES('" + str(category_id) + "', '" + course.semester.year + "', '" + course.semester.semester + "', '" + course.semester.semester_sort
-    sql += "', '" + course.dept  + "', '" + course.code  + "', '" + course.topic + "')"
-    logger.debug("db_create_course_registration query: \"" + sql + "\"")
-    conn.execute(sql) # Execute the query
-    conn.commit() # Commit the change
-
-def db_create_course(course : Course):
-    """Create a course
-    
-    Args:\n
-        \tdept (string): the department the course is in\n
-        \tcourse (string): the course code\n
-        \ttopic (string): the course topic (only relevant for special topics courses, 0 for other courses)\n
-        \ttitle (integer): the name of the course
-    """
-    
-    # Insert the course into the registrar table
-    sql = "INSERT INTO courses (dept, course, topic, title, special) "
-    sql += "VALUES('" + course.dept  + "', '" + course.code  + "', '" + course.topic + "', '" + course.title + "', "
-    if course.topic != "0": # if the topic is not "0", then it is a special topics course
-        sql += "'1')"
-    else:
-        sql += "'0')"
-    logger.debug("db_create_course query: \"" + sql + "\"")
-    conn.execute(sql) # Execute the query
-    conn.commit() # Commit the change
+background_started = False
 
-def db_request_course(course : Course, user, username):
-    """Create a course request
-    
-    Args:
-        dept (string): the department the course is in
-        course (string): the course code
-        topic (string): 
-        user (integer): Discord ID of the requesting user
-        year (str): optional. defaults to current_year environment variable
-        semester (str): optional. defaults to current_semester environment variable
-    """
-    
-    # Insert the course into the requests table
-    sql = "INSERT INTO requests (dept, course, topic, year, semester, user, username) "
-    sql += " VALUES('" + course.dept  + "', '" + course.code  + "', '" + course.topic + "', '"
-    sql += course.semester.year + "', '" + course.semester.semester + "', '" 
-    sql += str(user) + "', '" + username + "')"
-    logger.debug("db_request_course query: \"" + sql + "\"")
-    conn.execute(sql) # Execute the query
-    conn.commit() # Commit the change
-
-def db_clear_request(course : Course, user):
-    """Delete a course request
-    
-    Args:
-    \tdept (string): the department the course is in
-    \tcourse (string): the course code
-    \ttopic (string): the topic (only )
-    \tuser (integer): Discord ID of the requesting user
-    \tyear (str): optional. defaults to current_year environment variable
-    \tsemester (str): optional. defaults to current_semester environment variable
-    """
-    
-    # Remove the request from the requests table
-    sql = "DELETE FROM requests WHERE dept='" + course.dept + "' AND course='" + course.code + "'"
-    sql += " AND topic='" + course.topic + "' AND year='" + course.semester.year + "' AND semester='" + course.semester.semester + "'"
-    sql += " AND user='" + str(user) + "'"
-    logger.debug("db_clear_request query: \"" + sql + "\"")
-    conn.execute(sql) # Execute the query
-    conn.commit() # Commit the change
 
 ############################### Helper Functions ###############################
 # Some functions to help with discord
 
-# Get the total number of channels in the server
+# Get the total number of channels in the server (text, voice and categories)
 def get_total_channels(context):
-    return len(context.guild.text_channels) + len(context.guild.text_channels)
+    return channel_budget.get_total_channels(context.guild)
 
 # Get the max number of courses that could be created
 def get_max_courses_remaining(context):
-    total_channels = get_total_channels(context)
-    return math.floor((500-total_channels) / 4)
+    return channel_budget.get_courses_remaining(context.guild)
 
 # Check the server limits and return a printable string
 def check_limits(context):
     total_channels = get_total_channels(context)
     base_message = "Total channels currently: " + str(total_channels) + "\nMax courses remaining: " + str(get_max_courses_remaining(context))
-    if total_channels > 450:
-        logger.warning(base_message + "\nTotal channels approaching max.")
+    for guild in get_placement_guilds(context.guild, guild_states.get(context.guild))[1:]:
+        base_message += "\nOverflow server " + guild.name + ": " + str(channel_budget.get_courses_remaining(guild)) + " courses remaining"
+    base_message += "\nDiscord actions queued: " + str(action_queue.depth()) + " (" + str(action_queue.coalesced) + " merged so far)"
+    if total_channels > channel_budget.get_limit(context.guild) - 50:
+        logger.warning("%s\nTotal channels approaching max.", base_message)
     else:
-        logger.info(base_message)
+        logger.info("%s", base_message)
     return base_message
 
+# Queue the creation of the text and voice channels for a new course category. All three are sent as soon as the rate limits allow
+# Returns a future that finishes once all three have been created (or failed to be, which the action queue logs)
+def create_course_channels(guild, course : Course, category):
+    channel_name_suffix = course.get_channel_postfix_name().lower() # set the suffix to be used in each channel
+    route = ("channels", guild.id)
+    return asyncio.gather(
+        action_queue.submit(route, lambda: guild.create_text_channel("general-" + channel_name_suffix, category=category, position=0)), # create the general text chat
+        action_queue.submit(route, lambda: guild.create_text_channel("hw-" + channel_name_suffix, category=category, position=1)), # create the hw text chat
+        action_queue.submit(route, lambda: guild.create_voice_channel("voice-chat-" + channel_name_suffix, category=category, position=0)), # create the voice chat
+        return_exceptions=True)
+
+# Queue giving a member a role. Giving the same member the same role twice before it is sent only sends it once
+def add_role(member, role):
+    return action_queue.submit(("roles", member.guild.id), lambda: member.add_roles(role), key=(member.id, role.id))
+
+# The guilds a guild's new course groups can go in: the guild itself, then its overflow guilds (see OVERFLOW_GUILDS) for when it's full
+# An overflow guild has to share the guild's database, so its categories are in the same registrar and covered by !rebuild and !rollover
+def get_placement_guilds(guild, state):
+    guilds = [guild]
+    for guild_id in state.config.overflow_guilds:
+        overflow = bot.get_guild(guild_id)
+        overflow_state = guild_states.get(overflow) if overflow is not None else None
+        if overflow_state is None or overflow.unavailable:
+            logger.warning("overflow guild %s isn't available", guild_id)
+        elif overflow_state.database is not state.database:
+            logger.warning("overflow guild %s(%s) doesn't share the database %s, skipping it", overflow.name, guild_id, state.database.path)
+        elif overflow is not guild:
+            guilds.append(overflow)
+    return guilds
+
+# Get the category of a course offering from its registrar guild ID. The older registrations don't have one, they're in the guild the command came from
+# Returns the category, or None if the bot can't see it
+def get_course_category(context, category_id, guild_id):
+    guild = context.guild if guild_id in (None, context.guild.id) else bot.get_guild(guild_id)
+    return guild.get_channel(category_id) if guild is not None else None
+
+# Give a user access to a course category in an overflow guild if they're in it. If not, they get it once they join (see on_member_join)
+# Returns True if they're in the guild
+def join_overflow_category(category, user):
+    member = category.guild.get_member(user.id)
+    if member is not None:
+        action_queue.set_permissions(category, member, discord.PermissionOverwrite(view_channel=True, connect=True))
+    return member is not None
+
+# Get an invite to an overflow guild. It's created the first time it's needed and reused after that
+# Returns the invite URL, or None if it couldn't be created (the action queue logs why)
+async def get_overflow_invite(guild):
+    if guild.id not in overflow_invites:
+        channel = guild.system_channel or next(iter(guild.text_channels), None)
+        if channel is None:
+            return None
+        try:
+            invite = await action_queue.submit(("channel", channel.id), lambda: channel.create_invite(max_age=0, unique=False, reason="Overflow course groups"), key="invite")
+        except discord.HTTPException:
+            return None
+        overflow_invites[guild.id] = invite.url
+    return overflow_invites[guild.id]
+
+# Tell a user that a course group is in an overflow guild, with an invite if they aren't in that guild yet
+async def append_course_in_other_server(message, course, category, in_server, prefix = "", overflow = True):
+    invite = None if in_server else await get_overflow_invite(category.guild)
+    message.append_course_in_other_server(course, category.guild.name, in_server, invite, prefix, overflow)
+
+# Get the guilds using a guild's database (the guild and its overflow guilds) that the bot can see right now
+# Returns the guilds, and whether that's all of them
+def get_sharing_guilds(state):
+    guilds = [bot.get_guild(other.guild_id) for other in guild_states.sharing(state.database)]
+    available = [guild for guild in guilds if guild is not None and not guild.unavailable]
+    return available, len(available) == len(guilds)
+
+# Find a user in any of the guilds
+# Returns the first discord.Member found, or None if they're in none of them
+def find_member(guilds, user_id):
+    return next((member for member in (guild.get_member(user_id) for guild in guilds) if member is not None), None)
+
+# Drop the requests (rows from queries.get_courses_requested) made by people who are in none of the guilds using the database, queueing their
+# deletion on the transaction. When some of those guilds can't be seen the requests are only skipped, the requestor may still be in one of them
+# Returns the rest of the requests
+def drop_departed_requests(guilds, all_guilds : bool, course : Course, request, transaction : Transaction):
+    remaining = []
+    for row in request:
+        user = row[queries.Requests_Columns.user.value]
+        if find_member(guilds, user) is not None:
+            remaining.append(row)
+        elif all_guilds:
+            transaction.add(queries.clear_request, course, user)
+            logger.info("register - dropped the request for %s by %s, who has left", course.get_full_name_and_semester(), user)
+    return remaining
+
+# Remember a member who left so their requests and schedule can be purged. Everyone who leaves a guild's database within a second
+# (ie a prune or a raid being cleaned up) is purged in a single transaction
+def purge_departed_member(state, member):
+    departed = departed_members.setdefault(state.database, set())
+    if not departed:
+        asyncio.ensure_future(purge_departed_members(state))
+    departed.add((member.id, member.guild.id))
+
+async def purge_departed_members(state):
+    await asyncio.sleep(1)
+    departed = departed_members.pop(state.database, set())
+
+    # Their requests can only go once they're in none of the guilds using the database (they may have only left an overflow guild)
+    guilds, all_guilds = get_sharing_guilds(state)
+    gone = {user for user, _ in departed if find_member(guilds, user) is None} if all_guilds else set()
+
+    transaction = Transaction()
+    transaction.add(queries.delete_member_requests, sorted(gone))
+    transaction.add(queries.delete_member_schedules, sorted(departed), guild_states.get_home_guild(state.database))
+    try:
+        await state.database.run(transaction.apply)
+    except Exception:
+        logger.exception("Purging %d members who left failed", len(departed))
+    else:
+        logger.info("Purged %d members who left: %d of them from every guild using %s", len(departed), len(gone), state.database.path)
+
+# Expire the requests older than REQUEST_MAX_AGE_DAYS in every database, forever. Started once (see on_ready)
+async def expire_requests_periodically():
+    while True:
+        await asyncio.sleep(config.request_sweep_interval)
+        if config.request_max_age_days == 0:
+            continue
+        older_than = int(time.time()) - config.request_max_age_days * 24 * 60 * 60
+        for database in {state.database for state in guild_states}:
+            try:
+                expired = await database.write(queries.expire_requests, older_than)
+            except Exception:
+                logger.exception("Expiring the old requests in %s failed", database.path)
+            else:
+                if expired:
+                    logger.info("Expired %d requests older than %d days in %s", expired, config.request_max_age_days, database.path)
+
+# Get the Course of a row from queries.get_member_schedule
+def get_schedule_course(row):
+    _, dept, code, topic, year, semester, _, _, title = row
+    course = Course(dept + code + ("-" + str(topic) if str(topic) != "0" else ""), year, semester)
+    course.set_title(title or "")
+    return course
+
+# Pick the rows of a user's schedule (from queries.get_member_schedule) that the argument of !drop, !hide or !show names: "all" or courses separated by commas
+# Returns the chosen rows and the courses named that the user isn't in
+def select_schedule_rows(state, rows, arg):
+    if arg.strip().lower() == "all":
+        return rows, []
+
+    by_key = {(row[1], row[2], str(row[3]), row[4], row[5]): row for row in rows}
+    chosen = {}
+    missing = []
+    for course_raw in [x.strip() for x in arg.upper().split(',') if x.strip()]:
+        key = Course(course_raw, state.config.current_year, state.config.current_semester).get_registration_key()
+        if key in by_key:
+            chosen[key] = by_key[key]
+        else:
+            missing.append(course_raw)
+    return list(chosen.values()), missing
+
+# Queue the user's permission overwrite on the categories of many courses at once. Each category is its own rate limit route,
+# so the changes are all sent concurrently rather than one round trip after another
+def set_course_permissions(context, user, rows, overwrite):
+    for row in rows:
+        category = get_course_category(context, row[0], row[6])
+        member = category.guild.get_member(user.id) if category is not None else None # they may not have joined an overflow guild
+        if member is not None:
+            action_queue.set_permissions(category, member, overwrite)
+
+# Sync the registrar and schedule tables of a guild's database with the course categories in every guild that uses it (see reconcile.py)
+# Returns the Reconciliation with what was (or would have been) fixed, or None if one of those guilds isn't available to read
+async def reconcile_guilds(state, dry_run = False):
+    async with state.reconcile_lock:
+        guilds = [bot.get_guild(other.guild_id) for other in guild_states.sharing(state.database)]
+        if any(guild is None or guild.unavailable for guild in guilds):
+            logger.warning("reconcile - skipped, a guild using %s is unavailable", state.database.path)
+            return None
+
+        start = time.monotonic()
+        categories, unrecognized = reconcile.get_course_categories(guilds, state.catalog, since=state.config.semester) # past semesters are left to !rollover
+        keys = {key for _, key in categories.values()}
+
+        # An offering another registration is in the middle of creating (its category may not be in the guild cache yet)
+        def in_progress(row):
+            key = (row[1], row[2], str(row[3]), row[4], row[5])
+            return key not in keys and state.course_locks.locked(key)
+
+        # Hold the course locks so registrations of these courses wait until the fixes are made
+        async with state.course_locks.acquire_all(keys):
+            registrar_rows = [row for row in await state.database.read(queries.get_registrar) if not in_progress(row)]
+            schedule_rows = await state.database.read(queries.get_schedule)
+            fixes = reconcile.reconcile(guilds, categories, registrar_rows, schedule_rows, guild_states.get_home_guild(state.database))
+            fixes.unrecognized = unrecognized
+
+            if not dry_run and len(fixes) > 0:
+                await state.database.run(fixes.apply)
+                for category, member in fixes.permissions:
+                    action_queue.set_permissions(category, member, discord.PermissionOverwrite(view_channel=True, connect=True))
+
+        logger.info("reconcile - %s%s: %d course categories checked in %.3fs: %s", "dry run, " if dry_run else "", state.database.path, len(categories), time.monotonic() - start, fixes)
+        for name in unrecognized:
+            logger.warning("reconcile - category looks like a course but isn't in the catalog: %s", name)
+        return fixes
+
+# Delete an old course category and its channels. The category is only deleted once all its channels are
+# Returns True if everything was deleted
+async def retire_category(category):
+    results = await asyncio.gather(*(action_queue.submit(("channel", channel.id), channel.delete) for channel in category.channels), return_exceptions=True)
+    if any(isinstance(result, Exception) for result in results):
+        return False
+    await action_queue.submit(("channel", category.id), category.delete)
+    return True
+
+# Delete old course categories a batch at a time, so the rest of the bot's Discord actions still get through in between
+# Returns the number of categories that couldn't be deleted (the action queue logs why)
+async def retire_categories(categories, batch_size):
+    failed = 0
+    for i in range(0, len(categories), batch_size):
+        results = await asyncio.gather(*(retire_category(category) for category in categories[i:i + batch_size]), return_exceptions=True)
+        failed += sum(1 for result in results if result is not True)
+        logger.info("rollover - %d of %d old categories processed", min(i + batch_size, len(categories)), len(categories))
+    return failed
+
+# Reload the config (see config.py) of the process and every guild without restarting. The live settings apply straight away, the rest keep
+# their running values until the next restart. Raises ConfigError (and keeps the running configs) if anything is invalid
+# Returns the names of the settings that changed and of those that need a restart, in any guild
+async def reload_config():
+    global config
+    new_config = Config.load()
+    guild_changes = await guild_states.reload()
+
+    changed = set(config.changes(new_config))
+    restart_needed = set(config.restart_needed(new_config))
+    for guild_changed, guild_restart_needed in guild_changes.values():
+        changed.update(guild_changed)
+        restart_needed.update(guild_restart_needed)
+    for name in config.restart_needed(new_config):
+        setattr(new_config, name, getattr(config, name))
+    new_config.database_profile = config.database_profile
+
+    logging.getLogger().setLevel(new_config.log_level)
+    config = new_config
+    for state in guild_states:
+        configure_guild(state)
+    logger.warning("Config reloaded. Changed: %s. Needs a restart: %s", ", ".join(sorted(changed)) or "nothing", ", ".join(sorted(restart_needed)) or "nothing")
+    return sorted(changed), sorted(restart_needed)
+
+async def reload_config_from_signal():
+    try:
+        await reload_config()
+    except ConfigError as error:
+        logger.error("Config not reloaded, keeping the running config: %s", error)
+
+# Open a guild's state (see guild_state.py) and set up the caches for it. Returns the GuildState, or None if its settings are invalid
+async def open_guild(guild):
+    try:
+        state = await guild_states.open(guild.id)
+    except ConfigError as error:
+        logger.error("Not serving %s(%s), its settings are invalid: %s", guild.name, guild.id, error)
+        return None
+    except Exception:
+        logger.exception("Not serving %s(%s), its database couldn't be opened", guild.name, guild.id)
+        return None
+    configure_guild(state)
+    channel_budget.build(guild)
+    command_gate.build(guild)
+    return state
+
+# Apply a guild's settings to the channel budget and the command gate
+def configure_guild(state):
+    guild = discord.Object(state.guild_id)
+    channel_budget.set_limit(guild, state.config.channel_limit)
+    command_gate.configure(state.config.command_channels, state.config.admin_role, state.config.member_role, guild_id=state.guild_id)
+
+# A gauge value for every guild that has been opened, labelled with the guild's name
+def per_guild(function):
+    values = {}
+    for state in guild_states:
+        guild = bot.get_guild(state.guild_id)
+        if guild is not None:
+            values[(("guild", guild.name),)] = function(guild, state)
+    return values
+
+# The number of Discord actions waiting on each kind of route (ie all the "channel" routes together)
+def action_queue_depths():
+    depths = {}
+    for route_name, depth in action_queue.depths().items():
+        depths[(("route", route_name[0]),)] = depths.get((("route", route_name[0]),), 0) + depth
+    return depths
+
+# Time every command. context.command_started is set just before the command runs
+@bot.before_invoke
+async def start_command_timer(context):
+    context.command_started = time.perf_counter()
+
+@bot.after_invoke
+async def stop_command_timer(context):
+    bot_metrics.observe("buzzbot_command_seconds", time.perf_counter() - context.command_started, command=context.command.qualified_name)
+
+# Start expiring old requests, and serve the metrics and/or start logging them if configured. Only once, on_ready runs again after every reconnect
+async def start_background_tasks():
+    global background_started
+    if background_started:
+        return
+    background_started = True
+    asyncio.ensure_future(expire_requests_periodically())
+    if config.metrics_port:
+        await metrics.serve(bot_metrics, config.metrics_host, config.metrics_port)
+    if config.metrics_log_interval:
+        asyncio.ensure_future(metrics.log_periodically(bot_metrics, config.metrics_log_interval))
+
+# Only let members with the admin role (ADMIN_ROLE) use a command. Anyone else gets told so (see on_command_error)
+def admin_only():
+    async def predicate(context):
+        return command_gate.is_admin(context.author)
+    return commands.check(predicate)
+
 ################################## Bot Commands ##################################
 # All the commands the bot will respond to
 
 # Help Message
 @bot.command(name="help")
 async def help(context):
+    config = guild_states.get(context.guild).config
     message = "Here a list of what I can do:"
     
     message += "\n\n__**register**__ - join a course or list of courses (separated by commas). Capitalization and spaces don't matter, just make sure you separate multiple courses using a comma"
     message += "\n> Ex: `!register ae1000,ae1001` would register you for AE 1000 and AE 1001."
     message += "\n\n> Note: If this course is a special topics course (ie, all sections are not taught together, usually covering different topics), then include a \"-\" and the first 3 letters of the course name. Ex: `!register ae8803-non` would add you to the \"Nonlinear\" section of AE 8803"
-    message += "\n\n> Note2: If you want to register for a course in a semester other than " + CURRET_SEMESTER + " " + CURRENT_YEAR + " (the current semester) then just add the semester and year to the end of any course. Ex: `!register ae1000-sp22,ae1001,ae8803-non-f22` would register you for AE 1000 in Spring 2022, AE 1001 in the current semester, and AE 8803 Nonlinear in Fall 2022."
+    message += "\n\n> Note2: If you want to register for a course in a semester other than " + config.current_semester + " " + config.current_year + " (the current semester) then just add the semester and year to the end of any course. Ex: `!register ae1000-sp22,ae1001,ae8803-non-f22` would register you for AE 1000 in Spring 2022, AE 1001 in the current semester, and AE 8803 Nonlinear in Fall 2022."
     
     message += "\n\n__**add**__ - add an unknown course (this is needed when you try to register for a course I've never seen before). The department code, course code, and the course title are needed, in that order."
     message += "\n> Ex: `!add ece1000 Intro to Electrical Engineering` would add the course ECE 1000 and call it \"Into to Electrical Engineering\""
     
-    # message += "\n\n__**hide**__ - hide a given course or all courses from the sidebar."
-    # message += "\n> Ex: `!hide ae1000.` would hide AE 1000 and `!hide all` would hide all courses"
+    message += "\n\n__**schedule**__ - list the courses you're in."
+
+    message += "\n\n__**hide**__ - hide a course, a list of courses or all courses from the sidebar."
+    message += "\n> Ex: `!hide ae1000` would hide AE 1000 and `!hide all` would hide all courses"
     
-    # message += "\n\n__**show**__ - show a given course (that you had hidden) or all your courses in the sidebar."
-    # message += "\n> Ex: `!show ae1000.` would show AE 1000 and `!show all` would show all your courses"
+    message += "\n\n__**show**__ - show hidden courses in the sidebar again."
+    message += "\n> Ex: `!show ae1000` or `!show all`"
     
-    # message += "\n\n__**drop**__ - remove yourself entirely from a given course."
-    # message += "\n> Ex: `!drop ae1000`. would completely remove you from AE 1000 and you would need to join it again using !register"
+    message += "\n\n__**drop**__ - leave a course, a list of courses or all your courses."
+    message += "\n> Ex: `!drop ae1000` would remove you from AE 1000 (use !register to join it again)"
 
     message += "\n\n__**help**__ - show this message"
 
@@ -272,75 +453,133 @@ async def help(context):
 @bot.command(name="join")
 async def join(context):
     user = context.message.author # get the member who requested access
-    await user.add_roles(discord.utils.get(user.guild.roles, name="Yellow Jackets")) # give the Yellow Jackets role (which grants basic server access)
+    add_role(user, command_gate.get_member_role(user.guild)) # give the member role (Yellow Jackets, which grants basic server access)
 
     message = DiscordMessage()
     message.append_join_message(context, True)
 
     await context.message.channel.send(message.message)
-    logger.info("join- " + user.display_name + "(" + str(user.id) + ")")
+    logger.info("join- %s(%s)", user.display_name, user.id)
 
 
 # Register for one or more courses
 @bot.command(name="register")
 async def register(context, *, arg):
-    requestor = context.author
+    # In deferred mode, acknowledge the command straight away and process it on the guild's background workers
+    state = guild_states.get(context.guild)
+    if state.config.register_deferred:
+        acknowledgement = DiscordMessage()
+        acknowledgement.append_registration_started(len(arg.split(',')))
+        reply = await context.message.channel.send(acknowledgement.message)
+        state.register_workers.submit(finish_registration, context, arg, reply)
+        logger.debug("register - deferred. %d waiting for a worker", state.register_workers.depth())
+
+    else:
+        message = await process_registration(context, arg)
+        await context.message.channel.send(message.message) # send the message to the channel!
+
+
+# Process a deferred register command and edit the acknowledgement with the results
+async def finish_registration(context, arg, reply):
+    # Unless it finishes, let the user know rather than leaving the acknowledgement up forever (even if the job is cancelled). The worker logs any exception
+    message = DiscordMessage()
+    message.append_registration_failed()
+    try:
+        with bot_metrics.time("buzzbot_register_background_seconds"):
+            message = await process_registration(context, arg)
+    finally:
+        action_queue.submit(("messages", reply.channel.id), lambda: reply.edit(content=message.message))
+
+
+# Do all the work of a register command
+# Returns the DiscordMessage to reply with
+async def process_registration(context, arg):
+    state = guild_states.get(context.guild)
     courses_raw = [x.strip() for x in arg.upper().split(',')] # split up each course request
-    
+
+    # Parse all the courses and hold the locks for every known one until all the changes have been committed
+    potential_courses = [Course(x, state.config.current_year, state.config.current_semester) for x in courses_raw]
+    known_courses = [x for x in potential_courses if state.catalog.get_title(x) is not None]
+
+    async with state.course_locks.acquire_all([x.get_registration_key() for x in known_courses]):
+        return await register_courses(context, state, potential_courses, known_courses)
+
+
+# Register the requestor for each of the parsed courses in the guild (whose GuildState is `state`). The caller must hold the course locks for the known courses
+# Returns the DiscordMessage to reply with
+async def register_courses(context, state, potential_courses, known_courses):
+    requestor = context.author
+    database = state.database
+    catalog = state.catalog
+    guilds, all_guilds = get_sharing_guilds(state) # a request may have been made in any guild using the database
+
     # Create the message to send to the user
     message = DiscordMessage()
 
+    # Look up the registrations and requests for every known course at once
+    available = await database.read(queries.get_courses_available, known_courses)
+    requested = await database.read(queries.get_courses_requested, [x for x in known_courses if x.get_registration_key() not in available])
+
+    # Collect every database change so they can all be applied in a single transaction at the end
+    transaction = Transaction()
+
     # iterate through all the courses they requested
-    for x in courses_raw:
-        potential_course = Course(x, CURRENT_YEAR, CURRET_SEMESTER)
-        logger.info("register - Processing course: " + potential_course.raw_string)
+    for potential_course in potential_courses:
+        registration_key = potential_course.get_registration_key()
+        logger.info("register - Processing course: %s", potential_course.raw_string)
 
-        # check if the course is valid by checking the database
-        course_row = db_get_course(potential_course)
+        # check if the course is valid by checking the catalog
+        course_title = catalog.get_title(potential_course)
 
-        # If "course_row" is populated from the database call, then the course was found in the database (ie it is valid)
-        if course_row:
-            logger.debug("register - course was valid: " + str(potential_course))
+        # If there is a title in the catalog, then the course is known (ie it is valid)
+        if course_title is not None:
+            logger.debug("register - course was valid: %s", potential_course)
             
-            # Set the title of the course, returned from the database call
-            potential_course.set_title(course_row[0][Courses_Columns.title.value])
+            # Set the title of the course, returned from the catalog
+            potential_course.set_title(course_title)
             
-            # get the registration information from the database
-            scheduled = db_get_course_available(potential_course)
-
-            # if "scheduled" is populated from the database call, then there are matching course offerings (registrations)
-            if scheduled:
-                logger.debug("register - " + requestor.display_name + "(" + str(requestor.id) + ") joining " + str(potential_course))
-
-                # Add them to the course in the database
-                db_join_course(requestor.id, requestor.display_name, scheduled[0][Registrar_Columns.category.value])
-
-                # Get the Discord channel category object and add them to the course (give them the correct Discord permissions)
-                category = context.guild.get_channel(scheduled[0][Registrar_Columns.category.value])
-                await category.set_permissions(requestor, view_channel=True, connect=True)
-                logger.info("register - " + requestor.display_name + "(" + str(requestor.id) + ") joined " + potential_course.get_full_name_and_semester())
-
-                # Add a new line to the message to the user
-                message.append_course_added(potential_course)
+            # get the registration information (category ID and the guild it's in) from the batched lookup
+            registration = available.get(registration_key)
+
+            # if there is a registration, then there is a matching course offering
+            if registration is not None:
+                category_id, guild_id = registration
+                logger.debug("register - %s(%s) joining %s", requestor.display_name, requestor.id, potential_course)
+
+                # Get the Discord channel category object. Its overflow guild may be unavailable, or the category deleted (!rebuild cleans that up)
+                category = get_course_category(context, category_id, guild_id)
+                if category is None:
+                    logger.warning("register - category %s of %s in guild %s can't be found", category_id, potential_course.get_full_name_and_semester(), guild_id)
+                    message.append_course_unreachable(potential_course)
+                    continue
+
+                # Add them to the course in the database and give them the correct Discord permissions
+                transaction.add(queries.join_course, requestor.id, requestor.display_name, category_id)
+                message.append_course_added(potential_course) # Add a new line to the message to the user
+                if category.guild is context.guild:
+                    action_queue.set_permissions(category, requestor, discord.PermissionOverwrite(view_channel=True, connect=True))
+                else:
+                    await append_course_in_other_server(message, potential_course, category, join_overflow_category(category, requestor))
+                logger.info("register - %s(%s) joined %s in %s", requestor.display_name, requestor.id, potential_course.get_full_name_and_semester(), category.guild.name)
                 
             # If there was not a current course offering, check the requests
             else:
                 logger.debug("register - course was not scheduled. checking requests")
                 
-                # get any requests for the course
-                request = db_get_course_requested(potential_course)
+                # get any requests for the course from the batched lookup, leaving out (and clearing) those by people who have left since
+                request = requested[registration_key] = drop_departed_requests(guilds, all_guilds, potential_course, requested.get(registration_key, []), transaction)
                 
-                # If "request" is populated from the database call, then it has been requested and we can add them to it
+                # If "request" is populated, then it has been requested and we can add them to it
                 if request:
-                    logger.debug("register - " + requestor.display_name + "(" + str(requestor.id) + ") had already requested " + potential_course.get_full_name_and_semester())
+                    logger.debug("register - %s(%s) had already requested %s", requestor.display_name, requestor.id, potential_course.get_full_name_and_semester())
                     
                     # get the full information of the previous requestor from the database call and then the Discord member object
-                    previous_requestor_id = request[0][Requests_Columns.user.value]
-                    previous_requestor = context.guild.get_member(previous_requestor_id) # TODO: Need to put a check here for if the previous requestor is no longer a member
+                    previous_requestor_id = request[0][queries.Requests_Columns.user.value]
+                    previous_requestor = find_member(guilds, previous_requestor_id) # still a member, the requests of those who left were dropped above
 
                     # If the new requestor was also the previous requestor
                     if previous_requestor_id == requestor.id:
-                        logger.info("register - course was already requested, duplicate request by " + previous_requestor.display_name)
+                        logger.info("register - course was already requested, duplicate request by %s", previous_requestor.display_name)
                         
                         # they've already requested it so just tell them they had already requested it in a new line in the message to the user
                         message.append_course_already_requested(potential_course)
@@ -349,82 +588,106 @@ async def register(context, *, arg):
                     else:
                         logger.debug("register - requestor was not previous requestor, creating course")
 
-                        # If we cannot create any more courses, then we've got a problem. Continue in the loop and process the next course
-                        if get_max_courses_remaining(context) < 1:
+                        # Reserve room for the course's channels in this guild, or once it's full in the overflow guild with the most room.
+                        # If we cannot create any more courses anywhere, then we've got a problem. Continue in the loop and process the next course
+                        guild = channel_budget.reserve_course_in(get_placement_guilds(context.guild, state))
+                        if guild is None:
                             message.append("If you're reading this then unfortunately we've hit the course limit for this server and we've created courses faster than @Rob can make room for")
                             continue
-                        
+
+                        # The requestors as members of the guild the course goes in. They may not be members of it yet, they get access once they join it
+                        members = [guild.get_member(x.id) for x in (previous_requestor, requestor)]
+
                         # Configure the permission overwrites
                         permission_overwrites = {
                             # set the default role to not see or connect to the channel (replicate the built-in "Private Category" switch)
-                            context.guild.default_role: discord.PermissionOverwrite(read_messages=False, connect=False),
-
-                            # Allow the requesting users to view and connect to the channel
-                            previous_requestor: discord.PermissionOverwrite(view_channel=True, connect=True),
-                            requestor: discord.PermissionOverwrite(view_channel=True, connect=True)
+                            guild.default_role: discord.PermissionOverwrite(read_messages=False, connect=False),
                         }
-
-                        # Create the category and associated channels on Discord with appropriate permissions
-                        category = await context.guild.create_category(potential_course.get_category_name(), overwrites=permission_overwrites) # Create the category
-                        
-                        channel_name_suffix = potential_course.get_channel_postfix_name().lower() # set the suffix to be used in each channel
-                        await context.guild.create_text_channel("general-" + channel_name_suffix, category=category) # create the general text chat
-                        await context.guild.create_text_channel("hw-" + channel_name_suffix, category=category) # create the hw text chat
-                        await context.guild.create_voice_channel("voice-chat-" + channel_name_suffix, category=category) # create the voice chat
+                        for member in members: # Allow the requesting users to view and connect to the channel
+                            if member is not None:
+                                permission_overwrites[member] = discord.PermissionOverwrite(view_channel=True, connect=True)
+
+                        # Create the category on Discord with appropriate permissions. Its ID is needed for everything else so wait for it
+                        category_name = potential_course.get_category_name()
+                        try:
+                            category = await action_queue.submit(("channels", guild.id), lambda: guild.create_category(category_name, overwrites=permission_overwrites)) # Create the category
+                        except Exception:
+                            channel_budget.release_course(guild)
+                            raise
+
+                        # Create the associated channels in the background while the rest of the command is processed. Once they exist the channel events count them, so the reservation can go
+                        channels_created = create_course_channels(guild, potential_course, category)
+                        channels_created.add_done_callback(lambda f, guild=guild: channel_budget.release_course(guild))
 
                         # Check the server limits and log them.
                         check_limits(context)
 
-                        # Do all the associated database calls
-                        db_create_course_registration(potential_course, category.id) # create the course in the registrar
-                        db_join_course(requestor.id, requestor.display_name, category.id) # add current requestor to it
-                        db_join_course(previous_requestor_id, previous_requestor.display_name, category.id) # add previous requestor to it
-                        db_clear_request(potential_course, previous_requestor_id) # clear the request now that it's been fulfilled
-                        
+                        # Queue all the associated database changes
+                        transaction.add(queries.create_course_registration, potential_course, category.id, guild.id) # create the course in the registrar
+                        transaction.add(queries.join_course, requestor.id, requestor.display_name, category.id) # add current requestor to it
+                        transaction.add(queries.join_course, previous_requestor_id, previous_requestor.display_name, category.id) # add previous requestor to it
+                        transaction.add(queries.clear_request, potential_course, previous_requestor_id) # clear the request now that it's been fulfilled
+
+                        # The course now exists, so a repeat of it later in this command joins it instead of creating it again
+                        available[registration_key] = (category.id, guild.id)
+                        del requested[registration_key]
 
                         # Append to the message to the user
                         message.append_course_added(potential_course, f"{requestor.mention} - ")
                         message.append_course_previously_requested_added(potential_course, f"{previous_requestor.mention} - ")
+                        for user, member in zip((previous_requestor, requestor), members):
+                            if guild is not context.guild or member is None: # ie the previous requestor is only in an overflow guild
+                                await append_course_in_other_server(message, potential_course, category, member is not None, f"{user.mention} - ", guild is not context.guild)
                         
-                        logger.info("register - course was already requested by " + previous_requestor.display_name + "(" + str(previous_requestor.id) + "). Created course and added " + requestor.display_name + "(" + str(requestor.id) + ")")
+                        logger.info("register - course was already requested by %s(%s). Created course and added %s(%s)", previous_requestor.display_name, previous_requestor.id, requestor.display_name, requestor.id)
                 
                 else: # if the course has not been requested
                     logger.debug("register - course has not been requested. Creating request")
-                    db_request_course(potential_course, requestor.id, requestor.display_name)
-                    logger.info("register - course had not been requested. Created request by " + requestor.display_name + "(" + str(requestor.id) + ")" + " for " + potential_course.get_full_name())
+                    transaction.add(queries.request_course, potential_course, requestor.id, requestor.display_name)
+                    requested[registration_key] = [registration_key + (requestor.id, requestor.display_name, potential_course.semester.sort_key, int(time.time()))] # a repeat of it later in this command is a duplicate request
+                    logger.info("register - course had not been requested. Created request by %s(%s) for %s", requestor.display_name, requestor.id, potential_course.get_full_name())
                     
                     # Append to the message to the user
                     message.append_course_requested(potential_course)
 
         else: # if the course was not valid
-            logger.debug("register - course is not valid: " + x)
+            logger.debug("register - course is not valid: %s", potential_course.raw_string)
 
-            if db_is_course_special_topics(potential_course): # if that course is a special topics course, then they specified something incorrectly
-                logger.info("register - course is special topics course but topic did not match a known one: " + potential_course.get_full_name())
+            if catalog.is_special_topics(potential_course): # if that course is a special topics course, then they specified something incorrectly
+                logger.info("register - course is special topics course but topic did not match a known one: %s", potential_course.get_full_name())
                 
                 # Append to the message to the user
                 message.append_course_unknown_topic(potential_course)
 
             else:
-                logger.info("register - course is entirely unknown (not special topics): " + potential_course.get_full_name())
+                logger.info("register - course is entirely unknown (not special topics): %s", potential_course.get_full_name())
                 # Append to the message to the user
                 message.append_course_unknown(potential_course)
+
+            # Suggest the known courses that look most like what they typed
+            suggestions = catalog.suggest(potential_course)
+            if suggestions:
+                message.append_course_suggestions(suggestions)
     
     message.append("--------------------") # Append a dashed line to separate each course
 
-
     # If they tried to register in the welcome channel before "joining", just give them access because they clearly know more or less what's going on
-    if discord.utils.find(lambda r: r.name == 'Yellow Jackets', context.message.guild.roles) not in context.message.author.roles:
-        await context.message.author.add_roles(discord.utils.get(context.guild.roles, name="Yellow Jackets")) # give the Yellow Jackets role (which grants basic server access)
-        logger.info("automatically added after failling to follow join instructions- " + context.message.author.display_name + "(" + str(context.message.author.id) + ")")
+    if not command_gate.has_member_role(context.message.author):
+        add_role(context.message.author, command_gate.get_member_role(context.guild)) # give the member role (Yellow Jackets, which grants basic server access)
+        logger.info("automatically added after failling to follow join instructions- %s(%s)", context.message.author.display_name, context.message.author.id)
         message.append_join_message(context, False) # Provide the context and indicate that the initial instructions were not followed (just changes the message slightly)
 
-    await context.message.channel.send(message.message) # send the message to the channel!
+    # Apply all the database changes for every course in one transaction. The queued Discord changes finish in the background
+    await database.run(transaction.apply)
+
+    return message
 
 
 # Create a new course
 @bot.command(name="add")
 async def add(context, *, arg):
+    state = guild_states.get(context.guild)
+
     # split the command arguments using a space
     arg_components = arg.split(' ')
 
@@ -437,59 +700,284 @@ async def add(context, *, arg):
     # if the new course is not possible, they likely didn't follow the format.
     if not new_course.is_possible:
         message.append_add_misunderstood(arg)
-        logger.info("add - course not possible? : " + arg)
+        logger.info("add - course not possible? : %s", arg)
 
     else:
-        logger.info("add - course created in database: " + new_course.get_full_name())
+        logger.info("add - course created in database: %s", new_course.get_full_name())
         # Join the remaining arguments into a single string and set it as the course title
         new_course.set_title(' '.join(arg_components[1:]))
 
-        # create the course in the database
-        db_create_course(new_course)
+        # create the course in the database and keep the in-memory catalog in sync
+        await state.database.write(queries.create_course, new_course)
+        state.catalog.add(new_course)
 
         # the message to send back to the requestor
         message.append_added_to_memory(new_course)
 
     await context.message.channel.send(message.message) # send the message to the channel!
 
+# Bulk import a course catalog (a CSV or JSON file attached to the message), see catalog_import.py
+@bot.command(name="import")
+@admin_only()
+async def import_catalog(context, *args):
+    state = guild_states.get(context.guild)
+    message = DiscordMessage()
+
+    if len(context.message.attachments) == 0:
+        message.append_catalog_import_misunderstood()
+        await context.message.channel.send(message.message)
+        return
+
+    attachment = context.message.attachments[0]
+    format = "json" if attachment.filename.lower().endswith((".json", ".jsonl")) else "csv"
+    dry_run = "dry-run" in args or "--dry-run" in args
+    logger.info("import - importing %s%s", attachment.filename, " (dry run)" if dry_run else "")
+
+    try:
+        text = (await attachment.read()).decode("utf-8-sig")
+        result = await state.database.run(catalog_import.import_catalog, catalog_import.read_rows(io.StringIO(text, newline=""), format), dry_run)
+    except (ValueError, AttributeError, TypeError, csv.Error) as error: # a malformed file, nothing was imported
+        logger.warning("import - could not read %s: %s", attachment.filename, error)
+        message.append_catalog_import_failed(attachment.filename, error)
+    else:
+        if not dry_run:
+            state.catalog.replace(await state.database.run(Catalog.read)) # pick up the new courses and titles, indexed on the database thread
+        message.append_catalog_imported(result, dry_run)
+
+    await context.message.channel.send(message.message)
+
 # Check the server limits
 @bot.command(name="checklimits")
 async def checklimits(context):
     await context.message.channel.send(check_limits(context)) # send the message to the channel!
     
 
-# Rebuild the database of courses and registrations
-# @bot.command(name="rebuild")
-# async def rebuild(context):
-#     for category in context.message.guild.categories:
-#         print(category.name + ": " + str(category.id))
-        # temp = category.name.split(' ')
-        # if len(temp) > 4:
-        #     dept = temp[0]
-        #     course = temp[1]
-        #     temp2 = 
-        #     semester = 
-        #     title = ' '.join(temp[4:])
-        #     print(title)
-
-# Drop a course
-# @bot.command(name="drop")
-# async def drop(context, *, arg):
+# Start a new semester: archive the past semesters and delete their course categories. Ex: `!rollover fall 2022`
+# With no semester it just clears out everything before the current one. Add "dry-run" to only report what would change
+# It applies to the guild's database, so every guild sharing that database moves on too
+@bot.command(name="rollover")
+@admin_only()
+async def rollover_semester(context, *args):
+    dry_run = "dry-run" in args or "--dry-run" in args
+    semester_args = [x for x in args if x not in ("dry-run", "--dry-run")]
+    state = guild_states.get(context.guild)
+    message = DiscordMessage()
+
+    current_semester = state.config.semester
+    semester = rollover.parse_semester(semester_args) if semester_args else current_semester
+    if semester is None or semester < current_semester:
+        message.append_rollover_misunderstood(" ".join(semester_args), current_semester)
+        await context.message.channel.send(message.message)
+        return
+
+    # Archive the database first, so nothing is left pointing at the categories once they're gone
+    sharing = guild_states.sharing(state.database)
+    async with state.reconcile_lock:
+        result = await state.database.run(rollover.archive_semesters, semester, dry_run)
+        if not dry_run:
+            for other in sharing:
+                other.config.current_year, other.config.current_semester = semester.year, semester.semester
+
+    guilds = [guild for guild in (bot.get_guild(other.guild_id) for other in sharing) if guild is not None]
+    retired = rollover.get_retired_categories(guilds, semester)
+    result.categories = len(retired)
+    failed = 0 if dry_run else await retire_categories(retired, state.config.rollover_batch_size)
+
+    message.append_rollover_finished(result, failed, dry_run)
+    await context.message.channel.send(message.message) # send the message to the channel!
+
+# Reload the config file and environment without restarting (see config.py)
+@bot.command(name="reload")
+@admin_only()
+async def reload(context):
+    message = DiscordMessage()
+    try:
+        changed, restart_needed = await reload_config()
+    except ConfigError as error:
+        message.append_config_invalid(error)
+    else:
+        message.append_config_reloaded(changed, restart_needed)
+    await context.message.channel.send(message.message) # send the message to the channel!
+
+# Bring the database back in sync with the course categories. Add "dry-run" to only report what would change
+@bot.command(name="rebuild")
+@admin_only()
+async def rebuild(context, *args):
+    dry_run = "dry-run" in args or "--dry-run" in args
+    fixes = await reconcile_guilds(guild_states.get(context.guild), dry_run)
+
+    message = DiscordMessage()
+    message.append_rebuild_finished(fixes, dry_run)
+    await context.message.channel.send(message.message) # send the message to the channel!
+
+# List the courses the user is in
+@bot.command(name="schedule")
+async def schedule(context):
+    rows = await guild_states.get(context.guild).database.read(queries.get_member_schedule, context.author.id)
+
+    courses = []
+    for row in rows:
+        category = get_course_category(context, row[0], row[6])
+        in_other_server = category is not None and category.guild is not context.guild
+        courses.append((get_schedule_course(row), row[7], category.guild.name if in_other_server else None))
+
+    message = DiscordMessage()
+    message.append_schedule(courses)
+    await context.message.channel.send(message.message) # send the message to the channel!
+
+# Drop a course, a list of courses or "all" of them
+@bot.command(name="drop")
+async def drop(context, *, arg = ""):
+    await change_courses(context, arg, "drop")
+
+# Hide a course, a list of courses or "all" of them from the sidebar. They stay in the schedule so !show can bring them back
+@bot.command(name="hide")
+async def hide(context, *, arg = ""):
+    await change_courses(context, arg, "hide")
+
+# Show courses that were hidden again
+@bot.command(name="show")
+async def show(context, *, arg = ""):
+    await change_courses(context, arg, "show")
+
+# Drop, hide or show (the command) the user's courses named in the argument. One query reads their schedule, one transaction
+# changes it and the permission changes for every course are queued at once
+async def change_courses(context, arg, command):
+    state = guild_states.get(context.guild)
+    user = context.author
+    message = DiscordMessage()
+
+    if not arg.strip():
+        message.append_schedule_change_misunderstood(command)
+        await context.message.channel.send(message.message)
+        return
+
+    rows, missing = select_schedule_rows(state, await state.database.read(queries.get_member_schedule, user.id), arg)
+    category_ids = [row[0] for row in rows]
+
+    if rows:
+        if command == "drop":
+            await state.database.write(queries.leave_courses, user.id, category_ids)
+            set_course_permissions(context, user, rows, None)
+            message.append_courses_changed("Dropped", [get_schedule_course(row) for row in rows])
+        else:
+            hidden = command == "hide"
+            await state.database.write(queries.set_courses_hidden, user.id, category_ids, hidden)
+            changed = [row for row in rows if bool(row[7]) != hidden] # the ones already hidden (or shown) don't need a Discord call
+            set_course_permissions(context, user, changed, None if hidden else discord.PermissionOverwrite(view_channel=True, connect=True))
+            message.append_courses_changed("Hidden" if hidden else "Shown", [get_schedule_course(row) for row in rows])
+        logger.info("%s - %s(%s): %d courses", command, user.display_name, user.id, len(rows))
+
+    if missing:
+        message.append_courses_not_in_schedule(missing)
+    elif not rows: # "all" with no courses
+        message.append_schedule([])
+    await context.message.channel.send(message.message) # send the message to the channel!
 
 ################################ Event Functions #################################
 # These are functions that are automatically triggereg based on specific events
 
+# Triggers once the bot has connected and the guild cache is filled in (and again after a reconnect)
+# Every guild is opened at once, so a guild with a big database to migrate doesn't hold up the others
+@bot.event
+async def on_ready():
+    states = await asyncio.gather(*(open_guild(guild) for guild in bot.guilds))
+    await start_background_tasks()
+    await asyncio.gather(*(reconcile_on_startup(state) for state in states if state is not None))
+
+# Reconcile a guild's database once after it's first opened, if its settings ask for it. Guilds sharing the database are covered too
+async def reconcile_on_startup(state):
+    if state.config.reconcile_on_startup and not state.reconciled_on_startup:
+        for other in guild_states.sharing(state.database):
+            other.reconciled_on_startup = True
+        await reconcile_guilds(state)
+
+# Keep the channel count and the cached command channels and roles up to date
+@bot.event
+async def on_guild_channel_create(channel):
+    channel_budget.channel_created(channel)
+    command_gate.channel_changed(channel)
+
+@bot.event
+async def on_guild_channel_delete(channel):
+    channel_budget.channel_deleted(channel)
+    command_gate.channel_changed(channel)
+
+@bot.event
+async def on_guild_channel_update(before, after):
+    if before.name != after.name:
+        command_gate.channel_changed(after)
+
+@bot.event
+async def on_guild_role_create(role):
+    command_gate.role_changed(role)
+
+@bot.event
+async def on_guild_role_delete(role):
+    command_gate.role_changed(role)
+
+@bot.event
+async def on_guild_role_update(before, after):
+    if before.name != after.name:
+        command_gate.role_changed(after)
+
+@bot.event
+async def on_guild_join(guild):
+    state = await open_guild(guild)
+    if state is not None:
+        await reconcile_on_startup(state)
+
 # Triggers whenever a member joins the server
 @bot.event
 async def on_member_join(new_member):
+    # Give them access to the course groups they've registered for in this guild (ie an overflow guild they were sent an invite to)
+    state = guild_states.get(new_member.guild)
+    if state is not None:
+        for category_id in await state.database.read(queries.get_member_courses_in_guild, new_member.id, new_member.guild.id):
+            category = new_member.guild.get_channel(category_id)
+            if category is not None:
+                action_queue.set_permissions(category, new_member, discord.PermissionOverwrite(view_channel=True, connect=True))
+
     welcome_channel = discord.utils.get(new_member.guild.text_channels, name="welcome")
-    await welcome_channel.send(f"Hi {new_member.mention}! I'm the BuzzBot. I'm here to help get you situated. To complete the joining process please message back with \"!join\"")
+    if welcome_channel is None: # overflow guilds only hold course groups
+        return
+    welcome = f"Hi {new_member.mention}! I'm the BuzzBot. I'm here to help get you situated. To complete the joining process please message back with \"!join\""
+    action_queue.submit(("messages", welcome_channel.id), lambda: welcome_channel.send(welcome))
+
+# Triggers whenever a member leaves the server (or is kicked or banned). Their pending requests and schedule go, so nobody
+# else's registration is held up by them and no Discord calls are spent on them
+@bot.event
+async def on_member_remove(member):
+    state = guild_states.get(member.guild)
+    if state is not None:
+        purge_departed_member(state, member)
+
+# Tell a non-admin who tried an admin command that they can't use it. Every other error is handled the default way
+@bot.event
+async def on_command_error(context, error):
+    if isinstance(error, commands.CheckFailure):
+        logger.info("%s - refused for %s(%s), who isn't an admin", context.command, context.author.display_name, context.author.id)
+        message = DiscordMessage()
+        message.append_admin_only(context.command)
+        await context.message.channel.send(message.message)
+    else:
+        await commands.Bot.on_command_error(bot, context, error)
 
 # Watch all messages so as to only actually process the commands above in certain channels or if they're from an admin
 @bot.event
 async def on_message(message):
-    if message.channel.name == 'course-requests' or message.channel.name == 'welcome' or message.channel.name == 'bot-testing' or discord.utils.find(lambda r: r.name == 'Admin', message.guild.roles) in message.author.roles:
-        await bot.process_commands(message)
-
-# Get the Discord token from the environment and run the bot
-bot.run(os.getenv('BUZZ_BOT_TOKEN'))
\ No newline at end of file
+    # Most messages aren't commands, so check the prefix before anything else
+    if not message.content.startswith(bot.command_prefix):
+        return
+    # A guild's commands are only processed once its state is open (see on_ready). If it couldn't be opened, say so rather than ignore them
+    if command_gate.allows(message):
+        if guild_states.get(message.guild) is not None:
+            await bot.process_commands(message)
+        elif not message.author.bot: # like process_commands, other bots are ignored
+            reply = DiscordMessage()
+            reply.append_not_ready()
+            await message.channel.send(reply.message)
+
+# Get the Discord token from the environment and run the bot. Only when run as a script, so benchmarks/load_test.py can import it
+if __name__ == "__main__":
+    bot.run(os.getenv('BUZZ_BOT_TOKEN'))
\ No newline at end of file
@@ -0,0 +1,96 @@
+import logging
+from course import Course
+from suggestions import SuggestionIndex
+import queries
+
+logger = logging.getLogger(__name__)
+
+class Catalog:
+    """An in-memory copy of the courses table
+
+    The catalog is small and only changes through !add, so it is loaded once at startup and then kept up to date
+    as courses are created. Lookups never touch the database.
+    """
+
+    def __init__(self):
+        self.courses = {} # (dept, code, topic) -> title
+        self.special_topics = set() # (dept, code) of every special topics course
+        self.suggestions = SuggestionIndex() # for suggesting known courses when one isn't recognized
+
+    def load(self, rows):
+        """Replace the catalog with the given rows of the courses table
+
+        Args:
+            rows (list): (dept, course, topic, title, special) rows
+        """
+
+        self.courses = {}
+        self.special_topics = set()
+        self.suggestions = SuggestionIndex()
+        for dept, code, topic, title, special in rows:
+            self._add(dept, code, str(topic), title, special)
+        logger.info("Catalog loaded: %d courses", len(self.courses))
+
+    @staticmethod
+    def read(conn):
+        """Build a catalog from the courses table. Indexing tens of thousands of courses takes seconds, so this runs on a
+        database thread (ie database.read(Catalog.read)) and the result is swapped in with replace
+
+        Returns:
+            Catalog: the catalog
+        """
+
+        catalog = Catalog()
+        catalog.load(queries.get_all_courses(conn))
+        return catalog
+
+    def replace(self, other):
+        """Swap in everything from another catalog (see read), so everyone holding this one sees the new courses"""
+
+        self.courses, self.special_topics, self.suggestions = other.courses, other.special_topics, other.suggestions
+
+    def _add(self, dept, code, topic, title, special):
+        self.courses[(dept, code, topic)] = title
+        self.suggestions.add(dept, code, topic)
+        if special:
+            self.special_topics.add((dept, code))
+
+    def add(self, course : Course):
+        """Add a newly created course to the catalog"""
+
+        self._add(course.dept, course.code, course.topic, course.title, course.topic != "0")
+
+    def get_title(self, course : Course):
+        """Get the title of a known course
+
+        Returns:
+            string: the course title, or None if the course is unknown
+        """
+        return self.courses.get((course.dept, course.code, course.topic))
+
+    def is_special_topics(self, course : Course):
+        """Check if the course (ignoring the topic) is a known special topics course"""
+
+        return (course.dept, course.code) in self.special_topics
+
+    def get_topics(self, dept : str, code : str):
+        """Get the known topics of a course ("0" for a course that isn't special topics)
+
+        Returns:
+            set: the topics, empty if the course is unknown
+        """
+        return self.suggestions.topics.get((dept, code), set())
+
+    def suggest(self, course : Course, limit = 3):
+        """Suggest the known courses closest to a course that wasn't recognized
+
+        Returns:
+            list: (dept, code, topic, title) of up to `limit` courses, closest first
+        """
+
+        if course.is_possible:
+            text = course.dept + course.code
+        else:
+            text = "".join(course.raw_string.split()).upper().split("-")[0] # just use whatever was typed before any dash
+
+        return [(dept, code, topic, self.courses[(dept, code, topic)]) for dept, code, topic in self.suggestions.suggest(text, course.topic, limit)]
@@ -0,0 +1,172 @@
+"""Bulk import of a course catalog into the courses table
+
+Used by the !import admin command, and also runs on its own against a guild's database (ie to seed a new semester or
+department before starting the bot):
+    python catalog_import.py catalog.csv [--guild 123456789 | --database GT-123456789.db] [--format csv|json] [--dry-run]
+
+A CSV needs a header row with dept, course (or code) and title columns, and optionally a topic column. JSON can be a
+list of objects with the same keys, or one object per line.
+"""
+
+import argparse, csv, itertools, json, logging, os, sqlite3
+from course import parse_course_string
+from config import get_database_path
+import migrations
+
+logger = logging.getLogger(__name__)
+
+# Rows sent to executemany at a time, so a huge file isn't held in memory all at once
+BATCH_SIZE = 5000
+
+SQL_INSERT_COURSE = "INSERT INTO courses (dept, course, topic, title, special) VALUES (?, ?, ?, ?, ?)"
+SQL_UPDATE_COURSE_TITLE = "UPDATE courses SET title=? WHERE dept=? AND course=? AND topic=?"
+
+class ImportResult:
+    """The counts of what an import did"""
+
+    def __init__(self):
+        self.inserted = 0 # new courses
+        self.updated = 0 # known courses with a new title
+        self.unchanged = 0 # known courses with the same title
+        self.invalid = 0 # rows that aren't a possible course or have no title
+        self.duplicates = 0 # rows repeating a course earlier in the same import
+
+    @property
+    def skipped(self):
+        return self.unchanged + self.invalid + self.duplicates
+
+    def __str__(self):
+        return '{} inserted, {} updated, {} skipped ({} unchanged, {} invalid, {} duplicates)'.format(
+            self.inserted, self.updated, self.skipped, self.unchanged, self.invalid, self.duplicates)
+
+def read_rows(text_stream, format = "csv"):
+    """Read catalog rows from a CSV or JSON stream
+
+    Yields:
+        dict: one row of the catalog
+    """
+
+    if format == "csv":
+        yield from csv.DictReader(text_stream)
+        return
+
+    if format != "json":
+        raise ValueError("Unknown catalog format: " + format)
+
+    # Either a single JSON list or one JSON object per line (which can be streamed)
+    first = text_stream.read(1)
+    while first.isspace():
+        first = text_stream.read(1)
+    if first == "[":
+        yield from json.loads(first + text_stream.read())
+        return
+
+    for line in itertools.chain([first + text_stream.readline()], text_stream):
+        if line.strip():
+            yield json.loads(line)
+
+def normalize_row(row):
+    """Turn a catalog row into a courses row
+
+    Returns:
+        tuple: (dept, course, topic, title, special), or None if the row isn't a valid course
+    """
+
+    lowered = {str(key).strip().lower(): value for key, value in row.items() if key is not None}
+    dept = str(lowered.get("dept") or "")
+    code = str(lowered.get("course") or lowered.get("code") or "")
+    topic = str(lowered.get("topic") or "0").strip()
+    title = str(lowered.get("title") or "").strip()
+
+    course_string = dept + code + ("-" + topic if topic != "0" else "")
+    parsed = parse_course_string(course_string)
+    if parsed is None or not title:
+        return None
+
+    dept, code, topic, is_special_topic, _ = parsed
+    return (dept, code, topic, title, 1 if is_special_topic else 0)
+
+def import_catalog(conn, rows, dry_run = False):
+    """Import catalog rows into the courses table in a single transaction
+
+    New courses are inserted and known courses get their title updated. Runs on the database thread when used by the bot.
+
+    Args:
+        conn (sqlite3.Connection): the database connection
+        rows: the catalog rows (see read_rows)
+        dry_run (bool): count what would change without changing anything
+
+    Returns:
+        ImportResult: the counts of what was (or would be) done
+    """
+
+    result = ImportResult()
+    known = {(dept, code, str(topic)): title for dept, code, topic, title in conn.execute("SELECT dept, course, topic, title FROM courses")}
+    seen = set()
+    inserts = []
+    updates = []
+
+    def flush():
+        if not dry_run:
+            conn.executemany(SQL_INSERT_COURSE, inserts)
+            conn.executemany(SQL_UPDATE_COURSE_TITLE, updates)
+        inserts.clear()
+        updates.clear()
+
+    with conn: # commits everything at the end, or nothing if anything fails
+        for row in rows:
+            course = normalize_row(row)
+            if course is None:
+                result.invalid += 1
+                continue
+
+            dept, code, topic, title, special = course
+            key = (dept, code, topic)
+            if key in seen:
+                result.duplicates += 1
+                continue
+            seen.add(key)
+
+            if key not in known:
+                inserts.append(course)
+                result.inserted += 1
+            elif known[key] != title:
+                updates.append((title, dept, code, topic))
+                result.updated += 1
+            else:
+                result.unchanged += 1
+
+            if len(inserts) + len(updates) >= BATCH_SIZE:
+                flush()
+        flush()
+
+    logger.info("Catalog import%s: %s", " (dry run)" if dry_run else "", result)
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import a course catalog into the courses table")
+    parser.add_argument("catalog", help="CSV or JSON catalog export")
+    parser.add_argument("--database", help="path to the database (default: the guild's, see DATABASE_PATH)")
+    parser.add_argument("--guild", type=int, help="ID of the guild whose database to use")
+    parser.add_argument("--format", choices=["csv", "json"], help="catalog format (default: from the file extension)")
+    parser.add_argument("--dry-run", action="store_true", help="count what would change without changing anything")
+    args = parser.parse_args()
+
+    format = args.format or ("json" if args.catalog.lower().endswith((".json", ".jsonl")) else "csv")
+
+    database = args.database or get_database_path(os.getenv("DATABASE_PATH", ""), args.guild)
+    if database is None:
+        parser.error("each guild has its own database, give --guild or --database")
+
+    conn = sqlite3.connect(database)
+    try:
+        migrations.migrate(conn)
+        with open(args.catalog, newline="", encoding="utf-8-sig") as catalog_file:
+            result = import_catalog(conn, read_rows(catalog_file, format), dry_run=args.dry_run)
+    finally:
+        conn.close()
+
+    print(("Would have imported: " if args.dry_run else "Imported: ") + str(result))
+
+if __name__ == "__main__":
+    main()
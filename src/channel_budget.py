@@ -0,0 +1,97 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+class ChannelBudget:
+    """Keeps count of each guild's channels so capacity checks don't have to recount the guild
+
+    The count includes text channels, voice channels and categories (Discord's 500 channel limit counts all of
+    them). It is built once from the guild cache and then kept up to date from the channel create/delete events.
+    Course groups that are being created but don't have all their channels yet are reserved, so a burst of course
+    creation can't overshoot the limit.
+    """
+
+    def __init__(self, limit = 500, channels_per_course = 4):
+        self.limit = limit # for guilds without a limit of their own
+        self.limits = {} # guild ID -> the guild's limit
+        self.channels_per_course = channels_per_course # a category plus the general, hw and voice channels
+        self.counts = {} # guild ID -> number of channels
+        self.reserved = {} # guild ID -> number of channels reserved for course groups being created
+
+    def build(self, guild):
+        """(Re)count a guild's channels from the guild cache"""
+
+        self.counts[guild.id] = len(guild.channels)
+        logger.info("Channel budget for %s: %d of %d channels used", guild.name, self.counts[guild.id], self.get_limit(guild))
+
+    def set_limit(self, guild, limit : int):
+        """Set a guild's own channel limit"""
+
+        self.limits[guild.id] = limit
+
+    def get_limit(self, guild):
+        """Get the most channels the guild can have"""
+
+        return self.limits.get(guild.id, self.limit)
+
+    def channel_created(self, channel):
+        """Count a new channel (from the guild_channel_create event)"""
+
+        if channel.guild.id in self.counts:
+            self.counts[channel.guild.id] += 1
+
+    def channel_deleted(self, channel):
+        """Stop counting a deleted channel (from the guild_channel_delete event)"""
+
+        if channel.guild.id in self.counts:
+            self.counts[channel.guild.id] -= 1
+
+    def get_total_channels(self, guild):
+        """Get the number of channels in the guild"""
+
+        if guild.id not in self.counts:
+            self.build(guild)
+        return self.counts[guild.id]
+
+    def get_channels_remaining(self, guild):
+        """Get the number of channels that can still be created, leaving out the reserved ones"""
+
+        return self.get_limit(guild) - self.get_total_channels(guild) - self.reserved.get(guild.id, 0)
+
+    def get_courses_remaining(self, guild):
+        """Get the max number of course groups that could still be created"""
+
+        return max(0, self.get_channels_remaining(guild) // self.channels_per_course)
+
+    def reserve_course(self, guild):
+        """Reserve the channels for a course group that is about to be created
+
+        Returns:
+            bool: False (and reserves nothing) if there isn't room for it
+        """
+
+        if self.get_courses_remaining(guild) < 1:
+            return False
+        self.reserved[guild.id] = self.reserved.get(guild.id, 0) + self.channels_per_course
+        return True
+
+    def reserve_course_in(self, guilds):
+        """Reserve the channels for a course group in the first guild, or once it's full, in the one of the rest with the most room
+
+        Returns:
+            discord.Guild: the guild the channels were reserved in, or None if none of them have room
+        """
+
+        if not guilds:
+            return None
+        if self.reserve_course(guilds[0]):
+            return guilds[0]
+        overflow = max(guilds[1:], key=self.get_courses_remaining, default=None)
+        if overflow is not None and self.reserve_course(overflow):
+            return overflow
+        return None
+
+    def release_course(self, guild):
+        """Release a reservation once the course group's channels exist (or failed to be created)"""
+
+        self.reserved[guild.id] = max(0, self.reserved.get(guild.id, 0) - self.channels_per_course)
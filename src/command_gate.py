@@ -0,0 +1,117 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+class GuildGate:
+    """The IDs a guild's messages are checked against"""
+
+    __slots__ = ("channels", "admin_role", "member_role")
+
+    def __init__(self, channels : frozenset, admin_role, member_role):
+        self.channels = channels # IDs of the channels anyone can use commands in
+        self.admin_role = admin_role # ID of the admin role, None if the guild doesn't have one
+        self.member_role = member_role # ID of the member role (which grants basic server access), None if the guild doesn't have one
+
+
+class CommandGate:
+    """Decides which messages the bot processes commands from, without scanning the guild for every message
+
+    Commands are only processed in the command channels, or from members with the admin role. The channels and
+    roles are configured by name (per guild if it has names of its own), so their IDs are looked up once per guild
+    and cached. The cache is rebuilt whenever one of those channels or roles is created, deleted or renamed (see
+    the channel and role events in buzz-bot.py) or the configured names change.
+    """
+
+    def __init__(self, channel_names, admin_role : str, member_role : str):
+        self.guilds = {} # guild ID -> GuildGate
+        self.names = {} # guild ID -> (command channel names, admin role name, member role name), for guilds with their own
+        self.configure(channel_names, admin_role, member_role)
+
+    def configure(self, channel_names, admin_role : str, member_role : str, guild_id = None):
+        """Set the names to look for, in one guild or (with no guild_id) in every guild without names of its own
+
+        The guilds' IDs are looked up again the next time they're needed.
+        """
+
+        names = (frozenset(channel_names), admin_role, member_role)
+        if guild_id is None:
+            self.default_names = names
+            self.guilds = {id: gate for id, gate in self.guilds.items() if id in self.names}
+        else:
+            self.names[guild_id] = names
+            self.guilds.pop(guild_id, None)
+
+    def get_names(self, guild_id : int):
+        """Get the (command channel names, admin role name, member role name) a guild is configured with"""
+
+        return self.names.get(guild_id, self.default_names)
+
+    def build(self, guild):
+        """(Re)look up a guild's command channel and role IDs"""
+
+        channel_names, admin_role_name, member_role_name = self.get_names(guild.id)
+        channels = frozenset(channel.id for channel in guild.text_channels if channel.name in channel_names)
+        admin_role = next((role.id for role in guild.roles if role.name == admin_role_name), None)
+        member_role = next((role.id for role in guild.roles if role.name == member_role_name), None)
+        self.guilds[guild.id] = gate = GuildGate(channels, admin_role, member_role)
+        logger.debug("Command gate for %s: %d command channels, admin role %s, member role %s", guild.name, len(channels), admin_role, member_role)
+        return gate
+
+    def channel_changed(self, channel):
+        """Rebuild the guild's IDs if a created, deleted or renamed channel is (or was) a command channel"""
+
+        gate = self.guilds.get(channel.guild.id)
+        if gate is not None and (channel.id in gate.channels or channel.name in self.get_names(channel.guild.id)[0]):
+            self.build(channel.guild)
+
+    def role_changed(self, role):
+        """Rebuild the guild's IDs if a created, deleted or renamed role is (or was) the admin or member role"""
+
+        gate = self.guilds.get(role.guild.id)
+        if gate is not None and (role.id in (gate.admin_role, gate.member_role) or role.name in self.get_names(role.guild.id)[1:]):
+            self.build(role.guild)
+
+    def get(self, guild):
+        """Get a guild's IDs, looking them up if they aren't cached"""
+
+        gate = self.guilds.get(guild.id)
+        return gate if gate is not None else self.build(guild)
+
+    def allows(self, message):
+        """Check if commands in the message should be processed"""
+
+        if message.guild is None: # direct messages aren't supported
+            return False
+        gate = self.get(message.guild)
+        return message.channel.id in gate.channels or self._has_role(message.author, gate.admin_role)
+
+    def get_member_role(self, guild):
+        """Get the member role of a guild
+
+        Returns:
+            discord.Role: the role, or None if the guild doesn't have one
+        """
+
+        role_id = self.get(guild).member_role
+        return guild.get_role(role_id) if role_id is not None else None
+
+    def is_admin(self, member):
+        """Check if a member has the admin role"""
+
+        return self._has_role(member, self.get(member.guild).admin_role)
+
+    def has_member_role(self, member):
+        """Check if a member already has the member role"""
+
+        return self._has_role(member, self.get(member.guild).member_role)
+
+    def _has_role(self, member, role_id):
+        # Member.roles builds and sorts a list of Role objects on every call. The role IDs it is built from are a
+        # sorted array with a binary search (discord.py 1.7's private Member._roles), which is all that's needed here.
+        # If a discord.py upgrade changes it, the public Member.roles is used instead. Users outside the guild have no roles
+        if role_id is None:
+            return False
+        roles = getattr(member, "_roles", None)
+        if hasattr(roles, "has"):
+            return roles.has(role_id)
+        return any(role.id == role_id for role in getattr(member, "roles", ()))
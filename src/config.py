@@ -0,0 +1,256 @@
+"""The bot's settings, read from the environment and an optional .env style file
+
+Every setting is parsed and validated when it is loaded, and a bad value fails the whole load with every problem
+listed, so a reload with a typo keeps the settings that were already running. The file is found through the
+CONFIG_FILE environment variable (default: .env). As with python-dotenv, the environment wins over the file.
+
+Settings marked live are read each time they are used, so a reload (!reload or SIGHUP) applies them straight away.
+The rest are used to set things up at startup and need a restart to change. The environment of a running process
+can't change, so a reload only picks up what is set in the file: a setting meant to be changed live belongs in the
+file and must not be exported as well.
+
+Each guild can override the settings in GUILD_SETTINGS with a file named after its ID in GUILD_CONFIG_DIRECTORY (ie
+guilds/123456789.env), which wins over everything else. Every guild gets its own database (GT-<guild ID>.db) unless
+DATABASE_PATH is set, which can include {guild_id}. Guilds only share one when they are given the same path, which is
+meant for a guild and its OVERFLOW_GUILDS. With DATABASE_PATH unset, a GT.db left from before guilds had their own
+databases is still used (by every guild, see get_database_path), so an upgrade doesn't lose it.
+"""
+
+import logging, os
+import dotenv
+from semester import Semester, SEMESTERS
+from database import StorageProfile
+
+logger = logging.getLogger(__name__)
+
+# The database of every guild when DATABASE_PATH isn't set, and the single database used before there was one per guild
+DEFAULT_DATABASE_PATH = "GT-{guild_id}.db"
+LEGACY_DATABASE_PATH = "GT.db"
+
+class ConfigError(ValueError):
+    """One or more settings are missing or invalid"""
+
+def _year(value : str):
+    if len(value) != 4 or not value.isdigit():
+        raise ValueError("must be a 4 digit year")
+    return value
+
+def _semester(value : str):
+    value = value.strip().capitalize()
+    if value not in SEMESTERS:
+        raise ValueError("must be one of " + ", ".join(SEMESTERS))
+    return value
+
+def _log_level(value : str):
+    value = value.strip().upper()
+    if not isinstance(logging.getLevelName(value), int):
+        raise ValueError("must be DEBUG, INFO, WARNING, ERROR or CRITICAL")
+    return value
+
+def _name(value : str):
+    value = value.strip()
+    if not value:
+        raise ValueError("can't be empty")
+    return value
+
+def _names(value : str):
+    names = tuple(name.strip() for name in value.split(",") if name.strip())
+    if not names:
+        raise ValueError("must list at least one name (separated by commas)")
+    return names
+
+def _boolean(value : str):
+    if value.strip().lower() not in ("true", "false"):
+        raise ValueError("must be true or false")
+    return value.strip().lower() == "true"
+
+def _positive_int(value : str):
+    number = int(value)
+    if number < 1:
+        raise ValueError("must be at least 1")
+    return number
+
+def _port(value : str):
+    number = int(value)
+    if not 0 <= number <= 65535:
+        raise ValueError("must be a port number (or 0 for off)")
+    return number
+
+def _seconds(value : str):
+    number = float(value)
+    if number < 0:
+        raise ValueError("can't be negative (0 is off)")
+    return number
+
+def _non_negative_int(value : str):
+    number = int(value)
+    if number < 0:
+        raise ValueError("can't be negative")
+    return number
+
+def _ids(value : str):
+    return tuple(int(id) for id in value.split(",") if id.strip())
+
+def _database_path(value : str):
+    value = value.strip()
+    try:
+        value.format(guild_id=0)
+    except (KeyError, IndexError, ValueError):
+        raise ValueError("can only use {guild_id} as a placeholder")
+    return value
+
+def _positive_float(value : str):
+    number = float(value)
+    if number <= 0:
+        raise ValueError("must be more than 0")
+    return number
+
+# Every setting: (attribute, environment variable, default or None if it's required, parser, applies live)
+SETTINGS = [
+    ("current_year", "CURRENT_YEAR", None, _year, True),
+    ("current_semester", "CURRENT_SEMESTER", None, _semester, True),
+    ("log_level", "LOG_LEVEL", "WARNING", _log_level, True),
+    ("command_channels", "COMMAND_CHANNELS", "course-requests,welcome,bot-testing", _names, True), # channels anyone can use commands in
+    ("member_role", "MEMBER_ROLE", "Yellow Jackets", _name, True), # the role that grants basic server access
+    ("admin_role", "ADMIN_ROLE", "Admin", _name, True), # members with this role can use commands in any channel
+    ("register_deferred", "REGISTER_DEFERRED", "false", _boolean, True), # acknowledge !register straight away and do the work in the background
+    ("rollover_batch_size", "ROLLOVER_BATCH_SIZE", "10", _positive_int, True), # old course categories deleted at a time by !rollover
+    ("reconcile_on_startup", "RECONCILE_ON_STARTUP", "true", _boolean, True), # sync the database with the course categories once connected (see !rebuild)
+    ("request_max_age_days", "REQUEST_MAX_AGE_DAYS", "0", _non_negative_int, True), # requests nobody else made in this many days expire, 0 keeps them until !rollover
+    ("channel_limit", "CHANNEL_LIMIT", "500", _positive_int, True), # channels (including categories) a guild can have, Discord allows 500
+    ("overflow_guilds", "OVERFLOW_GUILDS", "", _ids, True), # IDs of the guilds new course groups go in once this one is full. They must share its database
+    ("database_path", "DATABASE_PATH", "", _database_path, False), # only guilds given the same path share a database. Empty for the default (see get_database_path)
+    ("guild_config_directory", "GUILD_CONFIG_DIRECTORY", "guilds", _name, False), # where the <guild ID>.env files are
+    ("db_journal_mode", "DB_JOURNAL_MODE", "WAL", _name, False),
+    ("db_synchronous", "DB_SYNCHRONOUS", "NORMAL", _name, False),
+    ("db_cache_size", "DB_CACHE_SIZE", "-16000", int, False),
+    ("db_mmap_size", "DB_MMAP_SIZE", str(64 * 1024 * 1024), int, False),
+    ("db_busy_timeout", "DB_BUSY_TIMEOUT", "5000", int, False),
+    ("db_readers", "DB_READERS", "2", int, False),
+    ("discord_route_rate", "DISCORD_ROUTE_RATE", "5", _positive_int, False), # actions per route (ie per channel) every discord_route_per seconds
+    ("discord_route_per", "DISCORD_ROUTE_PER", "5", _positive_float, False),
+    ("discord_global_rate", "DISCORD_GLOBAL_RATE", "40", _positive_int, False), # actions per second across all routes (Discord allows 50)
+    ("register_workers", "REGISTER_WORKERS", "4", _positive_int, False), # the most !register commands processed at once in the background
+    ("request_sweep_interval", "REQUEST_SWEEP_INTERVAL", "3600", _positive_float, False), # seconds between checks for expired requests
+    ("metrics_host", "METRICS_HOST", "127.0.0.1", _name, False), # where to serve the metrics (see metrics.py)
+    ("metrics_port", "METRICS_PORT", "0", _port, False), # 0 doesn't serve them
+    ("metrics_log_interval", "METRICS_LOG_INTERVAL", "0", _seconds, False), # seconds between metrics snapshots in the log, 0 for none
+    ("shard_count", "SHARD_COUNT", "0", _non_negative_int, False), # shards across every process, 0 lets Discord decide
+    ("shard_ids", "SHARD_IDS", "", _ids, False), # the shards this process runs (needs SHARD_COUNT), empty for all of them
+]
+
+# The settings a guild's own file can override. The rest are shared by the whole process
+GUILD_SETTINGS = frozenset(["current_year", "current_semester", "command_channels", "member_role", "admin_role", "register_deferred",
+                            "rollover_batch_size", "reconcile_on_startup", "channel_limit", "overflow_guilds", "database_path",
+                            "register_workers"])
+
+def get_database_path(database_path : str, guild_id = None):
+    """The path of a guild's database from a DATABASE_PATH value
+
+    Args:
+        database_path (str): the DATABASE_PATH value, empty if it isn't set. Without one, GT.db is used if it exists
+                             (a deployment from before every guild had its own database), otherwise GT-<guild ID>.db
+        guild_id (int): the guild, or None if it isn't known (ie in a command line tool)
+
+    Returns:
+        str: the path, or None if it depends on the guild and guild_id is None
+    """
+
+    if not database_path:
+        if os.path.isfile(LEGACY_DATABASE_PATH):
+            logger.warning("DATABASE_PATH isn't set, so every guild uses the existing %s. Set it to keep using that file and silence this warning",
+                           LEGACY_DATABASE_PATH)
+            return LEGACY_DATABASE_PATH
+        database_path = DEFAULT_DATABASE_PATH
+    if guild_id is None and "{guild_id}" in database_path:
+        return None
+    return database_path.format(guild_id=guild_id)
+
+class Config:
+    """One complete, validated set of settings (see SETTINGS)"""
+
+    def __init__(self, values : dict, database_profile : StorageProfile):
+        for name, value in values.items():
+            setattr(self, name, value)
+        self.database_profile = database_profile
+
+    @property
+    def semester(self):
+        """The current semester"""
+
+        return Semester(self.current_year, self.current_semester)
+
+    def get_database_path(self, guild_id : int):
+        """The path of a guild's database"""
+
+        return get_database_path(self.database_path, guild_id)
+
+    def changes(self, other):
+        """The names of the settings that are different in another config"""
+
+        return [name for name, _, _, _, _ in SETTINGS if getattr(self, name) != getattr(other, name)]
+
+    def restart_needed(self, other):
+        """The names of the settings that are different in another config but only take effect after a restart"""
+
+        return [name for name, _, _, _, live in SETTINGS if not live and getattr(self, name) != getattr(other, name)]
+
+    @staticmethod
+    def load(path = None, guild_id = None):
+        """Load and validate the settings
+
+        Args:
+            path (str): the settings file. Defaults to the CONFIG_FILE environment variable, or .env. A missing file is skipped
+            guild_id (int): optional. Also apply the guild's own file (see GUILD_SETTINGS), if it has one
+
+        Returns:
+            Config: the settings
+
+        Raises:
+            ConfigError: listing every setting that is missing or invalid
+        """
+
+        path = path or os.getenv("CONFIG_FILE", ".env")
+        environment = {}
+        if os.path.isfile(path):
+            environment.update({name: value for name, value in dotenv.dotenv_values(path).items() if value is not None})
+            ignored = [variable for _, variable, _, _, _ in SETTINGS if variable in environment and variable in os.environ and environment[variable] != os.environ[variable]]
+            if ignored:
+                logger.info("Set in the environment, so ignored in %s: %s", path, ", ".join(ignored))
+        environment.update(os.environ)
+
+        values = {}
+        errors = []
+
+        if guild_id is not None:
+            guild_path = os.path.join(environment.get("GUILD_CONFIG_DIRECTORY", "guilds"), str(guild_id) + ".env")
+            if os.path.isfile(guild_path):
+                guild_values = {name: value for name, value in dotenv.dotenv_values(guild_path).items() if value is not None}
+                shared = [variable for name, variable, _, _, _ in SETTINGS if variable in guild_values and name not in GUILD_SETTINGS]
+                errors.extend(variable + " can't be set per guild (in " + guild_path + ")" for variable in shared)
+                environment.update(guild_values)
+        for name, variable, default, parse, _ in SETTINGS:
+            raw = environment.get(variable, default)
+            if raw is None:
+                errors.append(variable + " is required")
+                continue
+            try:
+                values[name] = parse(raw)
+            except ValueError as error:
+                errors.append(variable + "=" + raw + ": " + str(error))
+
+        database_profile = None
+        if not errors:
+            try:
+                database_profile = StorageProfile(values["db_journal_mode"], values["db_synchronous"], values["db_cache_size"],
+                                                  values["db_mmap_size"], values["db_busy_timeout"], values["db_readers"])
+            except ValueError as error:
+                errors.append(str(error))
+            if values["shard_ids"] and not values["shard_count"]:
+                errors.append("SHARD_IDS needs SHARD_COUNT")
+            elif any(id >= values["shard_count"] for id in values["shard_ids"]):
+                errors.append("SHARD_IDS must all be less than SHARD_COUNT")
+
+        if errors:
+            raise ConfigError("; ".join(errors))
+        return Config(values, database_profile)
@@ -1,62 +1,68 @@
-import re, logging
+import re, functools
 from semester import Semester
 
+# The whole course string in one pass (after whitespace is removed and it is made uppercase):
+#   DEPTCODE, DEPTCODE-TOPIC, DEPTCODE-SEMYR or DEPTCODE-TOPIC-SEMYR
+# Ex: AE1000, AE8803-NON, AE1000-SP22, AE8803-NON-F2022
+COURSE_PATTERN = re.compile(r'([A-Z]+)(\d+)(?:-([A-Z]+))??(?:-(F|FALL|SP|SPRING|SU|SUMMER)(\d{2}|\d{4}))?')
+
+# Expand the semester abbreviations
+SEMESTER_NAMES = {"F": "Fall", "FALL": "Fall", "SP": "Spring", "SPRING": "Spring", "SU": "Summer", "SUMMER": "Summer"}
+
+# The most distinct course strings to remember the parsed form of
+PARSE_CACHE_SIZE = 4096
+
+@functools.lru_cache(maxsize=PARSE_CACHE_SIZE)
+def _parse_normalized(course_string : str, current_year : str, current_semester : str):
+    """Parse a normalized course string (see parse_course_string)"""
+
+    match = COURSE_PATTERN.fullmatch(course_string)
+    if match is None:
+        return None
+
+    dept, code, topic, semester, year = match.groups()
+    if semester is None:
+        semester, year = current_semester, current_year
+    else:
+        semester = SEMESTER_NAMES[semester]
+        if len(year) == 2: # expand to a 4 digit year
+            year = "20" + year
+
+    return (dept, code, topic or "0", topic is not None, Semester(year, semester))
+
+def parse_course_string(course_string : str, current_year = "", current_semester = ""):
+    """Parse a course string. Repeated strings (ie "AE1000" at the start of term) come straight from a cache
+
+    Returns:
+        tuple: (dept, code, topic, is_special_topic, Semester), or None if the string isn't a possible course
+    """
+
+    # Capitalization and spaces don't matter
+    return _parse_normalized("".join(course_string.split()).upper(), current_year, current_semester)
+
 class Course:
     """A single course"""
 
+    __slots__ = ("raw_string", "is_possible", "is_special_topic", "dept", "code", "topic", "title", "semester")
+
     def __init__(self, course_string : str, current_year = "", current_semester = ""):
         self.raw_string = course_string # The raw string to make the course
-        self.is_possible = False # if this course is even possible (ie is the course_string formatted correctly). default to false
-        self.is_special_topic = False # if this is a special topics course. default to false
-        self.dept = ""
-        self.code = ""
-        self.topic = "0"
         self.title = ""
-        
-        # assume the current year and semester
-        self.semester = Semester(current_year, current_semester)
-
-        # separate each component of a course, indicated by dashes (dept####-semester## or dept####-TOPIC-semester##)
-        course_components = course_string.split('-')
-
-        # if there is at least 1 component, then process it
-        if len(course_components) > 0:
-
-            # Use a regex to the department and course code from the first entry in course_components
-            dept_course = re.findall(r'\d+|\D+', course_components[0])
-
-            # if there is a department and a course, then the length will be 2. otherwise this is not possibly valid
-            if len(dept_course) == 2:
-                # Get rid of any hanging white space with strip.
-                self.dept = dept_course[0].strip().upper()
-                self.code = dept_course[1].strip()
-                self.topic = "0" # default to 0
-                self.is_possible = True
-
-            # If there are 2 course components, then there is either a special topic or a semester. This will figure out which.
-            if len(course_components) == 2:
-                # split the course components based on digits and non-digits.
-                course_component = re.findall(r'\d+|\D+', course_components[1])
-
-                # if the number of components in the second portion is 1, then it is a topic (no digits)
-                if len(course_component) == 1:
-                    self.topic = course_component[0].upper() # get the topic and make it all caps
-                    self.is_special_topic = True # This is a special topics course
-
-                # if the number of components in the second portion is 2, then it is a semester and year
-                elif len(course_component) == 2:
-                    self.semester.update_semester(course_component[0])
-                    self.semester.update_year(course_component[1])
-
-            # If there are 3 course components, then there is a special topic and semester as well
-            elif len(course_components) == 3:
-                self.topic = course_components[1].upper() # topic will always be in the second position. Make it all caps
-                self.is_special_topic = True # This is a special topics course
-                
-                # split the semester and year, which will always be in the third position
-                semester_year = re.findall(r'\d+|\D+', course_components[2])
-                self.semester.update_semester(semester_year[0]) # update the semester
-                self.semester.update_year(semester_year[1]) # update the year
+
+        # separate each component of a course (dept####, dept####-semester##, dept####-TOPIC or dept####-TOPIC-semester##)
+        parsed = parse_course_string(course_string, current_year, current_semester)
+
+        # if it didn't parse, then the course isn't possible (ie the course_string isn't formatted correctly)
+        if parsed is None:
+            self.is_possible = False
+            self.is_special_topic = False
+            self.dept = ""
+            self.code = ""
+            self.topic = "0"
+            self.semester = Semester(current_year, current_semester) # assume the current year and semester
+        else:
+            self.is_possible = True
+            self.dept, self.code, self.topic, self.is_special_topic, self.semester = parsed
 
     def __str__(self):
         if self.is_special_topic:
@@ -67,6 +73,12 @@ class Course:
     def __repr__(self):
         return '{}{}-{}-{}'.format(self.dept, self.code, self.topic, self.semester)
 
+    def get_registration_key(self):
+        """Get the key identifying this course offering in the registrar and requests tables.
+            Will be in the format:
+                (dept, code, topic, year, semester)"""
+        return (self.dept, self.code, self.topic, self.semester.year, self.semester.semester)
+
     def set_title(self, new_title):
         """Set the course title"""
 
@@ -0,0 +1,190 @@
+import asyncio, contextlib, sqlite3, logging, os, threading, urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_MODES = ("DELETE", "TRUNCATE", "PERSIST", "MEMORY", "WAL", "OFF")
+SYNCHRONOUS_LEVELS = ("OFF", "NORMAL", "FULL", "EXTRA")
+
+class StorageProfile:
+    """The PRAGMA settings every connection to the database is opened with
+
+    The defaults turn on WAL journaling, so readers (including other processes, like db_report.py) keep working
+    while a write commits, with synchronous=NORMAL so a commit doesn't wait on an fsync of the database file.
+    """
+
+    def __init__(self, journal_mode = "WAL", synchronous = "NORMAL", cache_size = -16000, mmap_size = 64 * 1024 * 1024,
+                 busy_timeout = 5000, readers = 2):
+        """
+        Args:
+            journal_mode (str): one of JOURNAL_MODES
+            synchronous (str): one of SYNCHRONOUS_LEVELS
+            cache_size (int): pages per connection, or KiB per connection if negative (sqlite's convention)
+            mmap_size (int): bytes of the database file to memory map. 0 turns it off
+            busy_timeout (int): milliseconds to wait on a locked database before failing
+            readers (int): number of read-only connections (and threads) for lookups. 0 sends everything to the writer
+        """
+
+        self.journal_mode = str(journal_mode).upper()
+        self.synchronous = str(synchronous).upper()
+        self.cache_size = int(cache_size)
+        self.mmap_size = int(mmap_size)
+        self.busy_timeout = int(busy_timeout)
+        self.readers = int(readers)
+
+        if self.journal_mode not in JOURNAL_MODES:
+            raise ValueError("Unknown journal mode: " + self.journal_mode)
+        if self.synchronous not in SYNCHRONOUS_LEVELS:
+            raise ValueError("Unknown synchronous level: " + self.synchronous)
+        if self.mmap_size < 0 or self.busy_timeout < 0 or self.readers < 0:
+            raise ValueError("mmap_size, busy_timeout and readers can't be negative")
+
+    def __repr__(self):
+        return 'StorageProfile(journal_mode={}, synchronous={}, cache_size={}, mmap_size={}, busy_timeout={}, readers={})'.format(
+            self.journal_mode, self.synchronous, self.cache_size, self.mmap_size, self.busy_timeout, self.readers)
+
+    def apply(self, conn, writer = True):
+        """Apply the settings to a connection. The journal mode is stored in the database file so only the writer sets it"""
+
+        # pragmas can't take bound parameters, but every value was validated or converted to an int above
+        conn.execute("PRAGMA busy_timeout = " + str(self.busy_timeout))
+        if writer:
+            conn.execute("PRAGMA journal_mode = " + self.journal_mode)
+        conn.execute("PRAGMA synchronous = " + self.synchronous)
+        conn.execute("PRAGMA cache_size = " + str(self.cache_size))
+        conn.execute("PRAGMA mmap_size = " + str(self.mmap_size))
+
+
+class Database:
+    """An sqlite database that is only ever touched from dedicated threads
+
+    sqlite3 calls block, so running them directly inside a command coroutine stalls the whole event loop
+    (including the gateway heartbeat). Every query is instead handed to a worker thread, and the command awaits
+    the result. A single writer thread owns the only read-write connection so writes are applied in submission
+    order. Lookups that don't need to see the writer's uncommitted work can go to a pool of read-only connections
+    instead (see read), which with WAL journaling keep working while the writer commits.
+    """
+
+    def __init__(self, path : str, profile : StorageProfile = None, metrics = None):
+        self.path = path
+        self.profile = profile or StorageProfile()
+        self.metrics = metrics # optional metrics.Metrics to time every query into
+        self.pending = 0 # queries awaited by coroutines that haven't finished yet
+        self.conn = None # created by the writer thread the first time it runs
+        self.readers = threading.local() # each reader thread has its own read-only connection
+        self.reader_conns = [] # every reader connection, so they can be closed
+
+        # A single writer keeps every write on the same thread (and the same connection), in submission order
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="buzz-bot-db", initializer=self._connect)
+        self.read_executor = None
+        if self.profile.readers > 0:
+            self.read_executor = ThreadPoolExecutor(max_workers=self.profile.readers, thread_name_prefix="buzz-bot-db-read",
+                                                    initializer=self._connect_reader)
+
+    def _connect(self):
+        """Open the read-write connection. Runs on the writer thread"""
+
+        self.conn = sqlite3.connect(self.path)
+        self.profile.apply(self.conn)
+        logger.debug("Database connection opened: %s %r", self.path, self.profile)
+
+    def _connect_reader(self):
+        """Open a read-only connection. Runs on each reader thread"""
+
+        # Make sure the writer has created the database (and set the journal mode) before opening it read-only
+        self.executor.submit(lambda: None).result()
+
+        # check_same_thread is off only so close() can close it. It is still only ever used by this thread
+        conn = sqlite3.connect("file:" + urllib.parse.quote(os.path.abspath(self.path)) + "?mode=ro", uri=True, check_same_thread=False)
+        self.profile.apply(conn, writer=False)
+        self.readers.conn = conn
+        self.reader_conns.append(conn)
+
+    def submit(self, function, *args):
+        """Schedule function(conn, *args) on the worker thread
+
+        Returns:
+            concurrent.futures.Future: the pending result. Usable outside of the event loop (ie at startup)
+        """
+        return self.executor.submit(lambda: function(self.conn, *args))
+
+    async def run(self, function, *args):
+        """Run function(conn, *args) on the writer thread and wait for the result without blocking the event loop"""
+
+        with self._time(function, "writer"):
+            return await asyncio.wrap_future(self.submit(function, *args))
+
+    async def read(self, function, *args):
+        """Run a read-only function(conn, *args) on a reader connection and wait for the result
+
+        Readers only see committed data, so anything that must see a write still queued on the writer should use run.
+        Falls back to the writer if the profile has no readers.
+        """
+
+        if self.read_executor is None:
+            return await self.run(function, *args)
+        with self._time(function, "reader"):
+            return await asyncio.wrap_future(self.read_executor.submit(lambda: function(self.readers.conn, *args)))
+
+    async def write(self, function, *args):
+        """Run function(conn, *args) on the worker thread in its own transaction and commit it"""
+
+        def _write(conn):
+            with conn: # commits on success, rolls back on an exception
+                return function(conn, *args)
+
+        with self._time(function, "writer"):
+            return await asyncio.wrap_future(self.submit(_write))
+
+    @contextlib.contextmanager
+    def _time(self, function, connection : str):
+        """Count a query as pending while it's awaited, and time it (waiting for the thread included) if there are metrics"""
+
+        self.pending += 1
+        try:
+            if self.metrics is None:
+                yield
+            else:
+                with self.metrics.time("buzzbot_db_query_seconds", query=getattr(function, "__qualname__", "query"), connection=connection):
+                    yield
+        finally:
+            self.pending -= 1
+
+    def close(self):
+        """Close the connections once all the queued work has finished"""
+
+        if self.read_executor is not None:
+            self.read_executor.shutdown(wait=True)
+            for conn in self.reader_conns:
+                conn.close()
+        self.submit(lambda conn: conn.close()).result()
+        self.executor.shutdown(wait=True)
+
+
+class Transaction:
+    """A group of writes that are applied together
+
+    Writes are collected while a command is processed and then applied in a single transaction, so the whole
+    command costs one commit and a failure part way through leaves the database untouched.
+    """
+
+    def __init__(self):
+        self.writes = [] # (function, args) in the order they were added
+
+    def __len__(self):
+        return len(self.writes)
+
+    def add(self, function, *args):
+        """Queue function(conn, *args) to run as part of the transaction"""
+
+        self.writes.append((function, args))
+
+    def apply(self, conn):
+        """Run every queued write and commit them together. Runs on the database thread"""
+
+        if not self.writes:
+            return
+
+        with conn: # commits on success, rolls back everything on an exception
+            for function, args in self.writes:
+                function(conn, *args)
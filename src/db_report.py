@@ -0,0 +1,56 @@
+"""Print a summary of the bot's database without stopping the bot
+
+Opens the database read-only, so with WAL journaling (the default StorageProfile) it can run at any time while the
+bot is serving commands, and it never locks the bot out.
+
+    python db_report.py [path to the database | --guild 123456789]
+"""
+
+import argparse, os, sqlite3, urllib.parse
+from config import get_database_path
+
+def connect_read_only(path : str, busy_timeout = 5000):
+    """Open a read-only connection to a live database"""
+
+    conn = sqlite3.connect("file:" + urllib.parse.quote(os.path.abspath(path)) + "?mode=ro", uri=True)
+    conn.execute("PRAGMA busy_timeout = " + str(int(busy_timeout)))
+    return conn
+
+def report(conn):
+    """Build the summary as a list of printable lines"""
+
+    lines = []
+    lines.append("Journal mode: " + conn.execute("PRAGMA journal_mode").fetchone()[0])
+    lines.append("Schema version: " + str(conn.execute("PRAGMA user_version").fetchone()[0]))
+    lines.append("Courses: " + str(conn.execute("SELECT COUNT(*) FROM courses").fetchone()[0]))
+    lines.append("Pending requests: " + str(conn.execute("SELECT COUNT(*) FROM requests").fetchone()[0]))
+
+    lines.append("Course groups per semester:")
+    sql = "SELECT registrar.year, registrar.semester, COUNT(DISTINCT registrar.category_id), COUNT(schedule.id) FROM registrar "
+    sql += "LEFT JOIN schedule ON schedule.category_id = registrar.category_id "
+    sql += "GROUP BY registrar.semester_key ORDER BY registrar.semester_key"
+    for year, semester, groups, members in conn.execute(sql):
+        lines.append("    {} {}: {} groups, {} members".format(semester, year, groups, members))
+
+    return lines
+
+def main():
+    parser = argparse.ArgumentParser(description="Print a summary of the bot's database without stopping the bot")
+    parser.add_argument("database", nargs="?", help="path to the database (default: the guild's, see DATABASE_PATH)")
+    parser.add_argument("--guild", type=int, help="ID of the guild whose database to report on")
+    args = parser.parse_args()
+
+    database = args.database or get_database_path(os.getenv("DATABASE_PATH", ""), args.guild)
+    if database is None:
+        parser.error("each guild has its own database, give --guild or a path")
+
+    conn = connect_read_only(database)
+    try:
+        # Read everything from one snapshot so the numbers agree with each other
+        conn.execute("BEGIN")
+        print("\n".join(report(conn)))
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    main()
@@ -17,6 +17,21 @@ class DiscordMessage:
         else:
             self.message += "\n" + msg
 
+    def append_registration_started(self, course_count : int):
+        """Append the "I'm working on your registration" message"""
+
+        if course_count == 1:
+            self.append("Got it! Working on registering you for that course, I'll update this message once it's done.")
+        else:
+            self.append("Got it! Working on registering you for those {} courses, I'll update this message once they're done.".format(course_count))
+
+    def append_registration_failed(self):
+        """Append the "something went wrong with your registration" message"""
+
+        line = "Sorry, something went wrong while registering you. Please try again in a minute, "
+        line += "and if it keeps happening mention @Rob or @Admin in a message."
+        self.append(line)
+
     def append_course_added(self, course : Course, prefix = ""):
         """Append the "you have been added to this course" message"""
         
@@ -24,6 +39,31 @@ class DiscordMessage:
         line += 'You have been added to {} in the {} semester.'.format(course.get_full_name(), course.get_full_semester())
         self.append(line)
 
+    def append_course_in_other_server(self, course : Course, server_name : str, in_server : bool, invite = None, prefix = "", overflow = True):
+        """Append the "this course's group is in one of the overflow servers" message
+
+        Args:
+            in_server : if they are already a member of that server
+            invite (str): an invite to the server for someone who isn't in it yet, None if there isn't one
+            overflow (bool): if the group is there because the server the command came from is full"""
+
+        line = prefix # start with any prefix provided
+        line += '{} is in the **{}** server{}. '.format(course.get_full_name(), server_name, " because this one is full" if overflow else "")
+        if in_server:
+            line += "You'll find it in your sidebar there."
+        elif invite is not None:
+            line += "Join it with {} and the course will show up once you do.".format(invite)
+        else:
+            line += "Ask @Admin for an invite to it and the course will show up once you join."
+        self.append(line)
+
+    def append_course_unreachable(self, course : Course):
+        """Append the "this course's group can't be reached right now" message"""
+
+        line = "I couldn't add you to {} in the {} semester, its group can't be reached right now. ".format(course.get_full_name(), course.get_full_semester())
+        line += "Please try again in a few minutes, and if it keeps happening mention @Rob or @Admin in a message."
+        self.append(line)
+
     def append_course_requested(self, course : Course):
         """Append the "you have successfully requested this course" message"""
 
@@ -66,6 +106,69 @@ class DiscordMessage:
         line += "(ex: `!add ece1000 Intro to Electrical Engineering`)"
         self.append(line)
 
+    def append_course_suggestions(self, suggestions):
+        """Append the "did you mean one of these courses" message
+
+        Args:
+            suggestions : (dept, code, topic, title) of each suggested course, see Catalog.suggest"""
+
+        names = []
+        for dept, code, topic, title in suggestions:
+            if topic != "0":
+                names.append('`{}{}-{}` ({} {} \"{}\")'.format(dept.lower(), code, topic.lower(), dept, code, title))
+            else:
+                names.append('`{}{}` ({} {} \"{}\")'.format(dept.lower(), code, dept, code, title))
+        self.append("Did you mean " + ", ".join(names[:-1]) + (" or " if len(names) > 1 else "") + names[-1] + "?")
+
+    def append_schedule(self, courses):
+        """Append the "these are your courses" message
+
+        Args:
+            courses : (Course, hidden, name of the server it's in or None if it's this one) of each course, see !schedule"""
+
+        if not courses:
+            self.append("You aren't in any courses yet. Use `!register` to join some, ex: `!register ae1000,ae1001`")
+            return
+
+        lines = ["Your courses:"]
+        for course, hidden, server_name in courses:
+            line = '{} \"{}\" ({})'.format(course.get_full_name(), course.title, course.get_full_semester())
+            if server_name is not None:
+                line += " in the **{}** server".format(server_name)
+            if hidden:
+                line += " - hidden"
+            lines.append(line)
+        self.append("\n".join(lines))
+
+    def append_courses_changed(self, action : str, courses):
+        """Append the "these courses were dropped/hidden/shown" message
+
+        Args:
+            action : what was done to them. Ex: "Dropped"
+            courses : the Course objects"""
+
+        self.append(action + ": " + ", ".join(course.get_full_name_and_semester() for course in courses))
+
+    def append_courses_not_in_schedule(self, names):
+        """Append the "you aren't in these courses" message"""
+
+        self.append("You aren't in " + ", ".join(names) + ". Use `!schedule` to see the courses you're in.")
+
+    def append_schedule_change_misunderstood(self, command : str):
+        """Append the "give me a course, a list of courses or all" message"""
+
+        self.append("Please give a course, a list of courses (separated by commas) or \"all\". Ex: `!{0} ae1000,ae1001` or `!{0} all`".format(command))
+
+    def append_not_ready(self):
+        """Append the "this server isn't set up (yet)" message"""
+
+        self.append("Sorry, I'm not ready to help in this server yet. If this keeps happening, mention @Rob or @Admin so they can check my logs.")
+
+    def append_admin_only(self, command):
+        """Append the "only admins can use this command" message"""
+
+        self.append("Sorry, only admins can use `!{}`.".format(command))
+
     def append_join_message(self, context, followed_instructions : bool):
         """Append the "Welcome to the Server" message
         
@@ -99,4 +202,89 @@ class DiscordMessage:
         """Append the "that was not valid" message"""
         
         line = "I did not understand \"" + arg + "\". Please use the format \"deptCourse title\". Ex: \"ece1000 Into to Electrical Engineering\""
-        self.append(line)
\ No newline at end of file
+        self.append(line)
+
+    def append_catalog_imported(self, result, dry_run = False):
+        """Append the "the catalog has been imported" message
+
+        Args:
+            result : the catalog_import.ImportResult of the import
+            dry_run : if nothing was actually changed"""
+
+        line = "Catalog import finished: " if not dry_run else "Catalog import dry run (nothing was changed): "
+        line += "{} inserted, {} updated, {} skipped".format(result.inserted, result.updated, result.skipped)
+        if result.skipped:
+            line += " ({} unchanged, {} invalid, {} duplicates)".format(result.unchanged, result.invalid, result.duplicates)
+        self.append(line)
+
+    def append_catalog_import_failed(self, filename : str, error : Exception):
+        """Append the "that catalog file could not be read" message"""
+
+        self.append("I could not read \"" + filename + "\" so nothing was imported: " + str(error))
+
+    def append_catalog_import_misunderstood(self):
+        """Append the "attach a catalog file" message"""
+
+        line = "Please attach a CSV or JSON catalog to the `!import` message. A CSV needs dept, course and title columns "
+        line += "(and optionally topic). Add `dry-run` to see what would change without changing anything."
+        self.append(line)
+
+    def append_rebuild_finished(self, fixes, dry_run = False):
+        """Append the "the database has been synced with the course categories" message
+
+        Args:
+            fixes : the reconcile.Reconciliation that was applied, or None if it couldn't run
+            dry_run : if nothing was actually changed"""
+
+        if fixes is None:
+            self.append("A server is unavailable right now so nothing was checked. Please try again in a few minutes.")
+            return
+
+        if len(fixes) == 0:
+            self.append("The database already matches the course categories.")
+        else:
+            self.append(("Rebuild dry run (nothing was changed): " if dry_run else "Rebuild finished: ") + str(fixes) + ".")
+        if fixes.unrecognized:
+            self.append("These categories look like courses but aren't in my memory: " + ", ".join(fixes.unrecognized))
+
+    def append_rollover_finished(self, result, failed = 0, dry_run = False):
+        """Append the "the new semester has started" message
+
+        Args:
+            result : the rollover.RolloverResult
+            failed : the number of old categories that couldn't be deleted
+            dry_run : if nothing was actually changed"""
+
+        semester = '{} {}'.format(result.semester.semester, result.semester.year)
+        if dry_run:
+            self.append("Rollover to " + semester + " dry run (nothing was changed): " + str(result) + ".")
+        else:
+            self.append("The current semester is now " + semester + ". " + str(result) + ".")
+        if failed:
+            self.append("{} old categories couldn't be deleted, running `!rollover` again will retry them.".format(failed))
+
+    def append_rollover_misunderstood(self, arg : str, current_semester):
+        """Append the "that isn't a semester I can roll over to" message"""
+
+        line = "I did not understand \"" + arg + "\". Please give a semester no earlier than the current one "
+        line += '({} {}). Ex: "!rollover fall 2022"'.format(current_semester.semester, current_semester.year)
+        self.append(line)
+
+    def append_config_reloaded(self, changed, restart_needed):
+        """Append the "the config has been reloaded" message
+
+        Args:
+            changed : the names of the settings that changed
+            restart_needed : the names of the changed settings that only take effect after a restart"""
+
+        if not changed:
+            self.append("Config reloaded, nothing changed.")
+            return
+        self.append("Config reloaded. Changed: " + ", ".join(changed) + ".")
+        if restart_needed:
+            self.append("These only take effect after a restart: " + ", ".join(restart_needed) + ".")
+
+    def append_config_invalid(self, error : Exception):
+        """Append the "the config has a problem so it wasn't reloaded" message"""
+
+        self.append("The config wasn't reloaded (the running one is still in use): " + str(error))
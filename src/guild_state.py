@@ -0,0 +1,174 @@
+"""Everything the bot keeps for each guild it serves
+
+Every guild gets its own settings (see Config.load), its own database (DATABASE_PATH includes {guild_id} by default)
+and its own background workers, so one guild's rush at the start of term never waits on another guild's database
+writer or queued commands. Guilds configured with the same database path (a guild and its overflow guilds) share the
+database along with everything guarding it (the catalog, the course locks and the reconcile lock).
+"""
+
+import asyncio, logging
+from config import Config, ConfigError
+from semester import Semester
+from database import Database
+from catalog import Catalog
+from worker_pool import WorkerPool
+from keyed_lock import KeyedLock
+import queries, migrations, rollover
+
+logger = logging.getLogger(__name__)
+
+def apply_stored_semester(config : Config, stored_semester):
+    """Apply the semester !rollover stored in the database. Semesters only move forward, so it wins over a config that's behind it"""
+
+    if stored_semester is not None:
+        stored_semester = Semester.from_sort_key(int(stored_semester))
+        if stored_semester > config.semester:
+            config.current_year, config.current_semester = stored_semester.year, stored_semester.semester
+            logger.info("Semester and Year (from the last rollover): %s %s", config.current_semester, config.current_year)
+
+
+class SharedDatabase:
+    """A database and everything that guards it, shared by every guild configured with its path"""
+
+    def __init__(self, database : Database):
+        self.database = database
+        self.catalog = Catalog() # the course catalog, kept in memory so checking a course never needs the database
+        self.course_locks = KeyedLock() # one lock per course offering (see Course.get_registration_key)
+        self.reconcile_lock = asyncio.Lock() # only one reconciliation or rollover at a time
+
+
+class GuildState:
+    """One guild's settings, database and background workers"""
+
+    def __init__(self, guild_id : int, config : Config, shared : SharedDatabase):
+        self.guild_id = guild_id
+        self.config = config
+        self.database = shared.database
+        self.catalog = shared.catalog
+        self.course_locks = shared.course_locks
+        self.reconcile_lock = shared.reconcile_lock
+        self.register_workers = WorkerPool(config.register_workers) # background workers for deferred !register commands
+        self.reconciled_on_startup = False
+
+
+class GuildStates:
+    """Opens each guild's state the first time the bot sees the guild, and keeps it"""
+
+    def __init__(self, metrics = None):
+        self.metrics = metrics # optional metrics.Metrics every database times its queries into
+        self.states = {} # guild ID -> GuildState
+        self.opening = {} # guild ID -> task opening its state
+        self.shared = {} # database path -> SharedDatabase
+        self.shared_lock = asyncio.Lock() # so two guilds opening at once with the same path can't both open its database
+
+    def __iter__(self):
+        return iter(list(self.states.values()))
+
+    def get(self, guild):
+        """Get a guild's state
+
+        Returns:
+            GuildState: the state, or None if it hasn't been opened (yet)
+        """
+
+        return self.states.get(guild.id)
+
+    async def open(self, guild_id : int):
+        """Open a guild's state (once, later calls get the same one): load its config, then open and migrate its database
+
+        Raises:
+            ConfigError: if the guild's settings are invalid. It can be opened again once they're fixed
+            sqlite3.Error: if its database can't be opened or migrated
+        """
+
+        state = self.states.get(guild_id)
+        if state is not None:
+            return state
+        task = self.opening.get(guild_id)
+        if task is None:
+            task = self.opening[guild_id] = asyncio.ensure_future(self._open(guild_id))
+        try:
+            return await asyncio.shield(task)
+        finally:
+            if task.done():
+                self.opening.pop(guild_id, None)
+
+    async def _open(self, guild_id : int):
+        config = Config.load(guild_id=guild_id)
+        path = config.get_database_path(guild_id)
+
+        async with self.shared_lock:
+            shared = self.shared.get(path)
+            if shared is None:
+                shared = SharedDatabase(Database(path, config.database_profile, metrics=self.metrics))
+                try:
+                    await shared.database.run(migrations.migrate) # bring the schema up to date before anything uses it
+                    shared.catalog.replace(await shared.database.read(Catalog.read)) # built on a database thread, not the event loop
+                except Exception:
+                    shared.database.close() # it can be opened again once the problem is fixed
+                    raise
+                self.shared[path] = shared
+                logger.info("Database for guild %s: %s %r", guild_id, path, config.database_profile)
+            else:
+                logger.info("Guild %s shares the database %s with guilds %s", guild_id, path, ", ".join(str(state.guild_id) for state in self.sharing(shared.database)))
+
+        apply_stored_semester(config, await shared.database.read(queries.get_setting, rollover.CURRENT_SEMESTER_SETTING))
+        self.states[guild_id] = state = GuildState(guild_id, config, shared)
+        logger.info("Guild %s: %s %s", guild_id, config.current_semester, config.current_year)
+        return state
+
+    def sharing(self, database : Database):
+        """The states of every guild that uses the database"""
+
+        return [state for state in self.states.values() if state.database is database]
+
+    def get_home_guild(self, database : Database):
+        """Get the guild a database's rows without a guild ID (made before guilds were recorded) belong to: the one guild
+        using it that isn't another's overflow guild
+
+        Returns:
+            int: the guild's ID, or None if it isn't clear which guild that is
+        """
+
+        sharing = self.sharing(database)
+        overflow = {guild_id for state in sharing for guild_id in state.config.overflow_guilds}
+        homes = [state.guild_id for state in sharing if state.guild_id not in overflow]
+        return homes[0] if len(homes) == 1 else None
+
+    async def reload(self):
+        """Load every guild's config again. Nothing changes unless they are all valid
+
+        Returns:
+            dict: guild ID -> (names of the settings that changed, names of those that need a restart)
+
+        Raises:
+            ConfigError: listing the problems of every guild with invalid settings
+        """
+
+        new_configs = {}
+        changes = {}
+        errors = []
+        for state in self:
+            try:
+                new_configs[state.guild_id] = new_config = Config.load(guild_id=state.guild_id)
+            except ConfigError as error:
+                errors.append("guild " + str(state.guild_id) + ": " + str(error))
+                continue
+            apply_stored_semester(new_config, await state.database.read(queries.get_setting, rollover.CURRENT_SEMESTER_SETTING))
+            changes[state.guild_id] = (state.config.changes(new_config), state.config.restart_needed(new_config))
+            for name in changes[state.guild_id][1]:
+                setattr(new_config, name, getattr(state.config, name))
+            new_config.database_profile = state.config.database_profile
+        if errors:
+            raise ConfigError("; ".join(errors))
+
+        for state in self:
+            state.config = new_configs[state.guild_id]
+        return changes
+
+    async def close(self):
+        """Finish the queued background work, then close every database"""
+
+        await asyncio.gather(*(state.register_workers.close() for state in self))
+        for shared in self.shared.values():
+            shared.database.close()
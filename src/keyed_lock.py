@@ -0,0 +1,49 @@
+import asyncio, contextlib
+
+class KeyedLock:
+    """A set of asyncio locks, one per key, created on demand
+
+    Work on different keys runs in parallel while work on the same key runs one at a time. A key's lock is
+    dropped once nobody holds it or is waiting for it, so the set only ever holds the keys in use.
+    """
+
+    def __init__(self):
+        self.locks = {} # key -> [asyncio.Lock, number of holders and waiters]
+
+    def __len__(self):
+        return len(self.locks)
+
+    def locked(self, key):
+        """Check if the key's lock is currently held"""
+
+        entry = self.locks.get(key)
+        return entry is not None and entry[0].locked()
+
+    @contextlib.asynccontextmanager
+    async def acquire(self, key):
+        """Hold the lock for a single key"""
+
+        entry = self.locks.get(key)
+        if entry is None:
+            entry = self.locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self.locks[key]
+
+    @contextlib.asynccontextmanager
+    async def acquire_all(self, keys):
+        """Hold the locks for several keys at once
+
+        The locks are always taken in sorted order so two holders of overlapping keys can't deadlock each other.
+        """
+
+        async with contextlib.AsyncExitStack() as stack:
+            for key in sorted(set(keys)):
+                await stack.enter_async_context(self.acquire(key))
+            yield
@@ -0,0 +1,195 @@
+"""Timings and queue depths of the bot's hot paths
+
+Metrics records latency histograms (command handling, database queries, Discord API calls and the time actions
+wait in the action queue), counters and gauges read on demand (queue depths). They can be served in the
+Prometheus text format from a small local HTTP endpoint (see serve) and/or written to the log periodically (see
+log_periodically). Recording a value is a dict lookup and a short loop, so it is cheap enough for every call.
+"""
+
+import asyncio, bisect, contextlib, logging, time
+
+logger = logging.getLogger(__name__)
+snapshot_logger = logging.getLogger(__name__ + ".snapshot") # has its own level, see log_periodically
+
+# Upper bounds (in seconds) of the histogram buckets, from a fast cached query up to a slow rate limited command
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+class Histogram:
+    """Counts of observed values in fixed buckets, plus their count and sum"""
+
+    __slots__ = ("counts", "count", "sum")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1) # the last one is for values over every bound
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value : float):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q : float):
+        """Estimate a quantile (ie 0.99) as the upper bound of the bucket it falls in"""
+
+        if self.count == 0:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if seen >= target:
+                return bound
+        return float("inf")
+
+
+class Metrics:
+    """Every metric the bot records, by name and labels"""
+
+    def __init__(self):
+        self.histograms = {} # (name, labels) -> Histogram
+        self.counters = {} # (name, labels) -> number
+        self.gauges = {} # name -> function returning a number, or a dict of labels -> number
+        self.help = {} # name -> description
+
+    def describe(self, name : str, description : str):
+        """Set the help text shown for a metric"""
+
+        self.help[name] = description
+
+    def observe(self, name : str, value : float, **labels):
+        """Record a value (usually a duration in seconds) in a histogram"""
+
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram()
+        histogram.observe(value)
+
+    def increment(self, name : str, amount = 1, **labels):
+        """Add to a counter"""
+
+        key = (name, tuple(sorted(labels.items())))
+        self.counters[key] = self.counters.get(key, 0) + amount
+
+    def gauge(self, name : str, function):
+        """Register a gauge, read each time the metrics are rendered
+
+        Args:
+            function: takes no arguments and returns a number, or a dict of {((label, value), ...): number}
+        """
+
+        self.gauges[name] = function
+
+    @contextlib.contextmanager
+    def time(self, name : str, **labels):
+        """Time the body of a with block (sync or inside a coroutine) into a histogram"""
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def render(self):
+        """Render every metric in the Prometheus text format"""
+
+        lines = []
+        by_name = {}
+        for (name, labels), histogram in self.histograms.items():
+            by_name.setdefault(name, []).append((labels, histogram))
+        for name in sorted(by_name):
+            self._header(lines, name, "histogram")
+            for labels, histogram in by_name[name]:
+                cumulative = 0
+                for bound, count in zip(BUCKETS + (float("inf"),), histogram.counts):
+                    cumulative += count
+                    lines.append('{}_bucket{} {}'.format(name, _labels(labels + (("le", "+Inf" if bound == float("inf") else repr(bound)),)), cumulative))
+                lines.append('{}_sum{} {}'.format(name, _labels(labels), histogram.sum))
+                lines.append('{}_count{} {}'.format(name, _labels(labels), histogram.count))
+
+        counters = {}
+        for (name, labels), value in self.counters.items():
+            counters.setdefault(name, []).append((labels, value))
+        for name in sorted(counters):
+            self._header(lines, name, "counter")
+            for labels, value in counters[name]:
+                lines.append('{}{} {}'.format(name, _labels(labels), value))
+
+        for name in sorted(self.gauges):
+            self._header(lines, name, "gauge")
+            for labels, value in self._read_gauge(name):
+                lines.append('{}{} {}'.format(name, _labels(labels), value))
+
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        """A short summary for the log: the count, mean and p50/p99 bucket of every histogram, and every counter and gauge"""
+
+        lines = []
+        for (name, labels), histogram in sorted(self.histograms.items()):
+            lines.append('{}{} count={} mean={:.4f}s p50<={}s p99<={}s'.format(name, _labels(labels), histogram.count,
+                         histogram.sum / histogram.count if histogram.count else 0.0, histogram.quantile(0.5), histogram.quantile(0.99)))
+        for (name, labels), value in sorted(self.counters.items()):
+            lines.append('{}{} {}'.format(name, _labels(labels), value))
+        for name in sorted(self.gauges):
+            for labels, value in self._read_gauge(name):
+                lines.append('{}{} {}'.format(name, _labels(labels), value))
+        return lines
+
+    def _header(self, lines, name, kind):
+        if name in self.help:
+            lines.append('# HELP {} {}'.format(name, self.help[name]))
+        lines.append('# TYPE {} {}'.format(name, kind))
+
+    def _read_gauge(self, name):
+        try:
+            value = self.gauges[name]()
+        except Exception:
+            logger.exception("Reading gauge %s failed", name)
+            return []
+        if isinstance(value, dict):
+            return sorted(value.items())
+        return [((), value)]
+
+
+def _labels(labels):
+    """Format label pairs the Prometheus way. Ex: {command="register"}"""
+
+    if not labels:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(key, str(value).replace("\\", "\\\\").replace('"', '\\"')) for key, value in labels) + "}"
+
+async def serve(metrics : Metrics, host = "127.0.0.1", port = 9108):
+    """Serve the metrics over HTTP (any path) for a Prometheus scraper or curl
+
+    Returns:
+        asyncio.AbstractServer: the running server
+    """
+
+    async def handle(reader, writer):
+        try:
+            await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout=5) # the request itself doesn't matter
+            body = metrics.render().encode()
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\nContent-Length: " + str(len(body)).encode()
+                         + b"\r\nConnection: close\r\n\r\n" + body)
+            await writer.drain()
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, host, port)
+    logger.info("Serving metrics on http://%s:%s/metrics", host, port)
+    return server
+
+async def log_periodically(metrics : Metrics, interval : float):
+    """Write a snapshot of the metrics to the log every `interval` seconds, forever
+
+    The snapshots are logged at INFO even when LOG_LEVEL is higher, since asking for them is asking to see them.
+    """
+
+    snapshot_logger.setLevel(logging.INFO)
+    while True:
+        await asyncio.sleep(interval)
+        snapshot_logger.info("Metrics:\n    %s", "\n    ".join(metrics.snapshot()))
@@ -0,0 +1,121 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+# The base schema of GT.sql, created in a new (empty) database before the migrations. It must never change, only the
+# migrations below change the schema. IF NOT EXISTS so running it on a database that already has it does nothing
+BASE_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS courses (dept TEXT NOT NULL, course TEXT NOT NULL, topic TEXT NOT NULL DEFAULT 0, title TEXT NOT NULL,
+        special INTEGER DEFAULT 0, PRIMARY KEY (dept ASC, course ASC, topic ASC))""",
+    """CREATE TABLE IF NOT EXISTS registrar (category_id INTEGER PRIMARY KEY, year TEXT NOT NULL, semester TEXT NOT NULL, semester_sort TEXT NOT NULL,
+        dept TEXT NOT NULL, course TEXT NOT NULL, topic TEXT NOT NULL DEFAULT 0, FOREIGN KEY(dept) REFERENCES courses(dept),
+        FOREIGN KEY(course) REFERENCES courses(course), FOREIGN KEY(topic) REFERENCES courses(topic))""",
+    """CREATE TABLE IF NOT EXISTS schedule (id INTEGER PRIMARY KEY, user INTEGER NOT NULL, username TEXT NOT NULL, category_id INTEGER NOT NULL,
+        hidden INTEGER DEFAULT 0, FOREIGN KEY (category_id) REFERENCES registrar(category_id))""",
+    """CREATE TABLE IF NOT EXISTS requests (dept TEXT NOT NULL, course TEXT NOT NULL, topic TEXT NOT NULL, year TEXT NOT NULL, semester TEXT NOT NULL,
+        user INTEGER NOT NULL, username TEXT NOT NULL, FOREIGN KEY(dept) REFERENCES courses(dept), FOREIGN KEY(course) REFERENCES courses(course),
+        FOREIGN KEY(topic) REFERENCES courses(topic))""",
+]
+
+# Every change to the database schema made after GT.sql, in order. Each one is (version, description, statements).
+# The version that has been applied is stored in the database itself (PRAGMA user_version), so each migration runs
+# exactly once. Never edit or reorder a migration that has been released, only add new ones to the end.
+MIGRATIONS = [
+    (1, "indexes for the hot lookups", [
+        # registrar and requests are looked up by course offering (see queries.get_courses_available and get_courses_requested)
+        "CREATE INDEX IF NOT EXISTS registrar_offering ON registrar (dept, course, topic, year, semester)",
+        # the trailing user column also covers deleting a single request (see queries.clear_request)
+        "CREATE INDEX IF NOT EXISTS requests_offering ON requests (dept, course, topic, year, semester, user)",
+    ]),
+    (2, "one schedule row per user and course", [
+        # keep the first of any duplicate joins so the unique index can be created
+        "DELETE FROM schedule WHERE id NOT IN (SELECT MIN(id) FROM schedule GROUP BY user, category_id)",
+        # also serves as the index for looking up a user's schedule
+        "CREATE UNIQUE INDEX IF NOT EXISTS schedule_user_category ON schedule (user, category_id)",
+    ]),
+    (3, "numeric semester keys (see Semester.sort_key)", [
+        "ALTER TABLE registrar ADD COLUMN semester_key INTEGER NOT NULL DEFAULT 0",
+        "ALTER TABLE requests ADD COLUMN semester_key INTEGER NOT NULL DEFAULT 0",
+        "UPDATE registrar SET semester_key = CAST(year AS INTEGER) * 10 + CASE semester WHEN 'Spring' THEN 1 WHEN 'Summer' THEN 2 WHEN 'Fall' THEN 3 ELSE 0 END",
+        "UPDATE requests SET semester_key = CAST(year AS INTEGER) * 10 + CASE semester WHEN 'Spring' THEN 1 WHEN 'Summer' THEN 2 WHEN 'Fall' THEN 3 ELSE 0 END",
+        "CREATE INDEX IF NOT EXISTS registrar_semester_key ON registrar (semester_key)",
+        "CREATE INDEX IF NOT EXISTS requests_semester_key ON requests (semester_key)",
+    ]),
+    (4, "index the schedule by course offering", [
+        # for finding and removing everyone in a course (see queries.delete_course_registrations)
+        "CREATE INDEX IF NOT EXISTS schedule_category ON schedule (category_id)",
+    ]),
+    (5, "archive tables for past semesters and stored settings (see rollover.py)", [
+        """CREATE TABLE IF NOT EXISTS registrar_archive (category_id INTEGER PRIMARY KEY, year TEXT NOT NULL, semester TEXT NOT NULL,
+            semester_sort TEXT NOT NULL, dept TEXT NOT NULL, course TEXT NOT NULL, topic TEXT NOT NULL DEFAULT 0, semester_key INTEGER NOT NULL DEFAULT 0)""",
+        """CREATE TABLE IF NOT EXISTS schedule_archive (id INTEGER PRIMARY KEY, user INTEGER NOT NULL, username TEXT NOT NULL,
+            category_id INTEGER NOT NULL, hidden INTEGER DEFAULT 0)""",
+        """CREATE TABLE IF NOT EXISTS requests_archive (dept TEXT NOT NULL, course TEXT NOT NULL, topic TEXT NOT NULL, year TEXT NOT NULL,
+            semester TEXT NOT NULL, user INTEGER NOT NULL, username TEXT NOT NULL, semester_key INTEGER NOT NULL DEFAULT 0)""",
+        "CREATE INDEX IF NOT EXISTS registrar_archive_semester_key ON registrar_archive (semester_key)",
+        "CREATE INDEX IF NOT EXISTS schedule_archive_user ON schedule_archive (user)",
+        # name -> value, ie the current semester once !rollover has moved it on from the environment
+        "CREATE TABLE IF NOT EXISTS settings (name TEXT PRIMARY KEY, value TEXT NOT NULL)",
+    ]),
+    (6, "the guild each course category is in (see OVERFLOW_GUILDS)", [
+        # NULL for the categories created before, which are all in the guild the database belongs to (reconcile.py fills them in)
+        "ALTER TABLE registrar ADD COLUMN guild_id INTEGER",
+        "ALTER TABLE registrar_archive ADD COLUMN guild_id INTEGER",
+        # for finding a member's courses in a guild when they join it
+        "CREATE INDEX IF NOT EXISTS registrar_guild ON registrar (guild_id)",
+    ]),
+    (7, "when each request was made, so old ones can expire (see REQUEST_MAX_AGE_DAYS)", [
+        # unix time. The requests made before this are treated as made now, so none of them expire straight away
+        "ALTER TABLE requests ADD COLUMN requested_at INTEGER NOT NULL DEFAULT 0",
+        "ALTER TABLE requests_archive ADD COLUMN requested_at INTEGER NOT NULL DEFAULT 0",
+        "UPDATE requests SET requested_at = CAST(strftime('%s', 'now') AS INTEGER)",
+        "CREATE INDEX IF NOT EXISTS requests_requested_at ON requests (requested_at)",
+        # for removing everything of a member who left (see queries.delete_member_requests)
+        "CREATE INDEX IF NOT EXISTS requests_user ON requests (user)",
+    ]),
+]
+
+def get_version(conn):
+    """Get the schema version of the database"""
+
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def migrate(conn):
+    """Apply every migration the database hasn't had yet. Each migration is applied in its own transaction
+
+    Returns:
+        int: the schema version of the database afterwards
+    """
+
+    version = get_version(conn)
+
+    if version == 0: # a new database, or one made from GT.sql
+        conn.execute("BEGIN")
+        try:
+            for sql in BASE_SCHEMA:
+                conn.execute(sql)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            logger.exception("Creating the base schema failed")
+            raise
+
+    for migration_version, description, statements in MIGRATIONS:
+        if migration_version <= version:
+            continue
+
+        logger.info("Applying database migration %d: %s", migration_version, description)
+        conn.execute("BEGIN")
+        try:
+            for sql in statements:
+                conn.execute(sql)
+            conn.execute("PRAGMA user_version = " + str(migration_version)) # pragmas can't take bound parameters
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            logger.exception("Database migration %d failed", migration_version)
+            raise
+
+        version = migration_version
+
+    return version
@@ -0,0 +1,328 @@
+"""All the queries the bot runs against the database
+
+Every function takes the sqlite3 connection as its first argument so it can be run on the database thread
+(see database.Database.run) or queued on a database.Transaction. The SQL text is constant and every value is a
+bound parameter, so sqlite3's statement cache reuses the compiled statements and quotes in titles or display
+names can't break a query. None of the functions commit.
+"""
+
+import logging, time
+from enum import Enum
+from course import Course
+
+logger = logging.getLogger(__name__)
+
+# Column positions of each table
+Courses_Columns = Enum('Courses_Columns', ['dept', 'course', 'topic', 'title', 'special'], start=0)
+Registrar_Columns = Enum('Registrar_Columns', ['category', 'year', 'semester', 'semester_sort', 'dept', 'course', 'topic', 'semester_key', 'guild'], start=0)
+Requests_Columns = Enum('Requests_Columns', ['dept', 'course', 'topic', 'year', 'semester', 'user', 'username', 'semester_key', 'requested_at'], start=0)
+Schedule_Columns = Enum('Schedule_Columns', ['id', 'user', 'username', 'category', 'hidden'], start=0)
+
+# The most course offerings to look up in a single query (5 parameters each, sqlite allows 999 per query)
+LOOKUP_CHUNK_SIZE = 150
+
+SQL_GET_ALL_COURSES = "SELECT dept, course, topic, title, special FROM courses"
+SQL_CREATE_COURSE = "INSERT INTO courses (dept, course, topic, title, special) VALUES (?, ?, ?, ?, ?)"
+# The batched lookups join the wanted registration keys against the table so each key can be found through an index
+SQL_LOOKUP_KEYS = "(VALUES {}) AS wanted"
+SQL_LOOKUP_ON = " ON {0}.dept=wanted.column1 AND {0}.course=wanted.column2 AND {0}.topic=wanted.column3 AND {0}.year=wanted.column4 AND {0}.semester=wanted.column5"
+SQL_GET_COURSES_AVAILABLE = "SELECT registrar.* FROM " + SQL_LOOKUP_KEYS + " JOIN registrar" + SQL_LOOKUP_ON.format("registrar")
+SQL_GET_COURSES_REQUESTED = "SELECT requests.* FROM " + SQL_LOOKUP_KEYS + " JOIN requests" + SQL_LOOKUP_ON.format("requests") + " ORDER BY requests.rowid"
+SQL_CREATE_COURSE_REGISTRATION = "INSERT INTO registrar (category_id, year, semester, semester_sort, dept, course, topic, semester_key, guild_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+SQL_JOIN_COURSE = "INSERT OR IGNORE INTO schedule (user, username, category_id) VALUES (?, ?, ?)"
+SQL_REQUEST_COURSE = "INSERT INTO requests (dept, course, topic, year, semester, user, username, semester_key, requested_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+SQL_CLEAR_REQUEST = "DELETE FROM requests WHERE dept=? AND course=? AND topic=? AND year=? AND semester=? AND user=?"
+SQL_GET_REGISTRAR = "SELECT category_id, dept, course, topic, year, semester, guild_id FROM registrar"
+SQL_SET_REGISTRATION_GUILD = "UPDATE registrar SET guild_id=? WHERE category_id=?"
+SQL_GET_MEMBER_COURSES_IN_GUILD = """SELECT schedule.category_id FROM schedule JOIN registrar ON registrar.category_id=schedule.category_id
+    WHERE schedule.user=? AND registrar.guild_id=? AND NOT schedule.hidden"""
+SQL_GET_SCHEDULE = "SELECT user, category_id, hidden FROM schedule"
+SQL_DELETE_REGISTRATION = "DELETE FROM registrar WHERE category_id=?"
+SQL_DELETE_REGISTRATION_SCHEDULE = "DELETE FROM schedule WHERE category_id=?"
+# A user's courses, through the schedule's (user, category_id) index and the registrar's and catalog's primary keys
+SQL_GET_MEMBER_SCHEDULE = """SELECT registrar.category_id, registrar.dept, registrar.course, registrar.topic, registrar.year, registrar.semester,
+    registrar.guild_id, schedule.hidden, courses.title FROM schedule
+    JOIN registrar ON registrar.category_id=schedule.category_id
+    LEFT JOIN courses ON courses.dept=registrar.dept AND courses.course=registrar.course AND courses.topic=registrar.topic
+    WHERE schedule.user=? ORDER BY registrar.semester_key, registrar.dept, registrar.course, registrar.topic"""
+SQL_SET_HIDDEN = "UPDATE schedule SET hidden=? WHERE user=? AND category_id=?"
+SQL_LEAVE_COURSE = "DELETE FROM schedule WHERE user=? AND category_id=?"
+SQL_DELETE_MEMBER_REQUESTS = "DELETE FROM requests WHERE user=?"
+SQL_DELETE_MEMBER_SCHEDULE = "DELETE FROM schedule WHERE user=? AND category_id IN (SELECT category_id FROM registrar WHERE guild_id=? OR (guild_id IS NULL AND ?))"
+SQL_EXPIRE_REQUESTS = "DELETE FROM requests WHERE requested_at < ?"
+SQL_GET_SETTING = "SELECT value FROM settings WHERE name=?"
+SQL_SET_SETTING = "INSERT OR REPLACE INTO settings (name, value) VALUES (?, ?)"
+
+
+def _lookup_sql(template : str, count : int):
+    """Fill in the VALUES list of a batched lookup with placeholders for the given number of registration keys"""
+
+    return template.replace("{}", ", ".join(["(?, ?, ?, ?, ?)"] * count), 1)
+
+def _lookup(conn, template : str, courses):
+    """Run a batched lookup for the registration key of each course (see Course.get_registration_key)
+
+    Yields:
+        tuple: every row returned
+    """
+
+    keys = list({course.get_registration_key() for course in courses}) # each offering only needs looking up once
+
+    for i in range(0, len(keys), LOOKUP_CHUNK_SIZE):
+        chunk = keys[i:i + LOOKUP_CHUNK_SIZE]
+        sql = _lookup_sql(template, len(chunk))
+        logger.debug("lookup query: \"%s\" for %d courses", sql, len(chunk))
+        yield from conn.execute(sql, [value for key in chunk for value in key])
+
+def get_all_courses(conn):
+    """Get every course in the catalog
+
+    Returns:
+        list: (dept, course, topic, title, special) rows
+    """
+    return conn.execute(SQL_GET_ALL_COURSES).fetchall()
+
+def create_course(conn, course : Course):
+    """Create a course
+
+    Args:
+        conn (sqlite3.Connection): the database connection
+        course (Course): the course, with its title set
+    """
+
+    # if the topic is not "0", then it is a special topics course
+    special = 1 if course.topic != "0" else 0
+    conn.execute(SQL_CREATE_COURSE, (course.dept, course.code, course.topic, course.title, special))
+
+def get_courses_available(conn, courses):
+    """Find which of the courses are available (ie "already exist") in a single pass
+
+    Args:
+        conn (sqlite3.Connection): the database connection
+        courses (list): the Course objects to look up. The year and semester of each course are used
+
+    Returns:
+        dict: registration key (see Course.get_registration_key) -> (Discord category ID, guild ID or None if it isn't known), for every available course
+    """
+
+    available = {}
+    for row in _lookup(conn, SQL_GET_COURSES_AVAILABLE, courses):
+        key = (row[Registrar_Columns.dept.value], row[Registrar_Columns.course.value], str(row[Registrar_Columns.topic.value]),
+               row[Registrar_Columns.year.value], row[Registrar_Columns.semester.value])
+        available.setdefault(key, (row[Registrar_Columns.category.value], row[Registrar_Columns.guild.value])) # keep the first match if there are several
+    return available
+
+def get_courses_requested(conn, courses):
+    """Find which of the courses are in the requested list (already been requested) in a single pass
+
+    Args:
+        conn (sqlite3.Connection): the database connection
+        courses (list): the Course objects to look up. The year and semester of each course are used
+
+    Returns:
+        dict: registration key (see Course.get_registration_key) -> list of requests rows, in the order they were requested
+    """
+
+    requested = {}
+    for row in _lookup(conn, SQL_GET_COURSES_REQUESTED, courses):
+        key = (row[Requests_Columns.dept.value], row[Requests_Columns.course.value], str(row[Requests_Columns.topic.value]),
+               row[Requests_Columns.year.value], row[Requests_Columns.semester.value])
+        requested.setdefault(key, []).append(row)
+    return requested
+
+def create_course_registration(conn, course : Course, category_id, guild_id):
+    """Create a specific instance of a course
+
+    Args:
+        conn (sqlite3.Connection): the database connection
+        course (Course): the course. The year and semester of the course are used
+        category_id (int): the Discord category ID
+        guild_id (int): the Discord ID of the guild the category is in
+    """
+
+    conn.execute(SQL_CREATE_COURSE_REGISTRATION, (category_id, course.semester.year, course.semester.semester, course.semester.semester_sort,
+                                                  course.dept, course.code, course.topic, course.semester.sort_key, guild_id))
+
+def join_course(conn, user, username, category_id):
+    """Add a user to a course. Does nothing if they are already in it (schedule is unique on user and category)
+
+    Args:
+        conn (sqlite3.Connection): the database connection
+        user (integer): the Discord user unique ID
+        username (string): the user's display name
+        category_id (integer): the Discord category unique ID
+    """
+
+    conn.execute(SQL_JOIN_COURSE, (user, username, category_id))
+
+def request_course(conn, course : Course, user, username):
+    """Create a course request
+
+    Args:
+        conn (sqlite3.Connection): the database connection
+        course (Course): the course. The year and semester of the course are used
+        user (integer): Discord ID of the requesting user
+        username (string): the user's display name
+    """
+
+    conn.execute(SQL_REQUEST_COURSE, course.get_registration_key() + (user, username, course.semester.sort_key, int(time.time())))
+
+def clear_request(conn, course : Course, user):
+    """Delete a course request
+
+    Args:
+        conn (sqlite3.Connection): the database connection
+        course (Course): the course. The year and semester of the course are used
+        user (integer): Discord ID of the requesting user
+    """
+
+    conn.execute(SQL_CLEAR_REQUEST, course.get_registration_key() + (user,))
+
+def get_registrar(conn):
+    """Get every course offering
+
+    Returns:
+        list: (category_id, dept, course, topic, year, semester, guild_id) rows
+    """
+    return conn.execute(SQL_GET_REGISTRAR).fetchall()
+
+def get_schedule(conn):
+    """Get every user's courses
+
+    Returns:
+        list: (user, category_id, hidden) rows
+    """
+    return conn.execute(SQL_GET_SCHEDULE).fetchall()
+
+def create_course_registrations(conn, rows):
+    """Create many course offerings at once
+
+    Args:
+        conn (sqlite3.Connection): the database connection
+        rows (list): (category_id, year, semester, semester_sort, dept, course, topic, semester_key, guild_id) of each offering
+    """
+
+    conn.executemany(SQL_CREATE_COURSE_REGISTRATION, rows)
+
+def set_registration_guilds(conn, rows):
+    """Record which guild many course offerings are in
+
+    Args:
+        conn (sqlite3.Connection): the database connection
+        rows (list): (guild_id, category_id) of each offering
+    """
+
+    conn.executemany(SQL_SET_REGISTRATION_GUILD, rows)
+
+def get_member_courses_in_guild(conn, user, guild_id):
+    """Get the courses a user is in (and hasn't hidden) whose categories are in a guild
+
+    Returns:
+        list: the Discord category IDs
+    """
+
+    return [row[0] for row in conn.execute(SQL_GET_MEMBER_COURSES_IN_GUILD, (user, guild_id))]
+
+def join_courses(conn, rows):
+    """Add many users to courses at once. Users already in a course are skipped
+
+    Args:
+        conn (sqlite3.Connection): the database connection
+        rows (list): (user, username, category_id) of each user and course
+    """
+
+    conn.executemany(SQL_JOIN_COURSE, rows)
+
+def delete_course_registrations(conn, category_ids):
+    """Delete course offerings and everyone's membership in them
+
+    Args:
+        conn (sqlite3.Connection): the database connection
+        category_ids (list): the Discord category ID of each offering
+    """
+
+    params = [(category_id,) for category_id in category_ids]
+    conn.executemany(SQL_DELETE_REGISTRATION_SCHEDULE, params)
+    conn.executemany(SQL_DELETE_REGISTRATION, params)
+
+def get_member_schedule(conn, user):
+    """Get every course a user is in
+
+    Returns:
+        list: (category_id, dept, course, topic, year, semester, guild_id, hidden, title) rows, in semester and course order
+    """
+
+    return conn.execute(SQL_GET_MEMBER_SCHEDULE, (user,)).fetchall()
+
+def set_courses_hidden(conn, user, category_ids, hidden : bool):
+    """Hide or show many of a user's courses at once
+
+    Args:
+        conn (sqlite3.Connection): the database connection
+        user (integer): the Discord user unique ID
+        category_ids (list): the Discord category IDs of the courses
+        hidden (bool): True to hide them, False to show them
+    """
+
+    conn.executemany(SQL_SET_HIDDEN, [(1 if hidden else 0, user, category_id) for category_id in category_ids])
+
+def leave_courses(conn, user, category_ids):
+    """Remove a user from many courses at once
+
+    Args:
+        conn (sqlite3.Connection): the database connection
+        user (integer): the Discord user unique ID
+        category_ids (list): the Discord category IDs of the courses
+    """
+
+    conn.executemany(SQL_LEAVE_COURSE, [(user, category_id) for category_id in category_ids])
+
+def delete_member_requests(conn, users):
+    """Delete every pending request made by any of the users
+
+    Args:
+        conn (sqlite3.Connection): the database connection
+        users (list): the Discord user IDs
+    """
+
+    conn.executemany(SQL_DELETE_MEMBER_REQUESTS, [(user,) for user in users])
+
+def delete_member_schedules(conn, rows, home_guild_id = None):
+    """Remove users from every course in a guild
+
+    Args:
+        conn (sqlite3.Connection): the database connection
+        rows (list): (user, guild_id) of each user and the guild they left
+        home_guild_id (int): optional. The guild the courses from before guilds were recorded are in (see GuildStates.get_home_guild).
+                             Without it nobody is removed from those
+    """
+
+    conn.executemany(SQL_DELETE_MEMBER_SCHEDULE, [(user, guild_id, guild_id == home_guild_id) for user, guild_id in rows])
+
+def expire_requests(conn, older_than : int):
+    """Delete the requests made before a time
+
+    Args:
+        conn (sqlite3.Connection): the database connection
+        older_than (int): unix time
+
+    Returns:
+        int: the number of requests deleted
+    """
+
+    return conn.execute(SQL_EXPIRE_REQUESTS, (older_than,)).rowcount
+
+def get_setting(conn, name : str):
+    """Get a stored setting
+
+    Returns:
+        string: the value, or None if it has never been set
+    """
+
+    row = conn.execute(SQL_GET_SETTING, (name,)).fetchone()
+    return row[0] if row is not None else None
+
+def set_setting(conn, name : str, value : str):
+    """Store a setting, replacing any previous value"""
+
+    conn.execute(SQL_SET_SETTING, (name, value))
@@ -0,0 +1,171 @@
+"""Bring the registrar and schedule tables back in sync with the course categories in the guilds
+
+The categories (and who can see them) are what people actually use, so they are treated as the truth for which
+course offerings exist and who is in them:
+    - a course category with no registrar row gets one (its topic is found from the catalog by its title)
+    - a registrar row whose category no longer exists in its guild is removed, along with its schedule rows. Rows of
+      guilds that weren't reconciled (ie other shards' guilds using the same database) are left alone
+    - a member with view permission on a course category but no schedule row gets one
+    - a schedule row (that isn't hidden) for a member still in the guild but without view permission gets it back
+Everything is read once up front, the database fixes are applied in one transaction and the permission fixes go
+through the action queue, which sends each member's only once however often it changes before it goes out.
+"""
+
+import logging, re
+import discord
+from semester import Semester, SEMESTERS
+import queries
+
+logger = logging.getLogger(__name__)
+
+# A category name made by Course.get_category_name. Ex: AE 8803 (Sp'22) - Nonlinear Control Systems
+CATEGORY_NAME_PATTERN = re.compile(r"([A-Z]+) (\d+) \((F|Sp|Su)'(\d{2})\) - (.*)", re.DOTALL)
+
+# Expand the short semester names used in category names
+SEMESTER_SHORT_NAMES = {semester_short: semester for semester, (semester_short, _) in SEMESTERS.items()}
+
+def parse_category_name(name : str):
+    """Parse the name of a course category
+
+    Returns:
+        tuple: (dept, code, Semester, title), or None if the name isn't one made by Course.get_category_name
+    """
+
+    match = CATEGORY_NAME_PATTERN.fullmatch(name)
+    if match is None:
+        return None
+
+    dept, code, semester_short, year_short, title = match.groups()
+    return (dept, code, Semester("20" + year_short, SEMESTER_SHORT_NAMES[semester_short]), title)
+
+def find_topic(catalog, dept : str, code : str, title : str):
+    """Find the topic of a course from the title in its category name
+
+    Returns:
+        str: the topic ("0" if the course isn't special topics), or None if no known course matches
+    """
+
+    topics = catalog.get_topics(dept, code)
+    if len(topics) == 1:
+        return next(iter(topics))
+
+    # Discord cuts category names off at 100 characters, so the title in the name can be a prefix of the real one
+    matches = [topic for topic in topics if title and catalog.courses[(dept, code, topic)].startswith(title)]
+    return matches[0] if len(matches) == 1 else None
+
+def get_course_categories(guilds, catalog, since = None):
+    """Find every course category in the guilds
+
+    Args:
+        guilds (list): every guild the bot is in
+        catalog (Catalog): the course catalog
+        since (Semester): optional. Categories from semesters before this one are left out (see rollover.py)
+
+    Returns:
+        tuple: ({category ID: (category, registration key)} of the recognized ones, [names of the ones that look like
+               a course but couldn't be matched to one in the catalog])
+    """
+
+    categories = {}
+    unrecognized = []
+    for guild in guilds:
+        for category in guild.categories:
+            parsed = parse_category_name(category.name)
+            if parsed is None:
+                continue
+
+            dept, code, semester, title = parsed
+            if since is not None and semester < since:
+                continue
+            topic = find_topic(catalog, dept, code, title)
+            if topic is None:
+                unrecognized.append(category.name)
+                continue
+            categories[category.id] = (category, (dept, code, topic, semester.year, semester.semester))
+    return categories, unrecognized
+
+
+class Reconciliation:
+    """The fixes that bring the database back in sync with the guilds"""
+
+    def __init__(self):
+        self.registrations = [] # registrar rows to create (see queries.create_course_registrations)
+        self.guilds = [] # (guild ID, category ID) of registrar rows missing the guild their category is in
+        self.removed_categories = [] # registrar category IDs whose category no longer exists
+        self.joins = [] # schedule rows to create: (user, username, category_id)
+        self.permissions = [] # (category, member) missing view permission for a course they're in
+        self.unrecognized = [] # names of course categories that couldn't be matched to the catalog
+
+    def __len__(self):
+        return len(self.registrations) + len(self.removed_categories) + len(self.guilds) + len(self.joins) + len(self.permissions)
+
+    def __str__(self):
+        return '{} registrations created, {} removed, {} given their guild, {} schedule rows created, {} permissions restored, {} categories not recognized'.format(
+            len(self.registrations), len(self.removed_categories), len(self.guilds), len(self.joins), len(self.permissions), len(self.unrecognized))
+
+    def apply(self, conn):
+        """Make the database fixes. Runs on the database thread, inside a single transaction"""
+
+        with conn:
+            queries.delete_course_registrations(conn, self.removed_categories)
+            queries.create_course_registrations(conn, self.registrations)
+            queries.set_registration_guilds(conn, self.guilds)
+            queries.join_courses(conn, self.joins)
+
+
+def reconcile(guilds, categories, registrar_rows, schedule_rows, home_guild_id = None):
+    """Work out what needs fixing
+
+    Args:
+        guilds (list): the guilds being reconciled
+        categories (dict): the recognized course categories (see get_course_categories)
+        registrar_rows (list): (category_id, dept, course, topic, year, semester, guild_id) rows, see queries.get_registrar
+        schedule_rows (list): (user, category_id, hidden) rows, see queries.get_schedule
+        home_guild_id (int): optional. The guild the registrar rows without a guild ID belong to (see GuildStates.get_home_guild).
+                             Without it those rows are never removed
+
+    Returns:
+        Reconciliation: the fixes
+    """
+
+    result = Reconciliation()
+
+    # Registrar: one row per course category
+    all_channels = {channel.id: guild.id for guild in guilds for channel in guild.categories}
+    guild_ids = {guild.id for guild in guilds}
+    registered = set()
+    for category_id, *_, guild_id in registrar_rows:
+        if category_id in all_channels:
+            registered.add(category_id)
+            if guild_id != all_channels[category_id]:
+                result.guilds.append((all_channels[category_id], category_id))
+        elif (guild_id if guild_id is not None else home_guild_id) in guild_ids: # only a guild that was read can say its category is gone
+            result.removed_categories.append(category_id)
+
+    for category_id, (category, (dept, code, topic, year, semester_name)) in categories.items():
+        if category_id not in registered:
+            semester = Semester(year, semester_name)
+            result.registrations.append((category_id, year, semester_name, semester.semester_sort, dept, code, topic, semester.sort_key, category.guild.id))
+
+    # Schedule: the members who can see each course category
+    scheduled = {} # category ID -> {user ID: hidden}
+    for user, category_id, hidden in schedule_rows:
+        scheduled.setdefault(category_id, {})[user] = hidden
+
+    for category_id, (category, _) in categories.items():
+        members = scheduled.get(category_id, {})
+        can_view = set()
+        for target, overwrite in category.overwrites.items():
+            if isinstance(target, discord.Member) and overwrite.view_channel:
+                can_view.add(target.id)
+                if target.id not in members:
+                    result.joins.append((target.id, target.display_name, category_id))
+
+        for user, hidden in members.items():
+            if hidden or user in can_view:
+                continue
+            member = category.guild.get_member(user)
+            if member is not None: # someone who left the guild can't be given permissions
+                result.permissions.append((category, member))
+
+    return result
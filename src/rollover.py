@@ -0,0 +1,103 @@
+"""Move past semesters out of the way at the start of a new one
+
+The registrar, schedule and requests rows of every semester before the current one are moved into the archive
+tables (registrar_archive, schedule_archive and requests_archive) in a single transaction, which also expires the
+pending requests nobody else made in time. The old course categories and their channels are then deleted from the
+guild through the action queue, so the hot tables and the channel budget only hold the current and upcoming semesters.
+"""
+
+import logging
+from semester import Semester
+from course import SEMESTER_NAMES
+from reconcile import parse_category_name
+import queries
+
+logger = logging.getLogger(__name__)
+
+# The setting (see queries.get_setting) holding the sort key of the current semester once it has been rolled over
+CURRENT_SEMESTER_SETTING = "current_semester"
+
+SQL_COUNT_REGISTRAR = "SELECT COUNT(*) FROM registrar WHERE semester_key < ?"
+SQL_COUNT_SCHEDULE = "SELECT COUNT(*) FROM schedule WHERE category_id IN (SELECT category_id FROM registrar WHERE semester_key < ?)"
+SQL_COUNT_REQUESTS = "SELECT COUNT(*) FROM requests WHERE semester_key < ?"
+SQL_ARCHIVE_SCHEDULE = """INSERT OR REPLACE INTO schedule_archive (id, user, username, category_id, hidden)
+    SELECT id, user, username, category_id, hidden FROM schedule WHERE category_id IN (SELECT category_id FROM registrar WHERE semester_key < ?)"""
+SQL_ARCHIVE_REGISTRAR = """INSERT OR REPLACE INTO registrar_archive (category_id, year, semester, semester_sort, dept, course, topic, semester_key, guild_id)
+    SELECT category_id, year, semester, semester_sort, dept, course, topic, semester_key, guild_id FROM registrar WHERE semester_key < ?"""
+SQL_ARCHIVE_REQUESTS = """INSERT INTO requests_archive (dept, course, topic, year, semester, user, username, semester_key, requested_at)
+    SELECT dept, course, topic, year, semester, user, username, semester_key, requested_at FROM requests WHERE semester_key < ?"""
+SQL_DELETE_SCHEDULE = "DELETE FROM schedule WHERE category_id IN (SELECT category_id FROM registrar WHERE semester_key < ?)"
+SQL_DELETE_REGISTRAR = "DELETE FROM registrar WHERE semester_key < ?"
+SQL_DELETE_REQUESTS = "DELETE FROM requests WHERE semester_key < ?"
+
+class RolloverResult:
+    """The counts of what a rollover did"""
+
+    def __init__(self, semester : Semester):
+        self.semester = semester # the new current semester
+        self.registrations = 0 # course offerings archived
+        self.memberships = 0 # schedule rows archived
+        self.requests = 0 # pending requests expired
+        self.categories = 0 # course categories retired from the guilds
+
+    def __str__(self):
+        return '{} course groups ({} members) archived, {} pending requests expired, {} categories retired'.format(
+            self.registrations, self.memberships, self.requests, self.categories)
+
+def parse_semester(args):
+    """Parse a semester given to !rollover, with the same spellings a course string accepts. Ex: "Fall 2022", "sp 23", "F22"
+
+    Returns:
+        Semester: the semester, or None if it isn't one
+    """
+
+    text = "".join(args).upper()
+    year = text.lstrip("ABCDEFGHIJKLMNOPQRSTUVWXYZ")
+    semester = SEMESTER_NAMES.get(text[:len(text) - len(year)])
+    if semester is None or not year.isdigit() or len(year) not in (2, 4):
+        return None
+    return Semester(year if len(year) == 4 else "20" + year, semester)
+
+def archive_semesters(conn, semester : Semester, dry_run = False):
+    """Archive everything from before the given semester in a single transaction
+
+    Args:
+        conn (sqlite3.Connection): the database connection
+        semester (Semester): the current semester. Everything before it is archived
+        dry_run (bool): count what would be archived without changing anything
+
+    Returns:
+        RolloverResult: the counts of what was (or would be) archived
+    """
+
+    result = RolloverResult(semester)
+    key = (semester.sort_key,)
+
+    with conn: # all or nothing
+        result.registrations = conn.execute(SQL_COUNT_REGISTRAR, key).fetchone()[0]
+        result.memberships = conn.execute(SQL_COUNT_SCHEDULE, key).fetchone()[0]
+        result.requests = conn.execute(SQL_COUNT_REQUESTS, key).fetchone()[0]
+
+        if not dry_run:
+            # the schedule goes first, it finds its rows through the registrar
+            for sql in (SQL_ARCHIVE_SCHEDULE, SQL_DELETE_SCHEDULE, SQL_ARCHIVE_REGISTRAR, SQL_DELETE_REGISTRAR, SQL_ARCHIVE_REQUESTS, SQL_DELETE_REQUESTS):
+                conn.execute(sql, key)
+            queries.set_setting(conn, CURRENT_SEMESTER_SETTING, str(semester.sort_key))
+
+    logger.info("Rollover to %s %s%s: %s", semester.semester, semester.year, " (dry run)" if dry_run else "", result)
+    return result
+
+def get_retired_categories(guilds, semester : Semester):
+    """Find the course categories of every semester before the given one
+
+    Returns:
+        list: the categories, in the order they should be deleted
+    """
+
+    retired = []
+    for guild in guilds:
+        for category in guild.categories:
+            parsed = parse_category_name(category.name)
+            if parsed is not None and parsed[2] < semester:
+                retired.append(category)
+    return retired
@@ -1,58 +1,77 @@
+import functools
+
+# Short name and sort order of each semester, in the order they happen in a year
+SEMESTERS = {
+    "Spring": ("Sp", 1),
+    "Summer": ("Su", 2),
+    "Fall": ("F", 3),
+}
+
+@functools.total_ordering
 class Semester:
-    """A single semester"""
+    """A single semester
+
+    Semesters are interned: Semester(year, semester) always returns the same immutable instance for the same year
+    and semester, so every Course in a semester shares one object. Semesters sort in the order they happen.
+    """
+
+    __slots__ = ("semester", "year", "year_short", "semester_short", "semester_sort", "sort_key")
+
+    _interned = {} # (year, semester) -> Semester
+
+    def __new__(cls, year, semester):
+        key = (year, semester)
+        instance = cls._interned.get(key)
+        if instance is not None:
+            return instance
+
+        instance = super().__new__(cls)
+        semester_short, semester_sort = SEMESTERS.get(semester, ("", 0))
+        set_attribute = super(Semester, instance).__setattr__
+        set_attribute("semester", semester) # Ex: Fall
+        set_attribute("year", year) # Ex: 2021
+        set_attribute("year_short", year[2:4]) # Ex: 21
+        set_attribute("semester_short", semester_short) # Ex: F
+        set_attribute("semester_sort", semester_sort) # Ex: 3 (Spring=1, Summer=2, Fall=3)
+        set_attribute("sort_key", (int(year) if year.isdigit() else 0) * 10 + semester_sort) # Ex: 20213
 
-    def __init__(self, year, semester):
-        self.semester = semester
-        self.year = year
-        self.year_short = year[2:4]
-                
-        self.update_other_semeseter_parameters()
+        cls._interned[key] = instance
+        return instance
 
+    def __setattr__(self, name, value):
+        raise AttributeError("Semester is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("Semester is immutable")
+
+    def __reduce__(self):
+        return (Semester, (self.year, self.semester))
+
+    def __eq__(self, other):
+        if not isinstance(other, Semester):
+            return NotImplemented
+        return self is other
+
+    def __hash__(self):
+        return hash((self.year, self.semester))
+
+    def __lt__(self, other):
+        if not isinstance(other, Semester):
+            return NotImplemented
+        return self.sort_key < other.sort_key
 
     def __str__(self):
         return '{}{}'.format(self.semester_short, self.year_short)
 
-
     def __repr__(self):
         return '{}{}'.format(self.semester_short, self.year_short)
 
+    @staticmethod
+    def from_sort_key(sort_key : int):
+        """Get the semester with the given sort key (see Semester.sort_key)"""
 
-    def update_other_semeseter_parameters(self):
-        """Set the other parameters for the semester"""
-
-        if self.semester == "Spring":
-            self.semester_short = "Sp"
-            self.semester_sort = "1"
-        elif self.semester == "Summer":
-            self.semester_short = "Su"
-            self.semester_sort = "2"
-        elif self.semester == "Fall":
-            self.semester_short = "F"
-            self.semester_sort = "3"
-    
-
-    def update_year(self, year):
-        """Update the year. Automatically expands to 4 digit year as necessary"""
-        
-        if len(year) == 2:
-            self.year = "20"
-        self.year += year
-        self.year_short = self.year[2:4]
-
-
-    def update_semester(self, semester):
-        """"Update the semester. Automatically expands to full name if necessary"""
-
-        # if there is just 1 character, then it's likely fall.
-        if len(semester) == 1 and semester[0] == "F":
-            self.semester = "Fall"
-        # if there's 2 characters, then we'll need to determine if it's spring or summer
-        elif len(semester) == 2 and semester[0] == "S":
-            if semester[1] == "P":
-                self.semester = "Spring"
-            elif semester[1] == "U":
-                self.semester = "Summer"
-        
-        # Update the other parameters
-        self.update_other_semeseter_parameters()
-        
\ No newline at end of file
+        year, semester_sort = divmod(sort_key, 10)
+        for semester, (_, order) in SEMESTERS.items():
+            if order == semester_sort:
+                return Semester(str(year), semester)
+        raise ValueError("Not a semester sort key: " + str(sort_key))
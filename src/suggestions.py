@@ -0,0 +1,113 @@
+# The furthest (in edits) a course can be from what was typed and still be suggested
+MAX_DISTANCE = 2
+
+def edit_distance(a : str, b : str):
+    """The Levenshtein distance between two strings (insertions, deletions and substitutions)"""
+
+    if len(a) < len(b):
+        a, b = b, a
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        previous = current
+    return previous[-1]
+
+def deletes(text : str, distance : int):
+    """Every string that can be made by deleting characters from the text
+
+    Returns:
+        list: sets of the strings made by deleting exactly 0, 1, ... `distance` characters
+    """
+
+    variants = [{text}]
+    for _ in range(distance):
+        variants.append({variant[:i] + variant[i + 1:] for variant in variants[-1] for i in range(len(variant))})
+    return variants
+
+class SuggestionIndex:
+    """Finds the known courses that look most like a course that wasn't recognized
+
+    Every course (ie "AE1000") is indexed under each string that can be made by deleting up to MAX_DISTANCE of its
+    characters. Two strings within N edits of each other always share a string made by deleting at most N characters
+    from each, so a typo like "AE100" only has to be compared against the handful of courses it shares one with
+    instead of the whole catalog. The closest courses (1 edit) are looked for first, and further ones only if
+    there aren't enough of those.
+    Every special topics course also keeps its topics so a wrong topic can be matched to the right one. Courses are
+    added one at a time, so the index is kept up to date as !add creates them.
+    The number of deletion variants grows with the square of the text's length, so text longer than any course
+    could be within MAX_DISTANCE edits of is never expanded (a long pasted message would otherwise block the bot).
+    """
+
+    def __init__(self):
+        self.deletes = [{} for _ in range(MAX_DISTANCE + 1)] # for each number of deleted characters: variant -> set of (dept, code)
+        self.topics = {} # (dept, code) -> set of topics ("0" for a course that isn't special topics)
+        self.longest = 0 # length of the longest dept + code
+
+    def __len__(self):
+        return len(self.topics)
+
+    def add(self, dept : str, code : str, topic : str):
+        """Add a course to the index"""
+
+        course = (dept, code)
+        if course not in self.topics:
+            self.topics[course] = set()
+            self.longest = max(self.longest, len(dept + code))
+            for depth, variants in enumerate(deletes(dept + code, MAX_DISTANCE)):
+                for variant in variants:
+                    self.deletes[depth].setdefault(variant, set()).add(course)
+        self.topics[course].add(topic)
+
+    def suggest(self, text : str, topic = "0", limit = 3):
+        """Find the known courses closest to what was typed
+
+        Args:
+            text (str): the department and course code that was typed (ie "AE100"), uppercase without spaces
+            topic (str): the topic that was typed, "0" if none was
+            limit (int): the most suggestions to return
+
+        Returns:
+            list: (dept, code, topic) of the closest courses, closest first
+        """
+
+        if len(text) > self.longest + MAX_DISTANCE: # too far from every course
+            return []
+
+        text_variants = deletes(text, MAX_DISTANCE)
+        suggestions = []
+        checked = set()
+
+        # Look for courses 0 edits away, then 1, and so on until there are enough
+        for distance in range(MAX_DISTANCE + 1):
+            candidates = set()
+            for text_depth in range(distance + 1):
+                for course_depth in range(distance + 1):
+                    index = self.deletes[course_depth]
+                    for variant in text_variants[text_depth]:
+                        candidates |= index.get(variant, set())
+
+            # Keep the candidates that really are this many edits away
+            found = []
+            for dept, code in candidates - checked:
+                if abs(len(text) - len(dept) - len(code)) <= distance and edit_distance(text, dept + code) <= distance:
+                    found.append((dept, code))
+                    checked.add((dept, code))
+
+            for dept, code in sorted(found):
+                for known_topic in self._closest_topics(dept, code, topic):
+                    suggestions.append((dept, code, known_topic))
+
+            if len(suggestions) >= limit:
+                break
+
+        return suggestions[:limit]
+
+    def _closest_topics(self, dept : str, code : str, topic : str):
+        """The course's topics, those starting like the typed topic (or closest to it) first"""
+
+        known = self.topics[(dept, code)]
+        if topic in known:
+            return [topic]
+        return sorted(known, key=lambda known_topic: (not known_topic.startswith(topic[:1]), edit_distance(topic, known_topic), known_topic))
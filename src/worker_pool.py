@@ -0,0 +1,59 @@
+import asyncio, logging
+
+logger = logging.getLogger(__name__)
+
+class WorkerPool:
+    """Runs queued background work on the event loop with at most `concurrency` jobs running at once"""
+
+    def __init__(self, concurrency = 4):
+        self.concurrency = concurrency
+        self.queue = None # created on first use so it belongs to the running event loop
+        self.workers = []
+        self.running = 0
+
+    def depth(self):
+        """The number of jobs waiting for a free worker"""
+
+        return self.queue.qsize() if self.queue is not None else 0
+
+    def submit(self, function, *args):
+        """Queue function(*args) (a coroutine function) to run on the next free worker
+
+        Returns:
+            asyncio.Future: the result of the job
+        """
+
+        if self.queue is None:
+            self.queue = asyncio.Queue()
+            self.workers = [asyncio.ensure_future(self._work()) for _ in range(self.concurrency)]
+
+        future = asyncio.get_event_loop().create_future()
+        future.add_done_callback(lambda f: f.cancelled() or f.exception()) # failures are already logged by the worker
+        self.queue.put_nowait((function, args, future))
+        return future
+
+    async def _work(self):
+        while True:
+            function, args, future = await self.queue.get()
+            self.running += 1
+            try:
+                result = await function(*args)
+            except Exception as e:
+                logger.exception("Background job %s failed", getattr(function, "__name__", function))
+                if not future.cancelled():
+                    future.set_exception(e)
+            else:
+                if not future.cancelled():
+                    future.set_result(result)
+            finally:
+                self.running -= 1
+                self.queue.task_done()
+
+    async def close(self):
+        """Wait for every queued job to finish, then stop the workers"""
+
+        if self.queue is None:
+            return
+        await self.queue.join()
+        for worker in self.workers:
+            worker.cancel()